@@ -0,0 +1,103 @@
+"""Checkpoints for resumable pipeline runs.
+
+A run directory holds one pickle per completed step plus `manifest.json`,
+which records the completed steps, a fingerprint of the input CSVs and the
+upload watermarks (rows acknowledged so far per table/lab). Every write goes
+to a temp file and is renamed into place, so a crash never leaves a torn
+checkpoint behind. Steps may checkpoint from several threads at once.
+"""
+import json
+import os
+import pickle
+import shutil
+import threading
+
+
+def _atomic_write(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def fingerprint_inputs(paths: dict[str, str]) -> dict[str, list]:
+    """(size, mtime) of each input file, to detect changed CSVs between runs."""
+    fp = {}
+    for name, path in sorted(paths.items()):
+        if os.path.exists(path):
+            st = os.stat(path)
+            fp[name] = [st.st_size, int(st.st_mtime)]
+    return fp
+
+
+class RunCheckpoint:
+    def __init__(self, run_dir: str, resume: bool = False, inputs: dict | None = None):
+        self.run_dir = run_dir
+        self.manifest_path = os.path.join(run_dir, "manifest.json")
+        self._lock = threading.Lock()
+        inputs = inputs or {}
+
+        if not resume and os.path.exists(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir, exist_ok=True)
+
+        self.manifest = {"inputs": inputs, "completed": [], "watermarks": {}}
+        if resume and os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("inputs") != inputs:
+                raise ValueError(
+                    f"Input CSVs changed since the run in {run_dir} was checkpointed; "
+                    "start a fresh run (without --resume, --only or --from)"
+                )
+            self.manifest = saved
+        self._write_manifest()
+
+    def _write_manifest(self):
+        # Callers hold self._lock (except __init__)
+        _atomic_write(self.manifest_path, json.dumps(self.manifest, indent=2).encode("utf-8"))
+
+    def _step_path(self, step: str) -> str:
+        return os.path.join(self.run_dir, f"{step}.pkl")
+
+    def done(self, step: str) -> bool:
+        return step in self.manifest["completed"]
+
+    def save(self, step: str, result=None):
+        """Persist a step's output and mark it completed."""
+        _atomic_write(self._step_path(step), pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            if step not in self.manifest["completed"]:
+                self.manifest["completed"].append(step)
+            self._write_manifest()
+
+    def discard(self, step: str):
+        """Forget a step's output, its sub-markers (`<step>_...`) and watermarks (`<step>:...`)."""
+        with self._lock:
+            completed = self.manifest["completed"]
+            gone = [s for s in completed if s == step or s.startswith(step + "_")]
+            watermarks = [k for k in self.manifest["watermarks"] if k.startswith(step + ":")]
+            if not gone and not watermarks:
+                return
+            for s in gone:
+                completed.remove(s)
+                if os.path.exists(self._step_path(s)):
+                    os.remove(self._step_path(s))
+            for k in watermarks:
+                del self.manifest["watermarks"][k]
+            self._write_manifest()
+
+    def load(self, step: str):
+        with open(self._step_path(step), "rb") as f:
+            return pickle.load(f)
+
+    def watermark(self, key: str) -> int:
+        """Rows of `key` acknowledged by the database so far."""
+        return self.manifest["watermarks"].get(key, 0)
+
+    def set_watermark(self, key: str, rows: int):
+        with self._lock:
+            self.manifest["watermarks"][key] = rows
+            self._write_manifest()
@@ -6,6 +6,8 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
 SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
+# Direct Postgres connection string, only needed for --sink postgres
+DATABASE_URL = os.getenv("DATABASE_URL", "")
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)))
 
@@ -18,5 +20,16 @@ CSV_FILES = {
 }
 
 BATCH_SIZE = 500
+# Rows per keyset page when reading tables back; PostgREST caps responses at 1000
+READ_PAGE_SIZE = 1000
+CHECKPOINT_ROWS = 10000  # lab_tests rows per streamed chunk and upload watermark
+STREAM_QUEUE_CHUNKS = 3  # lab_tests chunks built ahead of the upload (bounds memory)
+SPILL_AT_FRACTION = 0.6  # with --max-memory, spill to disk past this share of the budget
+SPILL_BATCH_ROWS = 1000  # loaded tests per budget check and per Arrow record batch when spilling
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "8"))  # batch requests in flight
+UPLOAD_BATCH_BYTES = int(os.getenv("UPLOAD_BATCH_BYTES", "512000"))  # starting JSON bytes per batch, adapts per table
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "5"))  # on 408/429/5xx/transport errors
+UPLOAD_RATE_LIMIT = float(os.getenv("UPLOAD_RATE_LIMIT", "0"))  # requests/s across all tables, 0 = unlimited
 MATCH_THRESHOLD = 0.60
 HIGH_CONFIDENCE_THRESHOLD = 0.85
+PACKAGE_MATCH_THRESHOLD = 0.80  # composition Jaccard to treat packages as equivalent
@@ -1,41 +1,280 @@
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
-from pipeline.config import SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, BATCH_SIZE
+from pipeline.config import SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, BATCH_SIZE, READ_PAGE_SIZE, UPLOAD_RATE_LIMIT
+from pipeline.profiling import span
+from pipeline.quarantine import QuarantineReport
+from pipeline.telemetry import UploadTelemetry
+from pipeline.sinks.base_sink import BaseSink
+from pipeline.throttle import AdaptiveBatchSizer, TokenBucket
+from pipeline.uploader import AsyncUploader, UploadJob
+
+# Rows rejected by any write in this process, see write_quarantine()
+QUARANTINE = QuarantineReport()
+# Latency, volume and errors of every write in this process, see write_telemetry()
+TELEMETRY = UploadTelemetry()
+# Shared by every uploader so learned batch sizes and the rate limit span the whole run
+BATCH_SIZERS: dict[str, AdaptiveBatchSizer] = {}
+RATE_LIMITER = TokenBucket(UPLOAD_RATE_LIMIT)
+
+# Natural (business) key per table, matching the UNIQUE constraints in schema.sql
+NATURAL_KEYS = {
+    "labs": "slug",
+    "cities": "name,state",
+    "departments": "slug",
+    "lab_locations": "lab_id,location_code",
+    "canonical_tests": "slug",
+    "lab_tests": "lab_id,source_key,lab_location_id",
+    "lab_tests_staging": "lab_id,source_key,lab_location_id",
+    "test_aliases": "canonical_test_id,alias_lower",
+    "price_heatmap": "city_id,canonical_test_id",
+    "department_availability": "city_id,department_id,lab_id",
+}
 
 
 def get_client() -> Client:
     return create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
 
 
-def batch_upsert(client: Client, table: str, rows: list[dict], conflict_columns: str | None = None, batch_size: int = BATCH_SIZE):
-    """Upsert rows in batches. Returns total inserted count."""
-    total = 0
-    for i in range(0, len(rows), batch_size):
-        batch = rows[i:i + batch_size]
-        q = client.table(table).upsert(batch)
-        if conflict_columns:
-            q = client.table(table).upsert(batch, on_conflict=conflict_columns)
-        result = q.execute()
-        total += len(result.data) if result.data else 0
+def open_sink(kind: str, target: str, copy_format: str = "binary") -> BaseSink:
+    """Open a storage backend: "postgres" (target is a DSN), "sqlite" or "duckdb" (target is a file path)."""
+    if kind == "postgres":
+        from pipeline.sinks.postgres_sink import PostgresSink
+        return PostgresSink(target, copy_format)
+    if kind == "sqlite":
+        from pipeline.sinks.sqlite_sink import SQLiteSink
+        return SQLiteSink(target)
+    if kind == "duckdb":
+        from pipeline.sinks.duckdb_sink import DuckDBSink
+        return DuckDBSink(target)
+    raise ValueError(f"Unknown sink {kind!r}")
+
+
+def get_uploader(client: Client, batch_size: int = BATCH_SIZE, ignore_duplicates: bool = False) -> AsyncUploader:
+    return AsyncUploader.from_client(
+        client, batch_size=batch_size, quarantine=QUARANTINE, ignore_duplicates=ignore_duplicates,
+        telemetry=TELEMETRY, rate_limiter=RATE_LIMITER, sizers=BATCH_SIZERS,
+    )
+
+
+def _key_value(row: dict, column: str):
+    # Generated *_lower columns are not sent; derive them from the source column
+    if column.endswith("_lower") and column not in row:
+        value = row.get(column[:-len("_lower")])
+        return value.lower() if isinstance(value, str) else value
+    return row.get(column)
+
+
+def natural_key_of(table: str):
+    """Function returning a row's natural key tuple for table (see NATURAL_KEYS)."""
+    columns = NATURAL_KEYS[table].split(",")
+    return lambda row: tuple(_key_value(row, c) for c in columns)
+
+
+def dedupe_by_key(rows: list[dict], conflict_columns: str, collisions: list | None = None) -> list[dict]:
+    """Keep the last row per conflict key.
+
+    Postgres rejects an upsert batch that touches the same key twice, so
+    duplicates must be collapsed before sending. Earlier rows that differ
+    from the row replacing them are appended to `collisions` when given.
+    """
+    columns = conflict_columns.split(",")
+    by_key: dict[tuple, dict] = {}
+    for row in rows:
+        key = tuple(_key_value(row, c) for c in columns)
+        if collisions is not None and key in by_key and by_key[key] != row:
+            collisions.append(by_key[key])
+        by_key[key] = row
+    return list(by_key.values())
+
+
+def _sink_upsert(sink: BaseSink, table: str, rows: list[dict], conflict_columns: str | None = None,
+                 ignore_duplicates: bool = False) -> int:
+    """One sink write, recorded in TELEMETRY as a single request (payload bytes unknown)."""
+    started = time.monotonic()
+    try:
+        written = sink.upsert(table, rows, conflict_columns, ignore_duplicates)
+    except Exception as e:
+        TELEMETRY.record_request(table, 0, 0, started, time.monotonic() - started, "error", type(e).__name__, str(e))
+        raise
+    TELEMETRY.record_request(table, len(rows), 0, started, time.monotonic() - started, "ok")
+    return written
+
+
+def batch_upsert(
+    client: Client,
+    table: str,
+    rows: list[dict],
+    conflict_columns: str | None = None,
+    batch_size: int = BATCH_SIZE,
+    ignore_duplicates: bool = False,
+):
+    """Upsert rows in concurrent batches. Returns total written count."""
+    if isinstance(client, BaseSink):
+        with span(f"upsert {table}", "upload", rows=len(rows)):
+            return _sink_upsert(client, table, rows, conflict_columns, ignore_duplicates)
+    uploader = get_uploader(client, batch_size, ignore_duplicates)
+    with span(f"upsert {table}", "upload", rows=len(rows)):
+        total = uploader.upload(table, rows, conflict_columns)
+    for err in uploader.errors:
+        print(f"  Error: {err}")
     return total
 
 
 def batch_insert(client: Client, table: str, rows: list[dict], batch_size: int = BATCH_SIZE):
-    """Insert rows in batches, ignoring duplicates."""
-    total = 0
-    for i in range(0, len(rows), batch_size):
-        batch = rows[i:i + batch_size]
-        try:
-            result = client.table(table).insert(batch).execute()
-            total += len(result.data) if result.data else 0
-        except Exception as e:
-            if "duplicate" in str(e).lower() or "unique" in str(e).lower():
-                # Insert one by one to skip duplicates
-                for row in batch:
-                    try:
-                        result = client.table(table).insert(row).execute()
-                        total += 1
-                    except Exception:
-                        pass
-            else:
-                raise
+    """Insert rows in concurrent batches, quarantining rows the database rejects."""
+    if isinstance(client, BaseSink):
+        return _sink_upsert(client, table, rows)
+    uploader = get_uploader(client, batch_size)
+    total = uploader.upload(table, rows)
+    for err in uploader.errors:
+        print(f"  Error: {err}")
+    return total
+
+
+def upsert_natural(client: Client, table: str, rows: list[dict], ignore_duplicates: bool = False) -> int:
+    """Idempotently upsert rows on the table's natural key (see NATURAL_KEYS).
+
+    Reruns update rows in place instead of relying on duplicate errors.
+    """
+    conflict_columns = NATURAL_KEYS[table]
+    collisions = []
+    rows = dedupe_by_key(rows, conflict_columns, collisions)
+    if collisions and not ignore_duplicates:
+        print(f"  WARNING: {len(collisions)} {table} rows replaced by a later row with the same "
+              f"natural key ({conflict_columns}) and different values")
+    return batch_upsert(client, table, rows, conflict_columns, ignore_duplicates=ignore_duplicates)
+
+
+def upsert_natural_stream(client: Client, table: str, chunks, on_chunk=None) -> int:
+    """Upsert (tag, rows) chunks on the table's natural key as they arrive.
+
+    Pair with a BackgroundIterator so rows are built while earlier chunks
+    upload. Rows are not deduplicated across chunks: a key must appear at
+    most once in the whole stream. `on_chunk(tag, written)` is called in
+    chunk order once each chunk is acknowledged.
+    """
+    conflict_columns = NATURAL_KEYS[table]
+    if isinstance(client, BaseSink):
+        total = 0
+        for tag, rows in chunks:
+            with span(f"upsert {table} chunk", "upload", rows=len(rows)):
+                written = _sink_upsert(client, table, rows, conflict_columns)
+            total += written
+            if on_chunk:
+                on_chunk(tag, written)
+        return total
+    uploader = get_uploader(client)
+    with span(f"upsert {table} stream", "upload"):
+        total = uploader.upload_chunks(table, chunks, conflict_columns, on_chunk)
+    for err in uploader.errors:
+        print(f"  Error: {err}")
     return total
+
+
+def upload_stages(client: Client, stages: list[list[UploadJob]], batch_size: int = BATCH_SIZE) -> dict[str, int]:
+    """Upload several tables concurrently, stage by stage (see AsyncUploader)."""
+    if isinstance(client, BaseSink):
+        return {
+            table: _sink_upsert(client, table, rows, conflict_columns)
+            for stage in stages
+            for table, rows, conflict_columns in stage
+        }
+    uploader = get_uploader(client, batch_size)
+    with span("upload stages", "upload", tables=[job[0] for stage in stages for job in stage]):
+        totals = uploader.upload_stages(stages)
+    for err in uploader.errors:
+        print(f"  Error: {err}")
+    return totals
+
+
+def _select_page(client: Client | BaseSink, table: str, columns: str, key: str, after, limit: int) -> list[dict]:
+    if isinstance(client, BaseSink):
+        return client.select_page(table, columns, key, after, limit)
+    query = client.table(table).select(columns).order(key).limit(limit)
+    if after is not None:
+        query = query.gt(key, after)
+    return query.execute().data
+
+
+def stream_rows(
+    client: Client | BaseSink,
+    table: str,
+    columns: str,
+    key: str = "id",
+    page_size: int = READ_PAGE_SIZE,
+    prefetch: bool = True,
+) -> Iterator[dict]:
+    """Yield every row of a table, paging on `key` (WHERE key > last ORDER BY key).
+
+    Unlike offset paging each page is an index range scan, so late pages cost
+    the same as the first, and nothing is lost to the PostgREST row cap. With
+    prefetch the next page is requested while the caller consumes this one.
+    `key` must be unique and included in `columns`.
+    Only an empty page ends the stream: PostgREST's max-rows setting may cap
+    pages below page_size, so a short page is not proof of the last one.
+    """
+    if key not in (c.strip() for c in columns.split(",")):
+        raise ValueError(f"stream_rows: key column {key!r} must be selected from {table}")
+
+    def fetch(after) -> list[dict]:
+        return _select_page(client, table, columns, key, after, page_size)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        page = fetch(None)
+        while page:
+            after = page[-1][key]
+            ahead = pool.submit(fetch, after) if prefetch else None
+            yield from page
+            page = ahead.result() if ahead else fetch(after)
+
+
+def fetch_row_hashes(client: Client | BaseSink, table: str, with_active: bool = True) -> dict[tuple, dict]:
+    """Stored {natural key: {"id", "row_hash", "is_active"}} for every row of table."""
+    columns = ["id", *NATURAL_KEYS[table].split(","), "row_hash"]
+    if with_active:
+        columns.append("is_active")
+    key_of = natural_key_of(table)
+    return {key_of(r): r for r in stream_rows(client, table, ", ".join(columns))}
+
+
+def deactivate_rows(client: Client | BaseSink, table: str, ids: list[int], chunk_size: int = 500) -> int:
+    """Set is_active = false on the given ids, one UPDATE per chunk."""
+    if isinstance(client, BaseSink):
+        return client.update_by_ids(table, {"is_active": False}, ids)
+    updated = 0
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        client.table(table).update({"is_active": False}).in_("id", chunk).execute()
+        updated += len(chunk)
+    return updated
+
+
+def supports_rpc(client: Client | BaseSink) -> bool:
+    """Whether call_rpc() works on client: Supabase and Postgres have the database functions."""
+    return not isinstance(client, BaseSink) or client.supports_rpc
+
+
+def call_rpc(client: Client | BaseSink, function: str, params: dict | None = None) -> list[dict]:
+    """Call a database function through the Supabase client or a sink."""
+    if isinstance(client, BaseSink):
+        return client.rpc(function, params)
+    return client.rpc(function, params or {}).execute().data
+
+
+def write_telemetry(directory: str) -> tuple[str, str]:
+    """Print the per-table upload report and export telemetry.prom / telemetry.json."""
+    print(TELEMETRY.report())
+    paths = TELEMETRY.write(directory)
+    print(f"  Telemetry written to {paths[0]} and {paths[1]}")
+    return paths
+
+
+def write_quarantine(path: str) -> int:
+    """Print the quarantine summary and write rejected rows to path if any."""
+    print(QUARANTINE.summary())
+    if len(QUARANTINE):
+        QUARANTINE.write(path)
+        print(f"  Rejected rows written to {path}")
+    return len(QUARANTINE)
@@ -0,0 +1,89 @@
+"""Row-hash change detection for diff-only uploads.
+
+Every outgoing row carries a stable content hash in `row_hash`. Comparing it
+with the hashes already stored (keyed by the table's natural key) splits a
+run into inserted, changed and unchanged rows, plus stored rows that vanished
+from the source. Only inserted and changed rows need to be written.
+"""
+import hashlib
+import json
+
+
+def row_hash(row: dict) -> str:
+    """Hash of a row's content, independent of key order. Ignores row_hash itself."""
+    content = {k: v for k, v in row.items() if k != "row_hash"}
+    payload = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def add_row_hashes(rows: list[dict]) -> list[dict]:
+    for row in rows:
+        row["row_hash"] = row_hash(row)
+    return rows
+
+
+def _is_active(stored: dict) -> bool:
+    # NULL counts as active (the column defaults to TRUE); SQLite returns 0/1
+    value = stored.get("is_active", True)
+    return value is None or bool(value)
+
+
+class RowDiff:
+    def __init__(self, table: str):
+        self.table = table
+        self.to_write: list[dict] = []
+        self.inserted = 0
+        self.changed = 0
+        self.unchanged = 0
+        # ids of stored active rows no longer produced by the source
+        self.vanished_ids: list[int] = []
+
+    def add(self, row: dict, old: dict | None) -> bool:
+        """Count one hashed outgoing row against its stored version. True if it must be written."""
+        if old is None:
+            self.inserted += 1
+            return True
+        if old["row_hash"] != row["row_hash"] or not _is_active(old):
+            self.changed += 1
+            return True
+        self.unchanged += 1
+        return False
+
+    def finish(self, stored: dict[tuple, dict], seen: set):
+        """Record the stored active rows whose key was not produced."""
+        self.vanished_ids = [
+            old["id"] for key, old in stored.items()
+            if key not in seen and _is_active(old)
+        ]
+
+    def counts(self) -> dict[str, int]:
+        return {
+            "inserted": self.inserted,
+            "changed": self.changed,
+            "unchanged": self.unchanged,
+            "vanished": len(self.vanished_ids),
+        }
+
+    def summary(self) -> str:
+        c = self.counts()
+        return (f"  {self.table} diff: {c['inserted']} new, {c['changed']} changed, "
+                f"{c['unchanged']} unchanged, {c['vanished']} vanished")
+
+
+def diff_rows(table: str, rows: list[dict], stored: dict[tuple, dict], key_of) -> RowDiff:
+    """Compare hashed outgoing rows with stored {key: {"id", "row_hash", "is_active"}}.
+
+    `key_of(row)` returns the natural key tuple of an outgoing row. Stored
+    rows whose key is not produced (and that are still active) are reported
+    in vanished_ids. To diff a stream instead, call RowDiff.add() per row and
+    RowDiff.finish() at the end.
+    """
+    diff = RowDiff(table)
+    seen = set()
+    for row in rows:
+        key = key_of(row)
+        seen.add(key)
+        if diff.add(row, stored.get(key)):
+            diff.to_write.append(row)
+    diff.finish(stored, seen)
+    return diff
@@ -1,5 +1,6 @@
 import csv
 import re
+from collections.abc import Iterator
 from pipeline.models import NormalizedLabTest
 from pipeline.ingest.base_loader import BaseLoader
 from pipeline.ingest.tat_normalizer import parse_tat_to_hours
@@ -10,9 +11,7 @@ class AgilusLoader(BaseLoader):
     def get_lab_slug(self) -> str:
         return "agilus"
 
-    def load(self, csv_path: str) -> list[NormalizedLabTest]:
-        results = []
-
+    def iter_tests(self, csv_path: str) -> Iterator[NormalizedLabTest]:
         with open(csv_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for row in reader:
@@ -49,7 +48,7 @@ class AgilusLoader(BaseLoader):
                 tat_text = (row.get("tat") or "").strip()
                 tat_hours = parse_tat_to_hours(tat_text)
 
-                results.append(NormalizedLabTest(
+                yield NormalizedLabTest(
                     lab_slug="agilus",
                     source_test_code=(row.get("test_code") or "").strip() or None,
                     source_test_name=test_name_clean,
@@ -69,7 +68,9 @@ class AgilusLoader(BaseLoader):
                     location_code="NEW_DELHI",
                     location_name="New Delhi",
                     raw_data=dict(row),
-                ))
+                )
 
+    def load(self, csv_path: str) -> list[NormalizedLabTest]:
+        results = list(self.iter_tests(csv_path))
         print(f"  Agilus: loaded {len(results)} tests")
         return results
@@ -1,4 +1,5 @@
 import csv
+from collections.abc import Iterator
 from pipeline.models import NormalizedLabTest
 from pipeline.ingest.base_loader import BaseLoader
 from pipeline.ingest.tat_normalizer import parse_tat_to_hours
@@ -9,9 +10,7 @@ class ApolloLoader(BaseLoader):
     def get_lab_slug(self) -> str:
         return "apollo"
 
-    def load(self, csv_path: str) -> list[NormalizedLabTest]:
-        results = []
-
+    def iter_tests(self, csv_path: str) -> Iterator[NormalizedLabTest]:
         with open(csv_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for row in reader:
@@ -40,7 +39,7 @@ class ApolloLoader(BaseLoader):
                 status = (row.get("status") or "").strip().lower()
                 is_active = status != "inactive"
 
-                results.append(NormalizedLabTest(
+                yield NormalizedLabTest(
                     lab_slug="apollo",
                     source_test_code=(row.get("test_code") or "").strip() or None,
                     source_test_name=test_name,
@@ -58,8 +57,10 @@ class ApolloLoader(BaseLoader):
                     location_code=(row.get("city_id") or "").strip() or None,
                     location_name=(row.get("centre_name") or "").strip() or None,
                     raw_data=dict(row),
-                ))
+                )
 
+    def load(self, csv_path: str) -> list[NormalizedLabTest]:
+        results = list(self.iter_tests(csv_path))
         print(f"  Apollo: loaded {len(results)} rows")
         return results
 
@@ -1,10 +1,16 @@
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
 from pipeline.models import NormalizedLabTest
 
 
 class BaseLoader(ABC):
     """Abstract base class for lab-specific CSV loaders."""
 
+    @abstractmethod
+    def iter_tests(self, csv_path: str) -> Iterator[NormalizedLabTest]:
+        """Read CSV and yield each row as a NormalizedLabTest, without holding the whole file."""
+        ...
+
     @abstractmethod
     def load(self, csv_path: str) -> list[NormalizedLabTest]:
         """Read CSV, normalize all fields, return list of NormalizedLabTest."""
@@ -1,4 +1,9 @@
 """Maps lab-specific department names to canonical departments."""
+import re
+from collections import Counter
+
+# Department of tests whose members name no known department
+OTHER = "Other"
 
 DEPARTMENT_MAP = {
     # Apollo (uppercase)
@@ -57,12 +62,47 @@ DEPARTMENT_MAP = {
     # Neuberg service_type
     "Test": "General",
     "Package": "Package",
+
+    # Formerly mapped in the dashboard's availability page
+    "Protein Chemistry": "Biochemistry",
+    "HPLC": "Biochemistry",
+    "Metals": "Biochemistry",
+    "Maternal Marker": "Biochemistry",
+    "Serology Immunology": "Serology",
+    "EIA Infectious": "Serology",
+    "EIA Autoimmune Section": "Immunology",
+    "Autoimmune": "Immunology",
+    "Automuine IFA": "Immunology",
+    "Nephelometry": "Serology",
+    "TORCH": "Serology",
+    "Tumor Marker": "Serology",
+    "Mycology": "Microbiology",
+    "Radiology": "Radiology",
+
+    # Sendouts, billing and company names, not departments
+    "Local Sendout": OTHER,
+    "International Sendout": OTHER,
+    "Outsource": OTHER,
+    "Marketing": OTHER,
+    "Corporate": OTHER,
+    "Other": OTHER,
+    "Super Religare Laboratories Ltd": OTHER,
+    "Home Collection": OTHER,
 }
 
 # All canonical department names
 CANONICAL_DEPARTMENTS = sorted(set(DEPARTMENT_MAP.values()))
 
 
+def _compact(name: str) -> str:
+    """Lowercase with spaces, hyphens, slashes and dots removed ("Eia - Auto Immune" -> "eiaautoimmune")."""
+    return re.sub(r"[\s\-/.]", "", name.lower())
+
+
+# Spelling variants of the DEPARTMENT_MAP keys resolve through their compact form
+_COMPACT_MAP = {_compact(raw): dept for raw, dept in DEPARTMENT_MAP.items()}
+
+
 def normalize_department(raw: str | None) -> str | None:
     """Map a raw department string to canonical form."""
     if not raw:
@@ -74,11 +114,11 @@ def normalize_department(raw: str | None) -> str | None:
     if stripped in DEPARTMENT_MAP:
         return DEPARTMENT_MAP[stripped]
 
-    # Case-insensitive lookup
+    # Case, spacing and punctuation insensitive lookup
+    compact = _compact(stripped)
+    if compact in _COMPACT_MAP:
+        return _COMPACT_MAP[compact]
     lower = stripped.lower()
-    for key, val in DEPARTMENT_MAP.items():
-        if key.lower() == lower:
-            return val
 
     # Fuzzy contains
     for keyword, dept in [
@@ -104,6 +144,24 @@ def normalize_department(raw: str | None) -> str | None:
     return stripped  # Return as-is if no mapping found
 
 
+def majority_department(raws: list[str | None]) -> str | None:
+    """Most common canonical department among raw department strings.
+
+    Unmapped strings are ignored. "Other" and Neuberg's catch-all "General"
+    only count when nothing more specific was voted, and a test with no
+    mapped department at all is "Other", so every test has a department.
+    Ties go to the name first alphabetically, so the result is stable
+    across runs.
+    """
+    votes = Counter(d for d in map(normalize_department, raws) if d in CANONICAL_DEPARTMENTS)
+    for catch_all in (OTHER, "General"):
+        if len(votes) > 1:
+            votes.pop(catch_all, None)
+    if not votes:
+        return OTHER
+    return min(votes, key=lambda d: (-votes[d], d))
+
+
 def get_all_departments() -> list[dict]:
     """Return list of canonical department records for seeding."""
     return [{"name": d, "slug": d.lower().replace(" ", "-")} for d in CANONICAL_DEPARTMENTS]
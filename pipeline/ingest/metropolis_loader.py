@@ -1,4 +1,5 @@
 import csv
+from collections.abc import Iterator
 from pipeline.models import NormalizedLabTest
 from pipeline.ingest.base_loader import BaseLoader
 from pipeline.ingest.tat_normalizer import parse_tat_to_hours
@@ -9,9 +10,7 @@ class MetropolisLoader(BaseLoader):
     def get_lab_slug(self) -> str:
         return "metropolis"
 
-    def load(self, csv_path: str) -> list[NormalizedLabTest]:
-        results = []
-
+    def iter_tests(self, csv_path: str) -> Iterator[NormalizedLabTest]:
         with open(csv_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for row in reader:
@@ -44,9 +43,9 @@ class MetropolisLoader(BaseLoader):
                 tat_text = (row.get("Reported On") or "").strip()
                 tat_hours = parse_tat_to_hours(tat_text)
 
-                results.append(NormalizedLabTest(
+                yield NormalizedLabTest(
                     lab_slug="metropolis",
-                    source_test_code=(row.get("Test Code") or "").strip(),
+                    source_test_code=(row.get("Test Code") or "").strip() or None,
                     source_test_name=test_name,
                     price=price,
                     mrp=price,  # Metropolis has single price = MRP
@@ -62,7 +61,9 @@ class MetropolisLoader(BaseLoader):
                     location_code="DELHI",
                     location_name="Delhi",
                     raw_data=dict(row),
-                ))
+                )
 
+    def load(self, csv_path: str) -> list[NormalizedLabTest]:
+        results = list(self.iter_tests(csv_path))
         print(f"  Metropolis: loaded {len(results)} tests")
         return results
@@ -1,4 +1,5 @@
 import csv
+from collections.abc import Iterator
 from pipeline.models import NormalizedLabTest
 from pipeline.ingest.base_loader import BaseLoader
 from pipeline.ingest.tat_normalizer import parse_tat_minutes_to_hours
@@ -9,9 +10,7 @@ class NeubergLoader(BaseLoader):
     def get_lab_slug(self) -> str:
         return "neuberg"
 
-    def load(self, csv_path: str) -> list[NormalizedLabTest]:
-        results = []
-
+    def iter_tests(self, csv_path: str) -> Iterator[NormalizedLabTest]:
         with open(csv_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for row in reader:
@@ -62,7 +61,7 @@ class NeubergLoader(BaseLoader):
                 # Gender
                 gender = (row.get("applicable_gender") or "").strip()
 
-                results.append(NormalizedLabTest(
+                yield NormalizedLabTest(
                     lab_slug="neuberg",
                     source_test_code=(row.get("service_code") or "").strip() or None,
                     source_test_name=test_name,
@@ -81,8 +80,10 @@ class NeubergLoader(BaseLoader):
                     location_name=(row.get("city_name") or "").strip() or None,
                     aliases=aliases,
                     raw_data=dict(row),
-                ))
+                )
 
+    def load(self, csv_path: str) -> list[NormalizedLabTest]:
+        results = list(self.iter_tests(csv_path))
         print(f"  Neuberg: loaded {len(results)} rows")
         return results
 
@@ -1,4 +1,5 @@
 import csv
+from collections.abc import Iterator
 from pipeline.models import NormalizedLabTest
 from pipeline.ingest.base_loader import BaseLoader
 from pipeline.ingest.tat_normalizer import parse_tat_to_hours
@@ -9,9 +10,7 @@ class TRUSTlabLoader(BaseLoader):
     def get_lab_slug(self) -> str:
         return "trustlab"
 
-    def load(self, csv_path: str) -> list[NormalizedLabTest]:
-        results = []
-
+    def iter_tests(self, csv_path: str) -> Iterator[NormalizedLabTest]:
         with open(csv_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for row in reader:
@@ -69,7 +68,7 @@ class TRUSTlabLoader(BaseLoader):
                 locations = [loc.strip() for loc in location_raw.split(",") if loc.strip()] if location_raw else ["Begumpet"]
 
                 for loc in locations:
-                    results.append(NormalizedLabTest(
+                    yield NormalizedLabTest(
                         lab_slug="trustlab",
                         source_test_code=(row.get("test_code") or "").strip() or None,
                         source_test_name=test_name,
@@ -90,7 +89,9 @@ class TRUSTlabLoader(BaseLoader):
                         location_code=loc,
                         location_name=loc,
                         raw_data=dict(row),
-                    ))
+                    )
 
+    def load(self, csv_path: str) -> list[NormalizedLabTest]:
+        results = list(self.iter_tests(csv_path))
         print(f"  TRUSTlab: loaded {len(results)} rows (expanded from locations)")
         return results
@@ -0,0 +1,69 @@
+"""Resolve the canonical cluster of every physical lab_test row.
+
+Matching only sees one representative per test (per code for Apollo and
+Neuberg, per code-or-name for the others), so location variants and rows
+without a code are not in `matcher.assignment`. This index propagates the
+cluster to all of them in memory, so step 6 writes linked rows the first
+time instead of leaving them for fix_linkage.py.
+"""
+from functools import lru_cache
+from pipeline.models import NormalizedLabTest
+from pipeline.matching.preprocessor import normalize_test_name
+
+# Location variants repeat the same names (151k Apollo rows, ~2.8k names),
+# so a modest cache catches nearly every repeat
+NORMALIZE_CACHE_SIZE = 1 << 16
+
+# (cluster_id, match_confidence, match_method), as resolve() returns it
+Link = tuple[int, float, str]
+
+
+class LinkageIndex:
+    """Lookups from code and name to a cluster.
+
+    Holds plain tuples and strings, not the matcher's member dicts or any
+    NormalizedLabTest, so it can outlive the tests it was built from.
+    """
+
+    def __init__(self, matcher):
+        # Per index, so the cached names are freed with it
+        self._normalize = lru_cache(maxsize=NORMALIZE_CACHE_SIZE)(normalize_test_name)
+        # (lab_slug, source_test_code) -> link of the first member with it
+        self.by_code: dict[tuple[str, str], Link] = {}
+        # (lab_slug, normalized name) -> link of the first member with it
+        self.by_lab_name: dict[tuple[str, str], Link] = {}
+        # normalized name -> cluster_id, across labs
+        self.by_name: dict[str, int] = {}
+        # lowercased alias -> cluster_id (Neuberg aliases from the alias pass)
+        self.by_alias: dict[str, int] = dict(matcher.alias_to_cluster)
+
+        for cid, members in matcher.clusters.items():
+            for m in members:
+                norm = self._normalize(m["source_test_name"])
+                link = (cid, m["confidence"], m["method"])
+                if m["source_test_code"]:
+                    self.by_code.setdefault((m["lab_slug"], m["source_test_code"]), link)
+                self.by_lab_name.setdefault((m["lab_slug"], norm), link)
+                self.by_name.setdefault(norm, cid)
+
+    def resolve(self, t: NormalizedLabTest) -> tuple[int | None, float | None, str | None]:
+        """Return (cluster_id, match_confidence, match_method) for a row."""
+        if t.source_test_code:
+            hit = self.by_code.get((t.lab_slug, t.source_test_code))
+            if hit:
+                return hit
+
+        norm = self._normalize(t.source_test_name)
+        hit = self.by_lab_name.get((t.lab_slug, norm))
+        if hit:
+            return hit
+
+        cid = self.by_name.get(norm)
+        if cid:
+            return cid, 0.85, "name_propagation"
+
+        cid = self.by_alias.get(norm) or self.by_alias.get(t.source_test_name.strip().lower())
+        if cid:
+            return cid, 0.80, "keyword_propagation"
+
+        return None, None, None
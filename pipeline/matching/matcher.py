@@ -9,6 +9,8 @@ Matches tests across labs to canonical test groups using:
 from collections import defaultdict
 from rapidfuzz import fuzz
 from pipeline.models import NormalizedLabTest
+from pipeline.ingest.department_normalizer import majority_department
+from pipeline.profiling import span
 from pipeline.matching.preprocessor import (
     normalize_test_name,
     tokenize,
@@ -55,31 +57,36 @@ class TestMatcher:
         unmatched = list(all_unique_tests)
 
         # Pass 1: Exact normalized name match (group by normalized name)
-        unmatched = self._pass_exact_name(unmatched)
+        with span("match pass 1: exact name", "match", tests=len(unmatched)):
+            unmatched = self._pass_exact_name(unmatched)
         print(f"  After Pass 1 (exact name): {len(self.clusters)} clusters, {len(unmatched)} unmatched")
 
         # Pass 2: Neuberg alias matching
-        unmatched = self._pass_alias_match(unmatched)
+        with span("match pass 2: alias", "match", tests=len(unmatched)):
+            unmatched = self._pass_alias_match(unmatched)
         print(f"  After Pass 2 (alias): {len(self.clusters)} clusters, {len(unmatched)} unmatched")
 
         # Pass 3: Fuzzy matching
-        unmatched = self._pass_fuzzy_match(unmatched)
+        with span("match pass 3: fuzzy", "match", tests=len(unmatched)):
+            unmatched = self._pass_fuzzy_match(unmatched)
         print(f"  After Pass 3 (fuzzy): {len(self.clusters)} clusters, {len(unmatched)} unmatched")
 
         # Pass 4: Create singleton clusters for remaining unmatched
-        for t in unmatched:
-            key = self._make_key(t)
-            member = {
-                "lab_slug": t.lab_slug,
-                "source_test_code": t.source_test_code,
-                "source_test_name": t.source_test_name,
-                "confidence": 1.0,
-                "method": "singleton",
-            }
-            cid = self._new_cluster([member])
-            self.assignment[key] = cid
-            norm = normalize_test_name(t.source_test_name)
-            self.name_to_cluster[norm] = cid
+        with span("match pass 4: singletons", "match", tests=len(unmatched)):
+            for t in unmatched:
+                key = self._make_key(t)
+                member = {
+                    "lab_slug": t.lab_slug,
+                    "source_test_code": t.source_test_code,
+                    "source_test_name": t.source_test_name,
+                    "department_raw": t.department_raw,
+                    "confidence": 1.0,
+                    "method": "singleton",
+                }
+                cid = self._new_cluster([member])
+                self.assignment[key] = cid
+                norm = normalize_test_name(t.source_test_name)
+                self.name_to_cluster[norm] = cid
 
         print(f"  Final: {len(self.clusters)} total clusters")
 
@@ -112,6 +119,7 @@ class TestMatcher:
                     "lab_slug": t.lab_slug,
                     "source_test_code": t.source_test_code,
                     "source_test_name": t.source_test_name,
+                    "department_raw": t.department_raw,
                     "confidence": 1.0,
                     "method": "exact_name",
                 }
@@ -130,6 +138,7 @@ class TestMatcher:
                         "lab_slug": t.lab_slug,
                         "source_test_code": t.source_test_code,
                         "source_test_name": t.source_test_name,
+                        "department_raw": t.department_raw,
                         "confidence": 0.95,
                         "method": "exact_name",
                     })
@@ -190,6 +199,7 @@ class TestMatcher:
                     "lab_slug": t.lab_slug,
                     "source_test_code": t.source_test_code,
                     "source_test_name": t.source_test_name,
+                    "department_raw": t.department_raw,
                     "confidence": 0.90,
                     "method": "alias_match",
                 }
@@ -253,6 +263,7 @@ class TestMatcher:
                     "lab_slug": t.lab_slug,
                     "source_test_code": t.source_test_code,
                     "source_test_name": t.source_test_name,
+                    "department_raw": t.department_raw,
                     "confidence": round(best_score, 4),
                     "method": "fuzzy_match",
                 }
@@ -279,19 +290,24 @@ class TestMatcher:
                 if len(m["source_test_name"]) > len(best_name):
                     best_name = m["source_test_name"]
 
-            # Collect all name variants as keywords
-            keywords = list(set(
+            # Collect all name variants as keywords, sorted so the uploaded
+            # keywords[:20], search_text and row_hash don't vary with the hash seed
+            keywords = sorted(set(
                 m["source_test_name"] for m in members
             ))
 
             lab_count = len(set(m["lab_slug"] for m in members))
 
+            # Majority vote over the members' lab departments
+            department = majority_department([m.get("department_raw") for m in members])
+
             canonicals.append({
                 "cluster_id": cid,
                 "name": best_name,
                 "keywords": keywords,
                 "member_count": len(members),
                 "lab_count": lab_count,
+                "department": department,
                 "members": members,
             })
 
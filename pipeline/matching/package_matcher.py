@@ -0,0 +1,185 @@
+"""Composition-based package matching.
+
+Package names are long and generic ("Comprehensive Full Body Checkup"), so
+name similarity is a poor signal for them. Instead each package is resolved
+to the canonical tests it contains and represented as a bitset over canonical
+test clusters (bit i set = cluster i is included). Two packages are compared
+with a popcount Jaccard on those integers, which keeps cross-lab package
+queries cheap even with thousands of packages.
+
+A package's composition is NormalizedLabTest.components, filled by its
+loader from the lab's package-composition source. None of the current CSV
+exports lists a package's tests, so until one does, packages go through the
+matcher's name passes like other tests (see has_composition()), and
+scripts/test_package_matcher.py exercises this module on hand-built packages.
+"""
+from collections import defaultdict
+from pipeline.config import PACKAGE_MATCH_THRESHOLD
+from pipeline.models import NormalizedLabTest
+from pipeline.matching.preprocessor import normalize_test_name
+
+
+def extract_components(t: NormalizedLabTest) -> list[str]:
+    """Return the constituent test names of a package."""
+    return t.components
+
+
+def has_composition(t: NormalizedLabTest) -> bool:
+    """Whether a test is a package its loader gave a composition, for PackageMatcher."""
+    return t.test_type == "package" and bool(extract_components(t))
+
+
+def iter_bits(bits: int):
+    """Yield the positions of the set bits in an int, lowest first."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def jaccard(a: int, b: int) -> float:
+    """Jaccard similarity of two bitsets via popcount."""
+    union = (a | b).bit_count()
+    if not union:
+        return 0.0
+    return (a & b).bit_count() / union
+
+
+class PackageMatcher:
+    """Clusters packages by composition on top of a finished TestMatcher."""
+
+    def __init__(self, matcher, threshold: float = PACKAGE_MATCH_THRESHOLD):
+        self.matcher = matcher
+        self.threshold = threshold
+
+        # canonical test cluster_id <-> bit position
+        self.bit_of: dict[int, int] = {}
+        self.cluster_of_bit: list[int] = []
+
+        # package cluster_id -> representative bitset
+        self.package_bits: dict[int, int] = {}
+        # Inverted index: bit -> package cluster_ids containing it
+        self.postings: dict[int, set[int]] = defaultdict(set)
+
+        self._name_index = self._build_name_index()
+
+    def _build_name_index(self) -> dict[str, int]:
+        """Map normalized test names and aliases to live single-test clusters."""
+        index: dict[str, int] = {}
+        for alias, cid in self.matcher.alias_to_cluster.items():
+            if cid in self.matcher.clusters:
+                index[alias] = cid
+        # Member names win over aliases
+        for cid, members in self.matcher.clusters.items():
+            for m in members:
+                index[normalize_test_name(m["source_test_name"])] = cid
+        return index
+
+    def _bit(self, cid: int) -> int:
+        bit = self.bit_of.get(cid)
+        if bit is None:
+            bit = len(self.cluster_of_bit)
+            self.bit_of[cid] = bit
+            self.cluster_of_bit.append(cid)
+        return bit
+
+    def resolve_component(self, name: str) -> int | None:
+        """Resolve a component test name to its canonical test cluster_id."""
+        norm = normalize_test_name(name)
+        return self._name_index.get(norm) or self._name_index.get(name.strip().lower())
+
+    def to_bitset(self, t: NormalizedLabTest) -> int:
+        bits = 0
+        for name in extract_components(t):
+            cid = self.resolve_component(name)
+            if cid:
+                bits |= 1 << self._bit(cid)
+        return bits
+
+    def component_clusters(self, bits: int) -> list[int]:
+        """Translate a bitset back to canonical test cluster_ids."""
+        return [self.cluster_of_bit[b] for b in iter_bits(bits)]
+
+    def find_equivalent(self, bits: int, min_jaccard: float | None = None) -> list[tuple[int, float]]:
+        """Return (package cluster_id, score) pairs at or above min_jaccard, best first.
+
+        Only packages sharing at least one component are scored, via the
+        inverted index.
+        """
+        if min_jaccard is None:
+            min_jaccard = self.threshold
+        candidates: set[int] = set()
+        for b in iter_bits(bits):
+            candidates |= self.postings.get(b, set())
+
+        scored = []
+        for cid in candidates:
+            score = jaccard(bits, self.package_bits[cid])
+            if score >= min_jaccard:
+                scored.append((cid, score))
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored
+
+    def _register(self, cid: int, bits: int):
+        self.package_bits[cid] = bits
+        for b in iter_bits(bits):
+            self.postings[b].add(cid)
+
+    def run(self, packages: list[NormalizedLabTest]) -> dict[str, int]:
+        """Cluster packages by composition. Returns {test_key: cluster_id}."""
+        print("\n=== Starting Package Matching ===")
+        print(f"  Total unique packages to match: {len(packages)}")
+
+        unresolved = []
+        composed = 0
+        for t in packages:
+            bits = self.to_bitset(t)
+            if not bits:
+                unresolved.append(t)
+                continue
+            composed += 1
+
+            key = self.matcher._make_key(t)
+            matches = self.find_equivalent(bits)
+            if matches:
+                cid, score = matches[0]
+                confidence = round(score, 4)
+                self.matcher._add_to_cluster(cid, self._member(t, confidence))
+            else:
+                cid = self.matcher._new_cluster([self._member(t, 1.0)])
+                self._register(cid, bits)
+            self.matcher.assignment[key] = cid
+
+        print(f"  Resolved by composition: {composed}, {len(self.package_bits)} package clusters")
+
+        # Without a composition, fall back to exact normalized name only;
+        # fuzzy name scores are meaningless for generic package names.
+        name_groups: dict[str, list[NormalizedLabTest]] = defaultdict(list)
+        for t in unresolved:
+            name_groups[normalize_test_name(t.source_test_name)].append(t)
+
+        for group in name_groups.values():
+            method = "exact_name" if len(group) > 1 else "singleton"
+            confidence = 0.95 if len(group) > 1 else 1.0
+            members = []
+            for t in group:
+                m = self._member(t, confidence)
+                m["method"] = method
+                members.append(m)
+            cid = self.matcher._new_cluster(members)
+            for t in group:
+                self.matcher.assignment[self.matcher._make_key(t)] = cid
+
+        print(f"  Unresolved packages (name only): {len(unresolved)}")
+        return self.matcher.assignment
+
+    @staticmethod
+    def _member(t: NormalizedLabTest, confidence: float) -> dict:
+        return {
+            "lab_slug": t.lab_slug,
+            "source_test_code": t.source_test_code,
+            "source_test_name": t.source_test_name,
+            "department_raw": t.department_raw,
+            "confidence": confidence,
+            "method": "package_composition",
+        }
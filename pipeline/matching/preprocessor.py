@@ -159,3 +159,32 @@ def tokenize_expanded(name: str) -> set[str]:
     norm = normalize_test_name(name)
     expanded = expand_abbreviations(norm)
     return {t for t in re.findall(r"[a-z]{2,}", expanded)}
+
+
+# Expansion -> the abbreviations that stand for it (sgot and ast share one)
+ABBREVIATIONS_OF: dict[str, list[str]] = {}
+for _abbr, _expansion in ABBREVIATIONS.items():
+    ABBREVIATIONS_OF.setdefault(_expansion, []).append(_abbr)
+
+
+def search_document(name: str, aliases: list[str]) -> str:
+    """Lowercase search text for a canonical test (canonical_tests.search_text).
+
+    The name and aliases, each followed by the abbreviations it contains
+    expanded and the expansions it contains abbreviated, so "sgpt" finds
+    "Alanine Aminotransferase" and the reverse.
+    """
+    phrases: dict[str, None] = {}
+    for text in [name, *aliases]:
+        norm = normalize_test_name(text)
+        if not norm:
+            continue
+        phrases[norm] = None
+        padded = f" {norm} "
+        for abbr, expansion in ABBREVIATIONS.items():
+            if f" {abbr} " in padded:
+                phrases[expansion] = None
+        for expansion, abbrs in ABBREVIATIONS_OF.items():
+            if f" {expansion} " in padded:
+                phrases.update(dict.fromkeys(abbrs))
+    return " ; ".join(phrases)
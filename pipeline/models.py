@@ -24,4 +24,15 @@ class NormalizedLabTest(BaseModel):
     location_code: Optional[str] = None
     location_name: Optional[str] = None
     aliases: list[str] = []
+    components: list[str] = []  # constituent test names (packages only)
     raw_data: dict = {}
+
+    def source_key(self) -> str:
+        """Identity of the row within its lab and location: the code, or the normalized name without one.
+
+        Rows without a code used to share one NULL key, so distinct tests
+        at the same location collapsed into a single lab_tests row.
+        """
+        if self.source_test_code:
+            return self.source_test_code
+        return "name:" + " ".join(self.source_test_name[:500].lower().split())
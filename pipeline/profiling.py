@@ -0,0 +1,170 @@
+"""Opt-in profiling for pipeline runs (--profile).
+
+Code marks units of work with `with span("name"):`, which costs nothing
+while profiling is off. After PROFILER.start(directory):
+- every span becomes a Chrome trace event (load trace.json in
+  chrome://tracing or https://ui.perfetto.dev), tagged with the RSS at its end
+- spans opened with profile=True (pipeline steps) also get their own cProfile
+  stats, as <name>.prof for snakeviz/pstats and <name>.txt (top functions)
+- tracemalloc runs for the whole process
+PROFILER.finish() writes trace.json and memory.txt/memory.json (peak RSS,
+tracemalloc peak and the top allocation sites).
+"""
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+
+def rss_mb() -> float:
+    """Current resident set size (Linux), else the peak."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def reset_peak_rss():
+    """Reset the process's peak RSS (Linux); elsewhere the peak stays cumulative."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.directory: str | None = None
+        self.events: list[dict] = []
+        self._threads: set[int] = set()
+        self._lock = threading.Lock()
+        self._origin = 0.0
+
+    def start(self, directory: str, trace_memory: bool = True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.events = []
+        self._threads = set()
+        self._origin = time.perf_counter()
+        self.enabled = True
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "pipeline", profile: bool = False, **args):
+        if not self.enabled:
+            yield
+            return
+
+        profiler = None
+        if profile:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one active cProfile per interpreter; a
+                # concurrent step still gets its trace span
+                profiler = None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if profiler:
+                profiler.disable()
+                self._write_stats(name, profiler)
+            self._record(name, category, start, end, args)
+
+    def _record(self, name: str, category: str, start: float, end: float, args: dict):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((start - self._origin) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": {**args, "rss_mb": round(rss_mb(), 1)},
+        }
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads.add(thread.ident)
+                self.events.append({
+                    "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident,
+                    "args": {"name": thread.name},
+                })
+            self.events.append(event)
+
+    def _write_stats(self, name: str, profiler: cProfile.Profile):
+        base = os.path.join(self.directory, re.sub(r"[^\w.-]+", "_", name))
+        profiler.dump_stats(base + ".prof")
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(40)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(text.getvalue())
+
+    def finish(self, top: int = 30) -> str | None:
+        """Write trace.json and the memory report. Returns the directory written to."""
+        if not self.enabled:
+            return None
+        self.enabled = False
+
+        with open(os.path.join(self.directory, "trace.json"), "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+        memory = {"peak_rss_mb": round(peak_rss_mb(), 1), "spans": len(self.events)}
+        lines = [f"Peak RSS: {memory['peak_rss_mb']:.1f} MB"]
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            stats = tracemalloc.take_snapshot().statistics("lineno")[:top]
+            tracemalloc.stop()
+            memory["tracemalloc_current_mb"] = round(current / 1e6, 1)
+            memory["tracemalloc_peak_mb"] = round(peak / 1e6, 1)
+            memory["top_allocations"] = [
+                {"site": f"{s.traceback[0].filename}:{s.traceback[0].lineno}", "mb": round(s.size / 1e6, 2),
+                 "blocks": s.count}
+                for s in stats
+            ]
+            lines.append(f"Python heap (tracemalloc): {memory['tracemalloc_peak_mb']:.1f} MB peak, "
+                         f"{memory['tracemalloc_current_mb']:.1f} MB still allocated at the end")
+            lines.append(f"\nTop {len(stats)} allocation sites still held:")
+            lines += [f"  {a['mb']:>9.2f} MB {a['blocks']:>9} blocks  {a['site']}" for a in memory["top_allocations"]]
+
+        with open(os.path.join(self.directory, "memory.json"), "w", encoding="utf-8") as f:
+            json.dump(memory, f, indent=2)
+        with open(os.path.join(self.directory, "memory.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return self.directory
+
+
+PROFILER = Profiler()
+
+
+def span(name: str, category: str = "pipeline", profile: bool = False, **args):
+    """Time a unit of work when profiling is on (see PROFILER)."""
+    return PROFILER.span(name, category, profile, **args)
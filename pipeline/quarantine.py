@@ -0,0 +1,35 @@
+"""Collects rows the database rejected, with the reason, for later review."""
+import json
+import os
+from collections import Counter
+
+
+class QuarantineReport:
+    def __init__(self):
+        self.entries: list[dict] = []
+
+    def add(self, table: str, row: dict, reason: str):
+        self.entries.append({"table": table, "reason": reason, "row": row})
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def counts(self) -> dict[str, int]:
+        """Rejected row count per table."""
+        return dict(Counter(e["table"] for e in self.entries))
+
+    def summary(self) -> str:
+        if not self.entries:
+            return "  Quarantine: no rejected rows"
+        lines = [f"  Quarantine: {len(self.entries)} rejected rows"]
+        for table, n in sorted(self.counts().items()):
+            lines.append(f"    {table}: {n}")
+        reasons = Counter(e["reason"] for e in self.entries)
+        for reason, n in reasons.most_common(5):
+            lines.append(f"    {n}x {reason[:200]}")
+        return "\n".join(lines)
+
+    def write(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, default=str)
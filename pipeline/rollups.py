@@ -0,0 +1,81 @@
+"""Dashboard tables precomputed from the pipeline's in-memory data.
+
+The dashboard used to page through every active lab_tests row of a city and
+aggregate in the browser. These rollups are computed once per run from the
+rows step 6 writes and uploaded as small tables the dashboard reads with a
+single indexed query. Step 6 hands them its linked rows as compact
+(lab_slug, location_code, canonical_test_id, price) tuples, so the labs are
+not read again (from disk, when spilled) and no second linkage index is built.
+"""
+from collections import defaultdict
+
+from pipeline.ingest.city_normalizer import normalize_city
+
+
+def location_city_ids(city_id_map: dict):
+    """Function (lab_slug, location_code) -> city_id or None, cached per location."""
+    cache: dict[tuple, int | None] = {}
+
+    def city_of(slug: str, location_code: str | None) -> int | None:
+        key = (slug, location_code)
+        if key not in cache:
+            name = normalize_city(location_code, slug) if location_code else None
+            cache[key] = city_id_map.get(name) if name else None
+        return cache[key]
+
+    return city_of
+
+
+def price_heatmap_rows(rows, city_of) -> list[dict]:
+    """price_heatmap rows: per (city, canonical test) offered by 2+ labs, each lab's average price.
+
+    `rows` are step 6's linked rows. price_spread is the gap between the
+    most and least expensive lab averages.
+    """
+    prices: dict[tuple, list[float]] = defaultdict(list)
+    for slug, location_code, ct_id, price in rows:
+        if not price or price <= 0:
+            continue
+        city_id = city_of(slug, location_code)
+        if city_id:
+            prices[(city_id, ct_id, slug)].append(price)
+
+    by_cell: dict[tuple, dict[str, float]] = defaultdict(dict)
+    for (city_id, ct_id, slug), values in prices.items():
+        by_cell[(city_id, ct_id)][slug] = round(sum(values) / len(values), 2)
+
+    heatmap = []
+    for (city_id, ct_id), lab_prices in by_cell.items():
+        if len(lab_prices) < 2:
+            continue
+        low, high = min(lab_prices.values()), max(lab_prices.values())
+        heatmap.append({
+            "city_id": city_id,
+            "canonical_test_id": ct_id,
+            "lab_prices": dict(sorted(lab_prices.items())),
+            "lab_count": len(lab_prices),
+            "min_price": low,
+            "max_price": high,
+            "price_spread": round(high - low, 2),
+            "is_active": True,
+        })
+    return heatmap
+
+
+def department_availability_rows(rows, city_of, lab_id_map: dict, ct_department: dict) -> list[dict]:
+    """department_availability rows: canonical tests per (city, department, lab).
+
+    `rows` are step 6's linked rows; `ct_department` maps canonical_test_id
+    to department_id (tests without a department are not counted).
+    """
+    tests: dict[tuple, set] = defaultdict(set)
+    for slug, location_code, ct_id, _ in rows:
+        city_id = city_of(slug, location_code)
+        department_id = ct_department.get(ct_id)
+        if city_id and department_id:
+            tests[(city_id, department_id, lab_id_map[slug])].add(ct_id)
+    return [
+        {"city_id": city_id, "department_id": department_id, "lab_id": lab_id,
+         "test_count": len(ct_ids), "is_active": True}
+        for (city_id, department_id, lab_id), ct_ids in tests.items()
+    ]
@@ -0,0 +1,178 @@
+"""Run pipeline steps as a DAG.
+
+Each step declares the named values it consumes (`inputs`) and produces
+(`outputs`); a step can also be ordered after another without consuming its
+output (`after`, e.g. locations need the labs seeded first). The scheduler
+starts every step as soon as its dependencies finish, so CPU-bound local work
+(matching) overlaps network-bound uploads. Steps run in threads: uploads spend
+their time waiting on the network with the GIL released.
+
+Steps that share a database client must be ordered through their
+dependencies; the scheduler does not serialize them otherwise.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pipeline.checkpoint import RunCheckpoint
+from pipeline.profiling import span
+
+
+class Step:
+    def __init__(self, name: str, fn, inputs: tuple = (), outputs: tuple = (), after: tuple = ()):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.after = tuple(after)
+
+    def unpack(self, result) -> dict:
+        """Map the function's return value onto the declared outputs."""
+        if not self.outputs:
+            return {}
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+        return dict(zip(self.outputs, result, strict=True))
+
+
+class PipelineDAG:
+    def __init__(self, steps: list[Step]):
+        self.steps = {s.name: s for s in steps}
+        if len(self.steps) != len(steps):
+            raise ValueError("Duplicate step names")
+
+        self.producer: dict[str, str] = {}
+        for s in steps:
+            for out in s.outputs:
+                if out in self.producer:
+                    raise ValueError(f"{out!r} is produced by both {self.producer[out]} and {s.name}")
+                self.producer[out] = s.name
+
+        # step -> steps it waits for
+        self.deps: dict[str, set[str]] = {}
+        for s in steps:
+            deps = {self.producer[i] for i in s.inputs if i in self.producer}
+            for name in s.after:
+                if name not in self.steps:
+                    raise ValueError(f"{s.name} runs after unknown step {name!r}")
+                deps.add(name)
+            self.deps[s.name] = deps
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> list[str]:
+        order, done = [], set()
+        pending = list(self.steps)
+        while pending:
+            ready = [n for n in pending if self.deps[n] <= done]
+            if not ready:
+                raise ValueError(f"Dependency cycle among steps: {', '.join(pending)}")
+            for n in ready:
+                order.append(n)
+                done.add(n)
+                pending.remove(n)
+        return order
+
+    def downstream(self, name: str) -> set[str]:
+        """Steps that depend on `name`, directly or transitively."""
+        found = set()
+        frontier = [name]
+        while frontier:
+            current = frontier.pop()
+            for n, deps in self.deps.items():
+                if current in deps and n not in found:
+                    found.add(n)
+                    frontier.append(n)
+        return found
+
+    def select(self, only: list[str] | None = None, start: str | None = None) -> list[str]:
+        """Step names to run: `only` those listed, or `start` and everything downstream of it."""
+        for name in (only or []) + ([start] if start else []):
+            if name not in self.steps:
+                raise ValueError(f"Unknown step {name!r} (steps: {', '.join(self.order)})")
+        if only:
+            chosen = set(only)
+        elif start:
+            chosen = {start} | self.downstream(start)
+        else:
+            chosen = set(self.steps)
+        return [n for n in self.order if n in chosen]
+
+    def plan(self, selected: list[str], checkpoint: RunCheckpoint, reuse: bool, provided) -> tuple[list, list]:
+        """Decide which steps run and which are restored. Raises ValueError if an input is unavailable.
+
+        With `reuse` (--resume), selected steps already checkpointed are
+        restored instead of rerun. A step that reruns invalidates its own
+        checkpoint and those of everything downstream of it.
+        """
+        to_run = [n for n in selected if not (reuse and checkpoint.done(n))]
+        stale = set()
+        if not reuse:
+            for name in to_run:
+                stale |= {name} | self.downstream(name)
+        restored = [n for n in self.order if n not in to_run and n not in stale and checkpoint.done(n)]
+
+        available = set(provided) | {o for n in to_run + restored for o in self.steps[n].outputs}
+        for name in to_run:
+            missing = [i for i in self.steps[name].inputs if i not in available]
+            if missing:
+                needed = sorted({self.producer.get(i, i) for i in missing})
+                raise ValueError(f"Step {name} needs {', '.join(missing)}; run {', '.join(needed)} first")
+
+        for name in self.order:
+            if name in stale:
+                checkpoint.discard(name)
+        return to_run, restored
+
+    def run(self, values: dict, to_run: list[str], restored: list[str], checkpoint: RunCheckpoint,
+            max_workers: int = 4) -> dict:
+        """Run steps as their dependencies finish, after loading the restored ones from checkpoint.
+
+        `values` holds the run-wide inputs (client, flags) and receives every
+        step output. `to_run` and `restored` come from plan().
+        """
+        for name in restored:
+            print(f"\n=== {name}: restored from checkpoint ===")
+            values.update(self.steps[name].unpack(checkpoint.load(name)))
+
+        timings: dict[str, float] = {}
+        pending = set(to_run)
+        running = {}
+        started = time.perf_counter()
+
+        def launch(pool, name):
+            step = self.steps[name]
+
+            def call():
+                t0 = time.perf_counter()
+                with span(name, "step", profile=True):
+                    result = step.fn(*(values[i] for i in step.inputs))
+                timings[name] = time.perf_counter() - t0
+                return result
+
+            running[pool.submit(call)] = name
+            pending.discard(name)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="step") as pool:
+            while pending or running:
+                for name in [n for n in self.order if n in pending]:
+                    if not (self.deps[name] & (pending | set(running.values()))):
+                        launch(pool, name)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BaseException:
+                        # Let running steps finish, but start nothing new
+                        pending.clear()
+                        wait(running)
+                        raise
+                    checkpoint.save(name, result)
+                    values.update(self.steps[name].unpack(result))
+
+        if timings:
+            wall = time.perf_counter() - started
+            print("\n=== Step timings ===")
+            for name in to_run:
+                print(f"  {name:<12} {timings[name]:>8.1f}s")
+            print(f"  Wall clock {wall:.1f}s for {sum(timings.values()):.1f}s of step time")
+        return values
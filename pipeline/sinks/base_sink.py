@@ -0,0 +1,35 @@
+from abc import ABC, abstractmethod
+
+
+class BaseSink(ABC):
+    """Abstract storage target the pipeline can write to instead of the Supabase client."""
+
+    # Whether rpc() can call the database functions of scripts/*.sql
+    supports_rpc = False
+
+    @abstractmethod
+    def upsert(self, table: str, rows: list[dict], conflict_columns: str | None = None, ignore_duplicates: bool = False) -> int:
+        """Insert rows, merging (or skipping) conflicts on conflict_columns. Returns rows written."""
+        ...
+
+    @abstractmethod
+    def select(self, table: str, columns: str) -> list[dict]:
+        """Return all rows of a table with the given comma-separated columns."""
+        ...
+
+    @abstractmethod
+    def select_page(self, table: str, columns: str, key: str, after, limit: int) -> list[dict]:
+        """Return up to limit rows with key > after (all rows if after is None), ordered by key."""
+        ...
+
+    @abstractmethod
+    def update_by_ids(self, table: str, values: dict, ids: list[int]) -> int:
+        """Set the same column values on every row whose id is in ids. Returns rows updated."""
+        ...
+
+    def rpc(self, function: str, params: dict | None = None) -> list[dict]:
+        """Call a database function, like supabase-py's client.rpc(). Check supports_rpc first."""
+        raise NotImplementedError(f"{type(self).__name__} does not support database functions")
+
+    def close(self):
+        pass
@@ -0,0 +1,83 @@
+"""Local DuckDB sink. Requires the optional `duckdb` package."""
+import json
+import re
+import pandas as pd
+from pipeline.sinks.embedded_sink import EmbeddedSink
+
+try:
+    import duckdb
+except ImportError:  # optional dependency
+    duckdb = None
+
+_TYPE_REWRITES = [
+    (re.compile(r"\bTIMESTAMPTZ DEFAULT NOW\(\)"), "TIMESTAMP DEFAULT current_timestamp"),
+    (re.compile(r"\bTEXT\[\]"), "VARCHAR[]"),
+    (re.compile(r"\bJSONB\b"), "VARCHAR"),
+    # DuckDB checks foreign keys on every parent update, which an upsert of labs would trip
+    (re.compile(r"\s+REFERENCES \w+\(\w+\)"), ""),
+    (re.compile(r"\bUNIQUE NULLS NOT DISTINCT\b"), "UNIQUE"),
+    # DuckDB only has virtual generated columns, which cannot be part of a UNIQUE key
+    (re.compile(r"\bSTORED\b"), "VIRTUAL"),
+    (re.compile(r",\s*CONSTRAINT \w+ UNIQUE \([^)]*_lower\)"), ""),
+]
+
+
+class DuckDBSink(EmbeddedSink):
+    def _connect(self, path: str):
+        if duckdb is None:
+            raise ImportError("DuckDBSink needs the duckdb package: pip install duckdb")
+        return duckdb.connect(path)
+
+    def _before_create(self, table: str):
+        self.conn.execute(f"CREATE SEQUENCE IF NOT EXISTS {table}_id_seq")
+
+    def translate_column_sql(self, table: str, body: str) -> str:
+        body = re.sub(r"\bSERIAL PRIMARY KEY\b", f"INTEGER PRIMARY KEY DEFAULT nextval('{table}_id_seq')", body)
+        for pattern, replacement in _TYPE_REWRITES:
+            body = pattern.sub(replacement, body)
+        return body
+
+    def _index_sql(self, name: str, table: str, columns: str, where: str) -> str:
+        # No partial indexes in DuckDB
+        return f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})"
+
+    def _stage(self, table: str, columns: list[str], rows: list[dict]) -> str:
+        # Binding Python parameters is slow in DuckDB; scan a registered
+        # DataFrame instead, cast to the target column types
+        staging = f"_stage_{table}"
+        cols = ", ".join(f'"{c}"' for c in columns)
+        frame = pd.DataFrame.from_records(
+            [[self._adapt(row.get(c)) for c in columns] for row in rows], columns=columns,
+        ).astype(object)
+        self.conn.execute(f"DROP TABLE IF EXISTS {staging}")
+        self.conn.execute(f"CREATE TEMP TABLE {staging} AS SELECT {cols} FROM {table} LIMIT 0")
+        self.conn.register("_incoming", frame)
+        try:
+            self.conn.execute(f"INSERT INTO {staging} ({cols}) SELECT {cols} FROM _incoming")
+        finally:
+            self.conn.unregister("_incoming")
+        return staging
+
+    def _fetch(self, query: str, params: list) -> list[dict]:
+        # A connection must not be shared across threads (stream_rows prefetches
+        # from a worker); cursor() opens a thread-local handle on the same database
+        cur = self.conn.cursor()
+        try:
+            cur.execute(query, params)
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+        finally:
+            cur.close()
+
+    def _adapt(self, value):
+        if isinstance(value, dict):
+            return json.dumps(value)
+        return value
+
+    def _begin(self):
+        self.conn.begin()
+
+    def _rowcount(self, cur) -> int:
+        # DML returns a one-row result holding the affected row count
+        row = cur.fetchone()
+        return row[0] if row else 0
@@ -0,0 +1,179 @@
+"""Shared logic for the embedded (in-process) sinks, SQLite and DuckDB.
+
+Tables are created from the CREATE TABLE statements in scripts/schema.sql,
+rewritten for the local dialect by `translate_column_sql`. Upserts load rows
+into a temporary staging table, update the rows whose natural key already
+exists and insert the rest, comparing keys with a NULL-safe equality so
+`UNIQUE NULLS NOT DISTINCT` keys behave as they do in Postgres.
+"""
+import os
+import re
+from abc import abstractmethod
+from pipeline.sinks.base_sink import BaseSink
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "scripts", "schema.sql")
+
+_TABLE_RE = re.compile(r"CREATE TABLE IF NOT EXISTS (\w+) \((.*?)\n\);", re.S)
+_INDEX_RE = re.compile(
+    r"CREATE INDEX IF NOT EXISTS (\w+) ON (\w+)\s*\(([^)]*)\)(?: INCLUDE \([^)]*\))?(?: WHERE ([^;]+))?;"
+)
+
+
+def schema_tables(path: str = SCHEMA_PATH) -> list[tuple[str, str]]:
+    """(table, column definitions) for every table in schema.sql, in file order."""
+    with open(path, encoding="utf-8") as f:
+        return _TABLE_RE.findall(f.read())
+
+
+def schema_indexes(path: str = SCHEMA_PATH) -> list[tuple[str, str, str, str]]:
+    """(name, table, columns, where) for the btree indexes in schema.sql.
+
+    GIN trigram indexes are Postgres-only and skipped; INCLUDE columns are
+    dropped, leaving a plain index on the key columns.
+    """
+    with open(path, encoding="utf-8") as f:
+        return _INDEX_RE.findall(f.read())
+
+
+def _quote(name: str) -> str:
+    return f'"{name}"'
+
+
+class EmbeddedSink(BaseSink):
+    # NULL-safe equality operator of the dialect
+    null_safe_eq = "IS NOT DISTINCT FROM"
+    # Rows per multi-row INSERT into the staging table
+    insert_chunk = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = self._connect(path)
+        self.create_schema()
+
+    @abstractmethod
+    def _connect(self, path: str):
+        """Open the database file at path. Returns the connection."""
+        ...
+
+    @abstractmethod
+    def translate_column_sql(self, table: str, body: str) -> str:
+        """Rewrite a schema.sql column list for this dialect."""
+        ...
+
+    def _adapt(self, value):
+        return value
+
+    def _begin(self):
+        pass
+
+    def _before_create(self, table: str):
+        pass
+
+    def create_schema(self):
+        for table, body in schema_tables():
+            self._before_create(table)
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ({self.translate_column_sql(table, body)}\n)"
+            )
+        for name, table, columns, where in schema_indexes():
+            self.conn.execute(self._index_sql(name, table, columns, where))
+        self.conn.commit()
+
+    def _index_sql(self, name: str, table: str, columns: str, where: str) -> str:
+        sql = f"CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})"
+        return f"{sql} WHERE {where}" if where else sql
+
+    def _stage(self, table: str, columns: list[str], rows: list[dict]) -> str:
+        staging = f"_stage_{table}"
+        cols = ", ".join(map(_quote, columns))
+        self.conn.execute(f"DROP TABLE IF EXISTS {staging}")
+        self.conn.execute(f"CREATE TEMP TABLE {staging} AS SELECT {cols} FROM {table} LIMIT 0")
+        placeholders = "(" + ", ".join("?" * len(columns)) + ")"
+        for i in range(0, len(rows), self.insert_chunk):
+            chunk = rows[i:i + self.insert_chunk]
+            params = [self._adapt(row.get(c)) for row in chunk for c in columns]
+            self.conn.execute(
+                f"INSERT INTO {staging} ({cols}) VALUES " + ", ".join([placeholders] * len(chunk)),
+                params,
+            )
+        return staging
+
+    def _key_match(self, keys: list[str], columns: list[str]) -> str:
+        conds = []
+        for k in keys:
+            # Generated *_lower columns are not sent; compare against the source column
+            staged = f"lower(s.{_quote(k[:-len('_lower')])})" if k.endswith("_lower") and k not in columns else f"s.{_quote(k)}"
+            conds.append(f"t.{_quote(k)} {self.null_safe_eq} {staged}")
+        return " AND ".join(conds)
+
+    def _rowcount(self, cur) -> int:
+        return cur.rowcount
+
+    def upsert(self, table: str, rows: list[dict], conflict_columns: str | None = None, ignore_duplicates: bool = False) -> int:
+        if not rows:
+            return 0
+        columns = list(rows[0].keys())
+        cols = ", ".join(map(_quote, columns))
+        written = 0
+        self._begin()
+        try:
+            staging = self._stage(table, columns, rows)
+            insert = f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {staging} s"
+            if conflict_columns:
+                keys = conflict_columns.split(",")
+                match = self._key_match(keys, columns)
+                updates = [c for c in columns if c not in keys]
+                if updates and not ignore_duplicates:
+                    sets = ", ".join(f"{_quote(c)} = s.{_quote(c)}" for c in updates)
+                    cur = self.conn.execute(f"UPDATE {table} AS t SET {sets} FROM {staging} s WHERE {match}")
+                    written += self._rowcount(cur)
+                insert += f" WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})"
+            cur = self.conn.execute(insert)
+            written += self._rowcount(cur)
+            self.conn.execute(f"DROP TABLE {staging}")
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return written
+
+    def update_by_ids(self, table: str, values: dict, ids: list[int]) -> int:
+        sets = ", ".join(f"{_quote(c)} = ?" for c in values)
+        updated = 0
+        self._begin()
+        try:
+            for i in range(0, len(ids), self.insert_chunk):
+                chunk = list(ids[i:i + self.insert_chunk])
+                cur = self.conn.execute(
+                    f"UPDATE {table} SET {sets} WHERE id IN ({', '.join('?' * len(chunk))})",
+                    [self._adapt(v) for v in values.values()] + chunk,
+                )
+                updated += self._rowcount(cur)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return updated
+
+    def _fetch(self, query: str, params: list) -> list[dict]:
+        cur = self.conn.execute(query, params)
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+    def select(self, table: str, columns: str) -> list[dict]:
+        cols = ", ".join(_quote(c.strip()) for c in columns.split(","))
+        return self._fetch(f"SELECT {cols} FROM {table}", [])
+
+    def select_page(self, table: str, columns: str, key: str, after, limit: int) -> list[dict]:
+        cols = ", ".join(_quote(c.strip()) for c in columns.split(","))
+        query = f"SELECT {cols} FROM {table}"
+        params: list = []
+        if after is not None:
+            query += f" WHERE {_quote(key)} > ?"
+            params.append(after)
+        query += f" ORDER BY {_quote(key)} LIMIT ?"
+        params.append(limit)
+        return self._fetch(query, params)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,175 @@
+"""Direct PostgreSQL sink using COPY.
+
+Bypasses PostgREST: each upsert streams the rows with `COPY ... FROM STDIN`
+into a temporary staging table, then merges them into the target with a
+single `INSERT ... SELECT ... ON CONFLICT`. One round trip per table instead
+of one per 500-row JSON batch.
+"""
+import json
+from decimal import Decimal
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from pipeline.sinks.base_sink import BaseSink
+
+NUMERIC_OID = 1700
+
+
+def _csv_field(value) -> str:
+    """Render one Postgres CSV field. NULL is an unquoted empty field and
+    every string is quoted, so '' stays distinct from NULL."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    elif isinstance(value, list):
+        items = (
+            "NULL" if v is None else '"' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"'
+            for v in value
+        )
+        value = "{" + ",".join(items) + "}"
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _adapt(value, type_oid: int):
+    """Coerce Python values to what the binary COPY dumpers expect."""
+    if isinstance(value, dict):
+        return Jsonb(value)
+    if isinstance(value, float) and type_oid == NUMERIC_OID:
+        return Decimal(repr(value))
+    return value
+
+
+class PostgresSink(BaseSink):
+    supports_rpc = True
+
+    def __init__(self, dsn: str, copy_format: str = "binary"):
+        if copy_format not in ("binary", "csv"):
+            raise ValueError(f"copy_format must be 'binary' or 'csv', got {copy_format!r}")
+        self.conn = psycopg.connect(dsn, autocommit=True, row_factory=dict_row)
+        self.copy_format = copy_format
+
+    def _column_types(self, table: str, columns: list[str]) -> list[int]:
+        """Type OIDs of the target columns, needed for binary COPY."""
+        query = sql.SQL("SELECT {} FROM {} LIMIT 0").format(
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.Identifier(table),
+        )
+        with self.conn.cursor() as cur:
+            cur.execute(query)
+            return [d.type_code for d in cur.description]
+
+    def _copy_to_staging(self, cur, table: str, staging: str, columns: list[str], rows: list[dict]):
+        cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+        cur.execute(sql.SQL(
+            "CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA"
+        ).format(sql.Identifier(staging), cols, sql.Identifier(table)))
+
+        fmt = sql.SQL("BINARY") if self.copy_format == "binary" else sql.SQL("CSV")
+        copy_stmt = sql.SQL("COPY {} ({}) FROM STDIN (FORMAT {})").format(
+            sql.Identifier(staging), cols, fmt,
+        )
+        if self.copy_format == "csv":
+            with cur.copy(copy_stmt) as copy:
+                for i in range(0, len(rows), 1000):
+                    copy.write("".join(
+                        ",".join(_csv_field(row.get(c)) for c in columns) + "\n"
+                        for row in rows[i:i + 1000]
+                    ))
+            return
+
+        types = self._column_types(table, columns)
+        with cur.copy(copy_stmt) as copy:
+            copy.set_types(types)
+            for row in rows:
+                copy.write_row([_adapt(row.get(c), oid) for c, oid in zip(columns, types)])
+
+    def upsert(self, table: str, rows: list[dict], conflict_columns: str | None = None, ignore_duplicates: bool = False) -> int:
+        if not rows:
+            return 0
+        columns = list(rows[0].keys())
+        staging = f"_stage_{table}"
+        cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+
+        merge = sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(
+            sql.Identifier(table), cols, cols, sql.Identifier(staging),
+        )
+        if conflict_columns:
+            keys = conflict_columns.split(",")
+            updates = [c for c in columns if c not in keys]
+            if ignore_duplicates or not updates:
+                action = sql.SQL("DO NOTHING")
+            else:
+                action = sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(
+                    sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(c), sql.Identifier(c))
+                    for c in updates
+                ))
+            merge += sql.SQL(" ON CONFLICT ({}) {}").format(
+                sql.SQL(", ").join(map(sql.Identifier, keys)), action,
+            )
+
+        with self.conn.transaction(), self.conn.cursor() as cur:
+            self._copy_to_staging(cur, table, staging, columns, rows)
+            cur.execute(merge)
+            return cur.rowcount
+
+    def select(self, table: str, columns: str) -> list[dict]:
+        cols = [c.strip() for c in columns.split(",")]
+        query = sql.SQL("SELECT {} FROM {}").format(
+            sql.SQL(", ").join(map(sql.Identifier, cols)),
+            sql.Identifier(table),
+        )
+        with self.conn.cursor() as cur:
+            cur.execute(query)
+            return cur.fetchall()
+
+    def select_page(self, table: str, columns: str, key: str, after, limit: int) -> list[dict]:
+        cols = [c.strip() for c in columns.split(",")]
+        query = sql.SQL("SELECT {} FROM {}").format(
+            sql.SQL(", ").join(map(sql.Identifier, cols)),
+            sql.Identifier(table),
+        )
+        params: list = []
+        if after is not None:
+            query += sql.SQL(" WHERE {} > %s").format(sql.Identifier(key))
+            params.append(after)
+        query += sql.SQL(" ORDER BY {} LIMIT %s").format(sql.Identifier(key))
+        params.append(limit)
+        with self.conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
+
+    def update_by_ids(self, table: str, values: dict, ids: list[int]) -> int:
+        if not ids:
+            return 0
+        query = sql.SQL("UPDATE {} SET {} WHERE id = ANY(%(ids)s)").format(
+            sql.Identifier(table),
+            sql.SQL(", ").join(
+                sql.SQL("{} = {}").format(sql.Identifier(c), sql.Placeholder(f"v_{c}")) for c in values
+            ),
+        )
+        params = {f"v_{c}": v for c, v in values.items()}
+        params["ids"] = list(ids)
+        with self.conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.rowcount
+
+    def rpc(self, function: str, params: dict | None = None) -> list[dict]:
+        params = params or {}
+        query = sql.SQL("SELECT * FROM {}({})").format(
+            sql.Identifier(function),
+            sql.SQL(", ").join(
+                sql.SQL("{} => {}").format(sql.Identifier(k), sql.Placeholder(k)) for k in params
+            ),
+        )
+        with self.conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall() if cur.description else []
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,36 @@
+"""Local SQLite sink, so the pipeline can run and be benchmarked offline."""
+import json
+import re
+import sqlite3
+from pipeline.sinks.embedded_sink import EmbeddedSink
+
+_TYPE_REWRITES = [
+    (re.compile(r"\bSERIAL PRIMARY KEY\b"), "INTEGER PRIMARY KEY"),
+    (re.compile(r"\bTIMESTAMPTZ DEFAULT NOW\(\)"), "TEXT DEFAULT CURRENT_TIMESTAMP"),
+    (re.compile(r"\bTEXT\[\]"), "TEXT"),
+    (re.compile(r"\bJSONB\b"), "TEXT"),
+    # SQLite unique keys treat NULLs as distinct; the staging merge compares with IS
+    (re.compile(r"\bUNIQUE NULLS NOT DISTINCT\b"), "UNIQUE"),
+]
+
+
+class SQLiteSink(EmbeddedSink):
+    null_safe_eq = "IS"
+
+    def _connect(self, path: str):
+        # stream_rows prefetches pages from a worker thread
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def translate_column_sql(self, table: str, body: str) -> str:
+        for pattern, replacement in _TYPE_REWRITES:
+            body = pattern.sub(replacement, body)
+        return body
+
+    def _adapt(self, value):
+        # Arrays and JSON are stored as JSON text
+        if isinstance(value, (list, dict)):
+            return json.dumps(value)
+        return value
@@ -0,0 +1,192 @@
+"""Spill-to-disk for memory-budgeted runs (--max-memory). Requires the optional `pyarrow` package.
+
+With a budget set, the pipeline checks its resident size at two points:
+- while each lab CSV is loaded, every SPILL_BATCH_ROWS rows: once over budget,
+  the lab's rows parsed so far and the rest of its CSV are streamed to
+  `<spill-dir>/tests/<slug>.arrow`, as is every lab already held in memory,
+  each replaced by a SpilledTests, which reads the rows back a record batch
+  at a time whenever it is iterated. A large CSV is never held in full.
+- before lab_tests rows are uploaded: once over budget, the prepared rows are
+  built into `<spill-dir>/rows/` first, the lookups used to build them are
+  released, and the upload streams the chunks back from disk
+Arrow IPC files keep the types (floats, bools, lists) without a parse step, so
+reading back costs disk I/O and little CPU. After each spill the freed heap
+is handed back to the OS, or resident size would stay at its high-water mark.
+"""
+import ctypes
+import gc
+import itertools
+import json
+import os
+import typing
+from collections.abc import Iterable
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+from pipeline.config import SPILL_AT_FRACTION, SPILL_BATCH_ROWS
+from pipeline.models import NormalizedLabTest
+from pipeline.profiling import rss_mb
+
+try:
+    _malloc_trim = ctypes.CDLL(None).malloc_trim
+except (AttributeError, OSError):  # not glibc
+    _malloc_trim = None
+
+_SCALAR_TYPES = {str: "string", float: "float64", int: "int64", bool: "bool_"}
+
+
+def _arrow_type(annotation):
+    # Optional[X] -> X (nullability is per column in Arrow)
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    if typing.get_origin(annotation) is typing.Union:
+        annotation = args[0]
+    if typing.get_origin(annotation) is list:
+        return pa.list_(_arrow_type(typing.get_args(annotation)[0]))
+    if annotation is dict:
+        # raw_data holds whatever the CSV had; stored as JSON text
+        return pa.string()
+    return getattr(pa, _SCALAR_TYPES[annotation])()
+
+
+def _test_schema():
+    return pa.schema([(name, _arrow_type(field.annotation)) for name, field in NormalizedLabTest.model_fields.items()])
+
+
+def _write_ipc(path: str, schema, batches):
+    """Write record batches to an Arrow IPC file via a temp file, so a crash leaves no torn file."""
+    tmp = path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(tmp, path)
+
+
+def _read_batches(path: str):
+    # OSFile rather than memory_map: mapped pages would count towards the RSS being budgeted
+    with pa.OSFile(path, "rb") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i).to_pylist()
+
+
+def release_memory():
+    """Collect garbage and return the freed pages of the Python, Arrow and C heaps to the OS."""
+    gc.collect()
+    pa.default_memory_pool().release_unused()
+    if _malloc_trim:
+        _malloc_trim(0)
+
+
+def _drain(held: list, rest):
+    """Yield and release the rows parsed so far, then the rest of the source."""
+    held.reverse()
+    while held:
+        yield held.pop()
+    yield from rest
+
+
+class SpilledTests:
+    """One lab's NormalizedLabTests on disk. Iterable any number of times; pickles as just the path."""
+
+    def __init__(self, path: str, count: int):
+        self.path = path
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for rows in _read_batches(self.path):
+            for row in rows:
+                row["raw_data"] = json.loads(row["raw_data"]) if row["raw_data"] else {}
+                # Validated when first loaded
+                yield NormalizedLabTest.model_construct(**row)
+
+
+class SpillStore:
+    def __init__(self, directory: str, max_memory_mb: float):
+        if pa is None:
+            raise ImportError("--max-memory needs the pyarrow package: pip install pyarrow")
+        self.directory = directory
+        self.max_memory_mb = max_memory_mb
+        self.spilled_mb = 0.0
+        os.makedirs(os.path.join(directory, "tests"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "rows"), exist_ok=True)
+
+    def over_budget(self) -> bool:
+        """True once resident size passes SPILL_AT_FRACTION of the budget, leaving headroom for the next step."""
+        return rss_mb() > self.max_memory_mb * SPILL_AT_FRACTION
+
+    def _record(self, path: str):
+        self.spilled_mb += os.path.getsize(path) / (1024 * 1024)
+
+    def spill_tests(self, slug: str, tests: Iterable[NormalizedLabTest]) -> SpilledTests:
+        """Write tests (a list, or a loader's iter_tests) to disk a record batch at a time."""
+        path = os.path.join(self.directory, "tests", f"{slug}.arrow")
+        schema = _test_schema()
+        source = iter(tests)
+        count = 0
+
+        def batches():
+            nonlocal count
+            while batch := list(itertools.islice(source, SPILL_BATCH_ROWS)):
+                rows = [t.model_dump() for t in batch]
+                for row in rows:
+                    row["raw_data"] = json.dumps(row["raw_data"], default=str) if row["raw_data"] else None
+                count += len(rows)
+                yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+        _write_ipc(path, schema, batches())
+        self._record(path)
+        return SpilledTests(path, count)
+
+    def load_tests(self, slug: str, tests: Iterable[NormalizedLabTest]) -> list[NormalizedLabTest] | SpilledTests:
+        """Collect one lab's tests in memory until resident size passes the spill point, then stream to disk."""
+        source = iter(tests)
+        held: list[NormalizedLabTest] = []
+        while batch := list(itertools.islice(source, SPILL_BATCH_ROWS)):
+            held.extend(batch)
+            if self.over_budget():
+                spilled = self.spill_tests(slug, _drain(held, source))
+                release_memory()
+                return spilled
+        return held
+
+    def spill_labs(self, all_tests: dict) -> list[str]:
+        """Spill every lab still held in memory, in place. Returns the slugs spilled."""
+        spilled = []
+        for slug, tests in all_tests.items():
+            if isinstance(tests, list):
+                all_tests[slug] = self.spill_tests(slug, tests)
+                spilled.append(slug)
+        release_memory()
+        return spilled
+
+    def spill_chunks(self, name: str, chunks) -> list[tuple]:
+        """Write each (tag, rows) chunk to its own Arrow file. Returns [(tag, path, rows)].
+
+        One file per chunk, so each chunk's schema is inferred from its own
+        rows (a column that is all null in one chunk need not be in another).
+        """
+        spilled = []
+        for n, (tag, rows) in enumerate(chunks):
+            path = os.path.join(self.directory, "rows", f"{name}-{n:05d}.arrow")
+            batch = pa.RecordBatch.from_pylist(rows)
+            _write_ipc(path, batch.schema, [batch])
+            self._record(path)
+            spilled.append((tag, path, len(rows)))
+        return spilled
+
+    def read_chunks(self, spilled: list[tuple]):
+        """Stream (tag, rows) chunks back from spill_chunks' files, deleting each once read."""
+        for tag, path, _ in spilled:
+            rows = [row for batch in _read_batches(path) for row in batch]
+            os.remove(path)
+            yield tag, rows
+
+    def report(self) -> str:
+        return (f"  Memory: {rss_mb():.0f} MB resident of a {self.max_memory_mb:.0f} MB budget, "
+                f"{self.spilled_mb:.1f} MB spilled to {self.directory}")
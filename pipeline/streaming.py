@@ -0,0 +1,61 @@
+"""Bounded producer/consumer hand-off for streaming uploads.
+
+A producer iterator (e.g. building lab_tests rows) runs on its own thread
+and feeds a bounded queue; the consumer (the uploader) drains it. When the
+queue is full the producer blocks, so at most `maxsize` chunks exist ahead
+of the upload, however large the source is.
+"""
+import queue
+import threading
+
+_DONE = object()
+
+
+class BackgroundIterator:
+    """Iterate `source` on a daemon thread, `maxsize` items ahead of the consumer.
+
+    An exception raised by the producer is re-raised to the consumer. Call
+    close() if the consumer stops early, so the producer is not left blocked.
+    """
+
+    def __init__(self, source, maxsize: int):
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(source,), daemon=True, name="producer")
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, source):
+        try:
+            for item in source:
+                if not self._put((item, None)):
+                    return
+        except BaseException as e:
+            self._put((_DONE, e))
+            return
+        self._put((_DONE, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item, error = self.queue.get()
+        if item is _DONE:
+            # Keep raising StopIteration on later calls
+            self.queue.put((_DONE, None))
+            if error is not None:
+                raise error
+            raise StopIteration
+        return item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
@@ -0,0 +1,266 @@
+"""Synthetic lab catalogues in each lab's CSV format, for scale benchmarks.
+
+Builds a pool of base tests (analyte x modifier combinations, then a long
+tail of allergen and gene panels so any scale has unique names) and lets
+each lab carry a skewed sample of it: common tests are offered by most labs,
+rare ones by one. Every lab renders a test the way its real export does
+(Apollo in capitals, abbreviations with or without the long form, specimen
+suffixes, "(Quantitative)" noise, Agilus' " Package in New delhi"), so the
+ingest, matching and linkage code paths all get exercised. Like the real
+exports, packages carry no list of their tests. Output is deterministic for
+a given seed.
+
+At scale 1 the five files hold roughly the real catalogue (~180K rows, of
+which Apollo's 2,786 tests x 54 centres are ~150K). Scale multiplies the
+number of tests per lab; locations stay fixed.
+"""
+import csv
+import os
+import random
+
+from pipeline.ingest.city_normalizer import APOLLO_CITY_MAP, NEUBERG_CITY_NORMALIZE, TRUSTLAB_CITY_MAP
+
+# (name, abbreviation, Apollo-style department, specimen)
+ANALYTES = [
+    ("Complete Blood Count", "CBC", "HAEMATOLOGY", "EDTA Blood"),
+    ("Erythrocyte Sedimentation Rate", "ESR", "HAEMATOLOGY", "EDTA Blood"),
+    ("Liver Function Test", "LFT", "BIOCHEMISTRY", "Serum"),
+    ("Kidney Function Test", "KFT", "BIOCHEMISTRY", "Serum"),
+    ("Thyroid Function Test", "TFT", "BIOCHEMISTRY", "Serum"),
+    ("Glycated Hemoglobin", "HbA1c", "BIOCHEMISTRY", "EDTA Blood"),
+    ("Fasting Blood Sugar", "FBS", "BIOCHEMISTRY", "Fluoride Plasma"),
+    ("Post Prandial Blood Sugar", "PPBS", "BIOCHEMISTRY", "Fluoride Plasma"),
+    ("Thyroid Stimulating Hormone", "TSH", "ENDOCRINOLOGY", "Serum"),
+    ("Free Triiodothyronine", "FT3", "ENDOCRINOLOGY", "Serum"),
+    ("Free Thyroxine", "FT4", "ENDOCRINOLOGY", "Serum"),
+    ("Prostate Specific Antigen", "PSA", "IMMUNOLOGY", "Serum"),
+    ("Alpha Fetoprotein", "AFP", "IMMUNOLOGY", "Serum"),
+    ("Hepatitis B Surface Antigen", "HBsAg", "SEROLOGY", "Serum"),
+    ("C Reactive Protein", "CRP", "SEROLOGY", "Serum"),
+    ("Antinuclear Antibody", "ANA", "IMMUNOLOGY", "Serum"),
+    ("Lactate Dehydrogenase", "LDH", "BIOCHEMISTRY", "Serum"),
+    ("Aspartate Aminotransferase", "SGOT", "BIOCHEMISTRY", "Serum"),
+    ("Alanine Aminotransferase", "SGPT", "BIOCHEMISTRY", "Serum"),
+    ("Gamma Glutamyl Transferase", "GGT", "BIOCHEMISTRY", "Serum"),
+    ("Alkaline Phosphatase", "ALP", "BIOCHEMISTRY", "Serum"),
+    ("Blood Urea Nitrogen", "BUN", "BIOCHEMISTRY", "Serum"),
+    ("Carcinoembryonic Antigen", "CEA", "IMMUNOLOGY", "Serum"),
+    ("Beta Human Chorionic Gonadotropin", "bHCG", "ENDOCRINOLOGY", "Serum"),
+    ("Immunoglobulin E", "IgE", "ALLERGY", "Serum"),
+    ("Prothrombin Time", "PT", "HAEMATOLOGY", "Citrate Plasma"),
+    ("Activated Partial Thromboplastin Time", "APTT", "HAEMATOLOGY", "Citrate Plasma"),
+    ("Creatine Kinase", "CK", "BIOCHEMISTRY", "Serum"),
+    ("Follicle Stimulating Hormone", "FSH", "ENDOCRINOLOGY", "Serum"),
+    ("Luteinizing Hormone", "LH", "ENDOCRINOLOGY", "Serum"),
+    ("Anti Mullerian Hormone", "AMH", "ENDOCRINOLOGY", "Serum"),
+    ("Rheumatoid Factor", "RF", "SEROLOGY", "Serum"),
+    ("Vitamin D 25 Hydroxy", None, "BIOCHEMISTRY", "Serum"),
+    ("Vitamin B12", None, "BIOCHEMISTRY", "Serum"),
+    ("Ferritin", None, "BIOCHEMISTRY", "Serum"),
+    ("Creatinine", None, "BIOCHEMISTRY", "Serum"),
+    ("Uric Acid", None, "BIOCHEMISTRY", "Serum"),
+    ("Calcium", None, "BIOCHEMISTRY", "Serum"),
+    ("Lipid Profile", None, "BIOCHEMISTRY", "Serum"),
+    ("Dengue NS1 Antigen", None, "SEROLOGY", "Serum"),
+    ("Culture and Sensitivity", None, "MICROBIOLOGY", "Urine"),
+    ("Cortisol", None, "ENDOCRINOLOGY", "Serum"),
+    ("Homocysteine", None, "BIOCHEMISTRY", "Serum"),
+    ("Histopathology Examination", None, "HISTOPATHOLOGY", "Tissue"),
+    ("Karyotyping", None, "CYTOGENETICS", "Heparin Blood"),
+]
+
+MODIFIERS = [
+    "", "Total", "Free", "Ratio", "Antibody IgG", "Antibody IgM", "Level", "Index", "Screen",
+    "Confirmation", "Panel", "Ultrasensitive", "Reflex", "Extended", "Follow Up",
+]
+
+ALLERGEN_GROUPS = ["Food", "Inhalant", "Drug", "Insect", "Mould", "Pollen", "Epidermal", "Occupational"]
+GENES = ["BRCA1", "BRCA2", "EGFR", "KRAS", "JAK2", "HFE", "MTHFR", "CFTR", "FLT3", "NPM1", "BCR ABL", "HLA B27"]
+
+PACKAGE_THEMES = ["Full Body Checkup", "Health Profile", "Wellness Package", "Fever Panel", "Diabetes Care",
+                  "Cardiac Risk Profile", "Womens Health", "Senior Citizen Package", "Pre Operative Profile"]
+PACKAGE_TIERS = ["Basic", "Advanced", "Comprehensive", "Essential", "Platinum", "Gold", "Silver"]
+
+APOLLO_CENTRES = list(APOLLO_CITY_MAP) + [f"SL2{i:02d}" for i in range(54 - len(APOLLO_CITY_MAP))]
+NEUBERG_CITIES = list(NEUBERG_CITY_NORMALIZE)[:5]
+TRUSTLAB_LOCATIONS = list(TRUSTLAB_CITY_MAP)
+
+# Tests per lab at scale 1, and the share of them that are packages
+LAB_TESTS = {
+    "metropolis": 4000,
+    "agilus": 3500,
+    "apollo": 2786,
+    "neuberg": 3000,
+    "trustlab": 2500,
+}
+PACKAGE_SHARE = 0.08
+# Base tests in the pool at scale 1: labs overlap on the common ones
+POOL_SIZE = 15000
+
+LAB_COLUMNS = {
+    "metropolis": ["Test Code", "Test Name", "Price", "Fasting Req?", "NABL", "Test Type", "Reported On", "Method",
+                   "Sample Quantity"],
+    "agilus": ["product_id", "test_code", "test_name", "price", "market_price", "product_type", "home_collection",
+               "tat", "department", "sample_type", "sample_volume", "sample_container", "full_url"],
+    "apollo": ["id", "test_code", "test_name", "mrp", "package_id", "tat", "status", "department_name", "methodology",
+               "sampleType_name", "container", "city_id", "centre_name"],
+    "neuberg": ["service_id", "service_code", "service_name", "price", "mrp", "is_package", "is_home_visit_applicable",
+                "tat_minutes", "alias_name", "is_active", "applicable_gender", "specimen_name", "city_name"],
+    "trustlab": ["id", "test_code", "test_name", "mrp", "l2l_price", "departments", "fasting", "home_collection", "nabl",
+                 "report_tat", "is_active", "location", "test_methodology", "sample_type", "sample_volume",
+                 "sample_container"],
+}
+
+
+def base_tests(n: int) -> list[dict]:
+    """The first n base tests: analyte x modifier combinations, then allergen and gene panels."""
+    tests = []
+    for modifier in MODIFIERS:
+        for name, abbr, dept, specimen in ANALYTES:
+            tests.append({
+                "name": f"{name} {modifier}".strip(),
+                "abbr": f"{abbr} {modifier}".strip() if abbr else None,
+                "dept": dept,
+                "specimen": specimen,
+            })
+    k = 0
+    while len(tests) < n:
+        k += 1
+        group = ALLERGEN_GROUPS[k % len(ALLERGEN_GROUPS)]
+        tests.append({"name": f"{group} Allergen {chr(97 + k % 26)}{k}", "abbr": None,
+                      "dept": "ALLERGY", "specimen": "Serum"})
+        gene = GENES[k % len(GENES)]
+        tests.append({"name": f"{gene} Gene Mutation Exon {k}", "abbr": None,
+                      "dept": "GENOMICS AND MOLECULAR DIAGNOSTICS", "specimen": "EDTA Blood"})
+    return tests[:n]
+
+
+def render_name(test: dict, lab: str, rng: random.Random) -> str:
+    """A lab's spelling of a base test name."""
+    name, abbr = test["name"], test["abbr"]
+    roll = rng.random()
+    if abbr and roll < 0.2:
+        text = abbr
+    elif abbr and roll < 0.35:
+        text = f"{abbr} ({name})"
+    elif roll < 0.55:
+        text = f"{name}, {test['specimen']}"
+    elif roll < 0.6:
+        text = f"{name} (Quantitative)"
+    else:
+        text = name
+    return text.upper() if lab == "apollo" else text
+
+
+def _pick(pool: int, count: int, rng: random.Random) -> list[int]:
+    """`count` distinct pool indices, skewed towards the head so labs share common tests."""
+    count = min(count, pool)
+    picked = set()
+    while len(picked) < count:
+        picked.add(int(pool * rng.random() ** 2))
+    return sorted(picked)
+
+
+def lab_catalogue(lab: str, scale: float, seed: int = 0) -> list[dict]:
+    """One lab's tests: {code, name, price, dept, specimen, tat_hours, package}."""
+    rng = random.Random(f"{seed}:{lab}")
+    pool = base_tests(int(POOL_SIZE * scale))
+    n_tests = int(LAB_TESTS[lab] * scale)
+    n_packages = int(n_tests * PACKAGE_SHARE)
+
+    tests = []
+    for idx in _pick(len(pool), n_tests - n_packages, rng):
+        base = pool[idx]
+        tests.append({
+            "code": f"{lab[:3].upper()}{idx:07d}",
+            "name": render_name(base, lab, rng),
+            "price": round(rng.uniform(150, 6000), -1),
+            "dept": base["dept"],
+            "specimen": base["specimen"],
+            "tat_hours": rng.choice([6, 12, 24, 48, 72, 120]),
+            "package": False,
+        })
+    for k in range(n_packages):
+        # Same theme and tier across labs for the low k, so some packages match
+        theme = PACKAGE_THEMES[k % len(PACKAGE_THEMES)]
+        tier = PACKAGE_TIERS[(k // len(PACKAGE_THEMES)) % len(PACKAGE_TIERS)]
+        tests.append({
+            "code": f"{lab[:3].upper()}P{k:06d}",
+            "name": f"{tier} {theme} {k // (len(PACKAGE_THEMES) * len(PACKAGE_TIERS)) + 1}",
+            "price": round(rng.uniform(999, 15000), -1),
+            "dept": "PACKAGE",
+            "specimen": "Serum",
+            "tat_hours": 48,
+            "package": True,
+        })
+    return tests
+
+
+def _tat_text(hours: int) -> str:
+    return f"{hours} hrs" if hours < 24 else f"{hours // 24} Days"
+
+
+def lab_rows(lab: str, tests: list[dict], rng: random.Random):
+    """CSV rows for one lab, in its export's column layout."""
+    for i, t in enumerate(tests):
+        dept_title = t["dept"].title()
+        if lab == "metropolis":
+            yield {
+                "Test Code": t["code"], "Test Name": t["name"], "Price": t["price"],
+                "Fasting Req?": rng.choice(["YES", "NO", ""]), "NABL": rng.choice(["Y", "N"]),
+                "Test Type": "PKG" if t["package"] else "TEST", "Reported On": f"After {max(1, t['tat_hours'] // 24)} Days",
+                "Method": rng.choice(["CLIA", "ELISA", "Photometry", ""]), "Sample Quantity": "2 mL",
+            }
+        elif lab == "agilus":
+            yield {
+                "product_id": 100000 + i, "test_code": t["code"],
+                "test_name": f"{t['name']} Package in New delhi" if t["package"] else t["name"],
+                "price": t["price"], "market_price": 0, "product_type": "PACKAGE" if t["package"] else "TEST",
+                "home_collection": rng.choice(["true", "false"]), "tat": _tat_text(t["tat_hours"]),
+                "department": "Bio Chemistry" if t["dept"] == "BIOCHEMISTRY" else dept_title,
+                "sample_type": t["specimen"], "sample_volume": "3 mL", "sample_container": "Vacutainer",
+                "full_url": f"https://agilusdiagnostics.com/tests/{t['code'].lower()}",
+            }
+        elif lab == "apollo":
+            for j, centre in enumerate(APOLLO_CENTRES):
+                yield {
+                    "id": i * len(APOLLO_CENTRES) + j, "test_code": t["code"], "test_name": t["name"],
+                    "mrp": t["price"] + 10 * (j % 5), "package_id": 5000 + i if t["package"] else "",
+                    "tat": _tat_text(t["tat_hours"]), "status": "active", "department_name": t["dept"],
+                    "methodology": "", "sampleType_name": t["specimen"].upper(), "container": "",
+                    "city_id": centre, "centre_name": f"Apollo Centre {centre}",
+                }
+        elif lab == "neuberg":
+            for city in NEUBERG_CITIES:
+                yield {
+                    "service_id": 900000 + i, "service_code": t["code"], "service_name": t["name"],
+                    "price": t["price"], "mrp": round(t["price"] * 1.2, -1),
+                    "is_package": "true" if t["package"] else "false", "is_home_visit_applicable": "true",
+                    "tat_minutes": t["tat_hours"] * 60, "alias_name": "", "is_active": "true",
+                    "applicable_gender": "Both", "specimen_name": t["specimen"], "city_name": city,
+                }
+        else:
+            locations = rng.sample(TRUSTLAB_LOCATIONS, rng.randint(1, 5))
+            yield {
+                "id": 700000 + i, "test_code": t["code"], "test_name": t["name"], "mrp": t["price"],
+                "l2l_price": round(t["price"] * 0.7, -1), "departments": "Package" if t["package"] else dept_title,
+                "fasting": rng.choice(["Required", "Not Required"]), "home_collection": "yes",
+                "nabl": rng.choice(["Y", "N"]), "report_tat": _tat_text(t["tat_hours"]), "is_active": "true",
+                "location": ", ".join(locations), "test_methodology": "", "sample_type": t["specimen"],
+                "sample_volume": "2 mL", "sample_container": "",
+            }
+
+
+def write_catalogue(out_dir: str, scale: float = 1.0, seed: int = 0) -> dict[str, str]:
+    """Write <lab>_tests_directory.csv for all five labs. Returns {slug: path}."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for lab, columns in LAB_COLUMNS.items():
+        rng = random.Random(f"{seed}:{lab}:rows")
+        path = os.path.join(out_dir, f"{lab}_tests_directory.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(lab_rows(lab, lab_catalogue(lab, scale, seed), rng))
+        paths[lab] = path
+    return paths
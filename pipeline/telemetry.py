@@ -0,0 +1,184 @@
+"""Per-table upload telemetry for the write layer.
+
+Records request latency (as a histogram), payload bytes, rows, retries and
+error classes for every table written, and exports them as a Prometheus
+text-format file (for node_exporter's textfile collector or a pushgateway)
+and as a JSON run summary.
+"""
+import json
+import os
+import time
+from collections import Counter
+
+# Request latency histogram buckets, seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "labcompare_upload"
+
+
+class TableStats:
+    def __init__(self):
+        self.requests = 0
+        self.rows = 0
+        self.bytes = 0
+        self.retries = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        # bucket upper bound -> requests at or under it (non-cumulative)
+        self.buckets = Counter()
+        self.status = Counter()
+        self.errors = Counter()
+        # Full text of the most recent error per class
+        self.error_samples: dict[str, str] = {}
+        self.first_start: float | None = None
+        self.last_end: float | None = None
+
+    def active_seconds(self) -> float:
+        if self.first_start is None or self.last_end is None:
+            return 0.0
+        return self.last_end - self.first_start
+
+    def rows_per_second(self) -> float:
+        seconds = self.active_seconds()
+        return self.rows / seconds if seconds > 0 else 0.0
+
+
+class UploadTelemetry:
+    def __init__(self):
+        self.tables: dict[str, TableStats] = {}
+        self.started = time.time()
+
+    def _table(self, table: str) -> TableStats:
+        if table not in self.tables:
+            self.tables[table] = TableStats()
+        return self.tables[table]
+
+    def record_request(
+        self,
+        table: str,
+        rows: int,
+        payload_bytes: int,
+        started: float,
+        seconds: float,
+        status: str,
+        error_class: str | None = None,
+        error: str | None = None,
+    ):
+        """Record one write request. `started` is a time.monotonic() value.
+
+        `rows` counts rows acknowledged (0 for a failed request).
+        """
+        stats = self._table(table)
+        stats.requests += 1
+        stats.rows += rows
+        stats.bytes += payload_bytes
+        stats.latency_sum += seconds
+        stats.latency_max = max(stats.latency_max, seconds)
+        stats.buckets[next((b for b in LATENCY_BUCKETS if seconds <= b), float("inf"))] += 1
+        stats.status[status] += 1
+        if error_class:
+            stats.errors[error_class] += 1
+            if error:
+                stats.error_samples[error_class] = error
+        end = started + seconds
+        stats.first_start = started if stats.first_start is None else min(stats.first_start, started)
+        stats.last_end = end if stats.last_end is None else max(stats.last_end, end)
+
+    def record_retry(self, table: str, n: int = 1):
+        self._table(table).retries += n
+
+    def summary(self) -> dict:
+        tables = {}
+        for table, s in sorted(self.tables.items()):
+            tables[table] = {
+                "requests": s.requests,
+                "rows": s.rows,
+                "bytes": s.bytes,
+                "retries": s.retries,
+                "rows_per_second": round(s.rows_per_second(), 1),
+                "active_seconds": round(s.active_seconds(), 3),
+                "latency_avg_seconds": round(s.latency_sum / s.requests, 4) if s.requests else 0.0,
+                "latency_max_seconds": round(s.latency_max, 4),
+                "latency_histogram": {
+                    ("+Inf" if b == float("inf") else str(b)): n for b, n in sorted(s.buckets.items())
+                },
+                "status": dict(s.status),
+                "errors": dict(s.errors),
+                "error_samples": s.error_samples,
+            }
+        return {"started": self.started, "finished": time.time(), "tables": tables}
+
+    def prometheus_text(self) -> str:
+        p = METRIC_PREFIX
+        lines = [
+            f"# HELP {p}_requests_total Write requests by table and status.",
+            f"# TYPE {p}_requests_total counter",
+        ]
+        for table, s in sorted(self.tables.items()):
+            for status, n in sorted(s.status.items()):
+                lines.append(f'{p}_requests_total{{table="{table}",status="{status}"}} {n}')
+
+        for name, help_text, attr in (
+            ("rows_total", "Rows acknowledged by table.", "rows"),
+            ("bytes_total", "Payload bytes sent by table.", "bytes"),
+            ("retries_total", "Re-sent requests (retries and bisection halves) by table.", "retries"),
+        ):
+            lines += [f"# HELP {p}_{name} {help_text}", f"# TYPE {p}_{name} counter"]
+            for table, s in sorted(self.tables.items()):
+                lines.append(f'{p}_{name}{{table="{table}"}} {getattr(s, attr)}')
+
+        lines += [
+            f"# HELP {p}_errors_total Failed requests by table and error class.",
+            f"# TYPE {p}_errors_total counter",
+        ]
+        for table, s in sorted(self.tables.items()):
+            for error_class, n in sorted(s.errors.items()):
+                lines.append(f'{p}_errors_total{{table="{table}",class="{error_class}"}} {n}')
+
+        lines += [
+            f"# HELP {p}_rows_per_second Rows acknowledged per second while the table was loading.",
+            f"# TYPE {p}_rows_per_second gauge",
+        ]
+        for table, s in sorted(self.tables.items()):
+            lines.append(f'{p}_rows_per_second{{table="{table}"}} {s.rows_per_second():.1f}')
+
+        lines += [
+            f"# HELP {p}_request_duration_seconds Write request latency.",
+            f"# TYPE {p}_request_duration_seconds histogram",
+        ]
+        for table, s in sorted(self.tables.items()):
+            cumulative = 0
+            for bound in (*LATENCY_BUCKETS, float("inf")):
+                cumulative += s.buckets.get(bound, 0)
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f'{p}_request_duration_seconds_bucket{{table="{table}",le="{le}"}} {cumulative}')
+            lines.append(f'{p}_request_duration_seconds_sum{{table="{table}"}} {s.latency_sum:.6f}')
+            lines.append(f'{p}_request_duration_seconds_count{{table="{table}"}} {s.requests}')
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> str:
+        if not self.tables:
+            return "  Upload telemetry: no writes"
+        lines = ["  Upload telemetry:"]
+        for table, s in sorted(self.tables.items()):
+            avg = s.latency_sum / s.requests if s.requests else 0.0
+            line = (f"    {table}: {s.rows} rows in {s.requests} requests, {s.bytes / 1e6:.1f} MB, "
+                    f"{s.rows_per_second():.0f} rows/s, avg {avg * 1000:.0f} ms, max {s.latency_max * 1000:.0f} ms, "
+                    f"{s.retries} retries")
+            if s.errors:
+                line += ", errors: " + ", ".join(f"{c}={n}" for c, n in s.errors.most_common())
+            lines.append(line)
+        return "\n".join(lines)
+
+    def write(self, directory: str) -> tuple[str, str]:
+        """Write telemetry.prom and telemetry.json into directory. Returns both paths."""
+        os.makedirs(directory, exist_ok=True)
+        prom_path = os.path.join(directory, "telemetry.prom")
+        json_path = os.path.join(directory, "telemetry.json")
+        # Write-then-rename so a textfile collector never reads a partial file
+        with open(prom_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(prom_path + ".tmp", prom_path)
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        return prom_path, json_path
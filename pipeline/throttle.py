@@ -0,0 +1,90 @@
+"""Flow control for the uploader: byte-sized adaptive batches, a request
+rate limiter and retry backoff.
+
+Rows differ a lot in width (a lab_tests row serializes to ~10x a labs row),
+so batches are cut by serialized bytes rather than row count. Each table's
+byte budget adapts AIMD-style: it grows while requests come back fast and
+shrinks on slow responses, throttling (429), oversized payloads (413) and
+server errors.
+"""
+import asyncio
+import random
+import time
+
+
+class TokenBucket:
+    """Request rate limiter: `rate` requests/s on average, bursts up to `burst`.
+
+    Safe to share between coroutines of one event loop without a lock: a
+    caller reserves its token before awaiting, so the balance may go negative
+    and later callers wait proportionally longer.
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0, retry_after: float | None = None) -> float:
+    """Exponential backoff with full jitter for retry `attempt` (0-based).
+
+    A server-supplied Retry-After is honoured as a lower bound.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class AdaptiveBatchSizer:
+    """Per-table byte budget for the next batch."""
+
+    def __init__(
+        self,
+        target_bytes: int,
+        min_bytes: int = 16_000,
+        max_bytes: int = 4_000_000,
+        target_latency: float = 2.0,
+    ):
+        self.min_bytes = min_bytes
+        self.max_bytes = max(max_bytes, min_bytes)
+        self.budget = float(min(max(target_bytes, min_bytes), self.max_bytes))
+        self.target_latency = target_latency
+
+    def on_success(self, latency: float):
+        if latency < self.target_latency / 2:
+            self.budget = min(self.max_bytes, self.budget * 1.25)
+        elif latency > self.target_latency:
+            self.budget = max(self.min_bytes, self.budget * 0.7)
+
+    def on_pressure(self):
+        """Throttled, payload too large, timed out or a server error: back off hard."""
+        self.budget = max(self.min_bytes, self.budget / 2)
+
+    def cut(self, encoded: list[str], start: int, max_rows: int) -> int:
+        """End index of the next batch from encoded rows starting at `start`.
+
+        Always takes at least one row, at most max_rows, and stops before the
+        byte budget is exceeded.
+        """
+        size = 2  # the surrounding []
+        end = start
+        stop = min(len(encoded), start + max_rows)
+        while end < stop:
+            size += len(encoded[end]) + 1
+            if size > self.budget and end > start:
+                break
+            end += 1
+        return end
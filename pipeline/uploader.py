@@ -0,0 +1,337 @@
+"""Concurrent PostgREST uploader.
+
+Keeps up to `concurrency` batch requests in flight over one pooled keep-alive
+HTTP client instead of waiting for each batch in turn. Uploads are grouped
+into stages: every batch of a stage must be acknowledged before the next
+stage starts, so foreign keys always point at rows that already exist
+(labs -> lab_locations -> canonical_tests -> lab_tests).
+
+Batches are cut by serialized bytes with a per-table budget that adapts
+to observed latency and errors (see pipeline/throttle.py), and requests
+pass a shared token-bucket rate limiter. Throttling (408/429), server errors
+and transport failures are retried with exponential backoff and jitter.
+
+upload_chunks() takes rows as a stream of chunks instead of one list, so
+the caller can build rows while earlier chunks upload (see streaming.py).
+
+A batch the database rejects row by row (409, or a Postgres data or
+constraint error, SQLSTATE class 22/23) is split in half and each half
+retried, recursively, so k bad rows in a batch of n are isolated in
+O(k log n) requests. Isolated rows go to a QuarantineReport with the error
+reason. A 413 (payload too large) is split the same way. Any other 4xx
+(bad key, missing table or column, ...) would fail every row alike, so it
+aborts the upload with UploadAborted instead of bisecting down to
+quarantining the whole table.
+"""
+import asyncio
+import json
+import time
+import httpx
+from pipeline.config import (
+    SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, BATCH_SIZE, UPLOAD_CONCURRENCY,
+    UPLOAD_BATCH_BYTES, UPLOAD_MAX_RETRIES, UPLOAD_RATE_LIMIT,
+)
+from pipeline.throttle import AdaptiveBatchSizer, TokenBucket, backoff_delay
+from pipeline.quarantine import QuarantineReport
+from pipeline.telemetry import UploadTelemetry
+
+# A stage is a list of (table, rows, conflict_columns) jobs that may run together
+UploadJob = tuple[str, list[dict], str | None]
+
+# Transient statuses worth retrying as-is (5xx are retried too)
+RETRY_STATUSES = {408, 429}
+
+# SQLSTATE classes of errors caused by the values of a row: 22 data exception
+# (bad number, string too long, ...) and 23 integrity constraint violation
+ROW_ERROR_CLASSES = ("22", "23")
+
+
+class UploadAborted(RuntimeError):
+    """The server rejected a request for a reason no row of it can fix."""
+
+
+def _error_code(resp: httpx.Response) -> str | None:
+    try:
+        return resp.json().get("code")
+    except (ValueError, AttributeError):
+        return None
+
+
+def _is_row_error(resp: httpx.Response) -> bool:
+    """True when the rejection is about some rows' values, so bisecting can isolate them."""
+    if resp.status_code == 409:
+        return True
+    code = _error_code(resp) or ""
+    return resp.status_code == 400 and len(code) == 5 and code.startswith(ROW_ERROR_CLASSES)
+
+
+def _retry_after(resp: httpx.Response) -> float | None:
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _error_class(resp: httpx.Response) -> str:
+    """'HTTP <status>' plus the PostgREST/Postgres error code when there is one."""
+    code = _error_code(resp)
+    return f"HTTP {resp.status_code} {code}" if code else f"HTTP {resp.status_code}"
+
+
+async def _gather_or_cancel(tasks: list[asyncio.Task]) -> list:
+    """Await all tasks; if one fails, cancel the others before re-raising."""
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def _error_reason(resp: httpx.Response) -> str:
+    """Format a PostgREST error body as 'code: message (details)'."""
+    try:
+        body = resp.json()
+    except ValueError:
+        return f"HTTP {resp.status_code}: {resp.text[:500]}"
+    reason = f"{body.get('code') or resp.status_code}: {body.get('message', '')}"
+    if body.get("details"):
+        reason += f" ({body['details']})"
+    return reason
+
+
+class AsyncUploader:
+    def __init__(
+        self,
+        base_url: str = SUPABASE_URL,
+        api_key: str = SUPABASE_SERVICE_ROLE_KEY,
+        concurrency: int = UPLOAD_CONCURRENCY,
+        batch_size: int = BATCH_SIZE,
+        quarantine: QuarantineReport | None = None,
+        ignore_duplicates: bool = False,
+        telemetry: UploadTelemetry | None = None,
+        target_batch_bytes: int = UPLOAD_BATCH_BYTES,
+        max_retries: int = UPLOAD_MAX_RETRIES,
+        rate_limiter: TokenBucket | None = None,
+        sizers: dict[str, AdaptiveBatchSizer] | None = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.concurrency = max(1, concurrency)
+        self.batch_size = batch_size
+        self.errors: list[str] = []
+        self.quarantine = quarantine if quarantine is not None else QuarantineReport()
+        # On conflict keep the existing row instead of merging the new values
+        self.ignore_duplicates = ignore_duplicates
+        self.telemetry = telemetry if telemetry is not None else UploadTelemetry()
+        # batch_size caps rows per batch; the byte budget usually binds first
+        self.target_batch_bytes = target_batch_bytes
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter if rate_limiter is not None else TokenBucket(UPLOAD_RATE_LIMIT)
+        # Per-table byte budgets; pass a shared dict to carry them across uploaders
+        self.sizers = sizers if sizers is not None else {}
+
+    @classmethod
+    def from_client(cls, client, **kwargs) -> "AsyncUploader":
+        """Reuse the URL and key of an existing Supabase client."""
+        return cls(client.supabase_url, client.supabase_key, **kwargs)
+
+    def _http_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency,
+        )
+        headers = {
+            "apikey": self.api_key,
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        return httpx.AsyncClient(
+            base_url=f"{self.base_url}/rest/v1",
+            headers=headers,
+            limits=limits,
+            timeout=httpx.Timeout(60.0),
+        )
+
+    async def _send(self, http: httpx.AsyncClient, table: str, payload: str, conflict_columns: str | None) -> httpx.Response:
+        params = {}
+        prefer = "return=minimal"
+        if conflict_columns:
+            params["on_conflict"] = conflict_columns
+            resolution = "ignore-duplicates" if self.ignore_duplicates else "merge-duplicates"
+            prefer += f",resolution={resolution}"
+        return await http.post(
+            f"/{table}",
+            params=params,
+            content=payload,
+            headers={"Prefer": prefer},
+        )
+
+    def _sizer(self, table: str) -> AdaptiveBatchSizer:
+        if table not in self.sizers:
+            self.sizers[table] = AdaptiveBatchSizer(self.target_batch_bytes)
+        return self.sizers[table]
+
+    async def _attempt(self, http, sem: asyncio.Semaphore, table: str, payload: str, conflict_columns: str | None):
+        """Send once. Returns (response or None, transport error or None, started, seconds)."""
+        async with sem:
+            await self.rate_limiter.acquire()
+            started = time.monotonic()
+            try:
+                resp = await self._send(http, table, payload, conflict_columns)
+                return resp, None, started, time.monotonic() - started
+            except httpx.HTTPError as e:
+                return None, e, started, time.monotonic() - started
+
+    async def _upload_batch(self, http, sem: asyncio.Semaphore, table: str, batch: list[dict], encoded: list[str],
+                            conflict_columns: str | None) -> int:
+        payload = "[" + ",".join(encoded) + "]"
+        sizer = self._sizer(table)
+
+        for attempt in range(self.max_retries + 1):
+            resp, error, started, seconds = await self._attempt(http, sem, table, payload, conflict_columns)
+
+            if resp is not None and resp.is_success:
+                self.telemetry.record_request(table, len(batch), len(payload), started, seconds, str(resp.status_code))
+                sizer.on_success(seconds)
+                return len(batch)
+
+            if resp is None:
+                reason = f"{type(error).__name__}: {error}"
+                self.telemetry.record_request(
+                    table, 0, len(payload), started, seconds, "transport_error", type(error).__name__, reason,
+                )
+                retry_after = None
+            else:
+                reason = _error_reason(resp)
+                self.telemetry.record_request(
+                    table, 0, len(payload), started, seconds, str(resp.status_code), _error_class(resp), reason,
+                )
+                if resp.status_code == 413:
+                    sizer.on_pressure()
+                    break
+                if resp.status_code not in RETRY_STATUSES and resp.status_code < 500:
+                    if _is_row_error(resp):
+                        # The database rejected a row: retrying the same batch won't help
+                        break
+                    # Auth, missing table or column, ...: every batch would fail the same way
+                    raise UploadAborted(f"{table}: upload aborted on HTTP {resp.status_code}: {reason}")
+                retry_after = _retry_after(resp)
+
+            # Throttled, server error or transport failure: back off and retry
+            sizer.on_pressure()
+            if attempt == self.max_retries:
+                self.errors.append(f"{table}: gave up after {attempt + 1} attempts: {reason}")
+                return 0
+            self.telemetry.record_retry(table)
+            await asyncio.sleep(backoff_delay(attempt, retry_after=retry_after))
+
+        if len(batch) == 1:
+            self.quarantine.add(table, batch[0], reason)
+            return 0
+
+        # Bisect: isolates rejected rows, and shrinks a batch that was too large
+        mid = len(batch) // 2
+        self.telemetry.record_retry(table, 2)
+        results = await _gather_or_cancel([
+            asyncio.create_task(self._upload_batch(http, sem, table, batch[:mid], encoded[:mid], conflict_columns)),
+            asyncio.create_task(self._upload_batch(http, sem, table, batch[mid:], encoded[mid:], conflict_columns)),
+        ])
+        return sum(results)
+
+    async def _upload_table(self, http, sem: asyncio.Semaphore, table: str, rows: list[dict], conflict_columns: str | None) -> int:
+        encoded = [json.dumps(row, default=str) for row in rows]
+        sizer = self._sizer(table)
+        # Each batch is cut only when one of `concurrency` outstanding batches
+        # finishes, so its size reflects the budget learned so far
+        window = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        failed = []
+
+        def on_done(task: asyncio.Task):
+            window.release()
+            if not task.cancelled() and task.exception() is not None:
+                failed.append(task)
+
+        start = 0
+        # Stop cutting batches once one has aborted the upload
+        while start < len(rows) and not failed:
+            await window.acquire()
+            end = sizer.cut(encoded, start, self.batch_size)
+            task = asyncio.create_task(
+                self._upload_batch(http, sem, table, rows[start:end], encoded[start:end], conflict_columns)
+            )
+            task.add_done_callback(on_done)
+            tasks.append(task)
+            start = end
+        results = await _gather_or_cancel(tasks)
+        return sum(results)
+
+    async def upload_stages_async(self, stages: list[list[UploadJob]]) -> dict[str, int]:
+        totals: dict[str, int] = {}
+        sem = asyncio.Semaphore(self.concurrency)
+        async with self._http_client() as http:
+            for stage in stages:
+                # Barrier: the whole stage is acknowledged before the next begins
+                results = await _gather_or_cancel([
+                    asyncio.create_task(self._upload_table(http, sem, table, rows, conflict_columns))
+                    for table, rows, conflict_columns in stage
+                ])
+                for (table, _, _), count in zip(stage, results):
+                    totals[table] = totals.get(table, 0) + count
+        return totals
+
+    def upload_stages(self, stages: list[list[UploadJob]]) -> dict[str, int]:
+        """Upload stages in order. Returns {table: rows written}."""
+        return asyncio.run(self.upload_stages_async(stages))
+
+    async def upload_chunks_async(self, table: str, chunks, conflict_columns: str | None = None,
+                                  on_chunk=None, chunks_in_flight: int = 2) -> int:
+        """Upload (tag, rows) chunks drawn from a blocking iterator.
+
+        Up to `chunks_in_flight` chunks upload at once, so the next chunk is
+        serialized while the previous one's requests are on the wire.
+        `on_chunk(tag, written)` is called in chunk order once each chunk is
+        fully acknowledged.
+        """
+        total = 0
+        sem = asyncio.Semaphore(self.concurrency)
+        in_flight: list[tuple[object, asyncio.Task]] = []
+
+        async def ack_oldest():
+            nonlocal total
+            tag, task = in_flight.pop(0)
+            written = await task
+            total += written
+            if on_chunk:
+                on_chunk(tag, written)
+
+        async with self._http_client() as http:
+            try:
+                while True:
+                    # The iterator may block on its producer, so wait off the event loop
+                    item = await asyncio.to_thread(next, chunks, None)
+                    if item is None:
+                        break
+                    tag, rows = item
+                    in_flight.append((tag, asyncio.create_task(
+                        self._upload_table(http, sem, table, rows, conflict_columns)
+                    )))
+                    if len(in_flight) >= chunks_in_flight:
+                        await ack_oldest()
+                while in_flight:
+                    await ack_oldest()
+            finally:
+                for _, task in in_flight:
+                    task.cancel()
+        return total
+
+    def upload_chunks(self, table: str, chunks, conflict_columns: str | None = None, on_chunk=None) -> int:
+        """Upload a stream of (tag, rows) chunks. Returns rows written."""
+        return asyncio.run(self.upload_chunks_async(table, iter(chunks), conflict_columns, on_chunk))
+
+    def upload(self, table: str, rows: list[dict], conflict_columns: str | None = None) -> int:
+        """Upload a single table concurrently. Returns rows written."""
+        if not rows:
+            return 0
+        return self.upload_stages([[(table, rows, conflict_columns)]])[table]
@@ -0,0 +1,188 @@
+"""Scale benchmark of the pipeline on synthetic catalogues.
+
+Usage:
+    python scripts/bench_pipeline.py [--scales 0.5,1,2] [--sink sqlite] [--output runs/bench_pipeline.json]
+                                     [--compare previous.json] [--data-dir DIR] [--match-sample 0.1]
+
+For each scale (default 1), writes all five lab CSVs with
+pipeline/synthetic.py, then times the real pipeline code on them in a fresh
+process:
+  ingest  the lab loaders reading the CSVs
+  match   step 4 (name passes and package matching)
+  upload  steps 1, 3, 5 and 6 into a local SQLite/DuckDB file
+Matching grows about quadratically with the catalogue (roughly 80s at 1x
+and 330s at 2x), so a full 10x run takes hours. --match-sample F matches
+only the fraction F of each lab's tests, picked by a hash of their source
+key; ingest and upload still see every row, and rows outside the sample
+link by name where they can. With F = 1/scale, e.g. `--scales 10
+--match-sample 0.1`, matching takes minutes (114s at 4x with 0.25, against
+80s for the full 1x). Ingest still holds every row, about 600 MB per 1x.
+and prints rows, seconds, rows/s and peak RSS per phase. Results are saved as
+JSON; `--compare` prints the rows/s change against an earlier run, so a
+regression shows up as a number.
+"""
+import sys
+import os
+import io
+import json
+import time
+import zlib
+import argparse
+import tempfile
+import contextlib
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, "runs", "bench_pipeline.json")
+RESULT_PREFIX = "RESULT "
+
+from pipeline.profiling import peak_rss_mb, reset_peak_rss
+
+
+def in_sample(t, fraction: float) -> bool:
+    """Stable choice of a test (and all its location rows) for --match-sample."""
+    return zlib.crc32(t.source_key().encode()) < fraction * 2**32
+
+
+def run_scale(scale: float, sink_kind: str, data_dir: str, seed: int, verbose: bool,
+              match_sample: float = 1.0) -> list[dict]:
+    """Generate, ingest, match and upload one scale in this process."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import run_pipeline
+    from pipeline.db import open_sink
+    from pipeline.synthetic import write_catalogue
+
+    results = []
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+    def phase(name: str, fn, sample: float = 1.0):
+        reset_peak_rss()
+        start = time.perf_counter()
+        with quiet:
+            value, rows = fn()
+        seconds = time.perf_counter() - start
+        results.append({
+            "scale": scale, "phase": name, "rows": rows, "seconds": round(seconds, 3),
+            "rows_per_second": round(rows / seconds, 1) if seconds > 0 else 0.0,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "sample": sample,
+        })
+        print(f"  {scale:>6g}x {name:<9} {rows:>10} rows {seconds:>9.2f}s", file=sys.stderr)
+        return value
+
+    def generate():
+        paths = write_catalogue(data_dir, scale, seed)
+        return paths, sum(sum(1 for _ in open(p, encoding="utf-8")) - 1 for p in paths.values())
+
+    def ingest():
+        loaders = {
+            "metropolis": run_pipeline.MetropolisLoader(),
+            "agilus": run_pipeline.AgilusLoader(),
+            "apollo": run_pipeline.ApolloLoader(),
+            "neuberg": run_pipeline.NeubergLoader(),
+            "trustlab": run_pipeline.TRUSTlabLoader(),
+        }
+        all_tests = {slug: loader.load(paths[slug]) for slug, loader in loaders.items()}
+        return (all_tests, loaders), sum(len(v) for v in all_tests.values())
+
+    def match():
+        sampled = all_tests
+        if match_sample < 1:
+            sampled = {slug: [t for t in tests if in_sample(t, match_sample)] for slug, tests in all_tests.items()}
+        result = run_pipeline.step4_run_matching(sampled, loaders)
+        return result, sum(len(members) for members in result[0].clusters.values())
+
+    def upload():
+        db_path = os.path.join(data_dir, f"bench.{sink_kind}")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        sink = open_sink(sink_kind, db_path)
+        try:
+            run_pipeline.step1_seed_reference_data(sink)
+            lab_id_map, _, loc_lookup = run_pipeline.step3_create_lab_locations(sink, all_tests)
+            cluster_to_ct_id = run_pipeline.step5_upload_canonical_tests(sink, canonicals, lab_id_map)
+            diffs, _ = run_pipeline.step6_upload_lab_tests(
+                sink, all_tests, matcher, lab_id_map, loc_lookup, cluster_to_ct_id,
+            )
+            # A fresh database: every row is new
+            written = len(cluster_to_ct_id) + sum(c["inserted"] for c in diffs.values())
+        finally:
+            sink.close()
+        return None, written
+
+    paths = phase("generate", generate)
+    all_tests, loaders = phase("ingest", ingest)
+    matcher, _, canonicals = phase("match", match, match_sample)
+    phase("upload", upload)
+    return results
+
+
+def print_table(results: list[dict], baseline: list[dict] | None = None):
+    before = {(r["scale"], r["phase"]): r for r in baseline or []}
+    header = f"{'scale':>6} {'phase':<9} {'rows':>10} {'seconds':>9} {'rows/s':>10} {'peak MB':>9}"
+    print(header + ("   vs baseline" if baseline else ""))
+    for r in results:
+        line = (f"{r['scale']:>5g}x {r['phase']:<9} {r['rows']:>10} {r['seconds']:>9.2f} "
+                f"{r['rows_per_second']:>10.0f} {r['peak_rss_mb']:>9.0f}")
+        if r.get("sample", 1.0) < 1:
+            line += f"   (matched a {r['sample']:.0%} sample)"
+        old = before.get((r["scale"], r["phase"]))
+        if old and old["rows_per_second"]:
+            change = (r["rows_per_second"] / old["rows_per_second"] - 1) * 100
+            line += f"   {change:+6.1f}% rows/s, {r['peak_rss_mb'] - old['peak_rss_mb']:+.0f} MB"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1", help="comma-separated catalogue scales, e.g. 0.5,1,2")
+    parser.add_argument("--sink", choices=("sqlite", "duckdb"), default="sqlite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=None, help="keep generated CSVs here (default: a temp dir)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--compare", default=None, help="earlier --output JSON to compare against")
+    parser.add_argument("--match-sample", type=float, default=1.0,
+                        help="match only this fraction of each lab's tests (e.g. 0.1 at 10x)")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    parser.add_argument("--worker", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        # One scale per process, so peak memory is not carried over between scales
+        results = run_scale(args.worker, args.sink, args.data_dir, args.seed, args.verbose, args.match_sample)
+        print(RESULT_PREFIX + json.dumps(results))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in [float(s) for s in args.scales.split(",")]:
+            data_dir = os.path.join(args.data_dir or tmp, f"scale_{scale:g}")
+            cmd = [sys.executable, os.path.abspath(__file__), "--worker", str(scale), "--sink", args.sink,
+                   "--seed", str(args.seed), "--data-dir", data_dir, "--match-sample", str(args.match_sample)]
+            if args.verbose:
+                cmd.append("--verbose")
+            proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, env={**os.environ, "TQDM_DISABLE": "1"})
+            lines = proc.stdout.splitlines()
+            if args.verbose:
+                print("\n".join(l for l in lines if not l.startswith(RESULT_PREFIX)))
+            if proc.returncode != 0:
+                print(f"ERROR: scale {scale:g} failed (exit {proc.returncode})")
+                sys.exit(1)
+            results += json.loads(next(l for l in lines if l.startswith(RESULT_PREFIX))[len(RESULT_PREFIX):])
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print()
+    print_table(results, baseline)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"sink": args.sink, "seed": args.seed, "finished": time.time(), "results": results}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""EXPLAIN-based benchmark of the dashboard's lab_tests reads under different layouts.
+
+Usage:
+    DATABASE_URL=postgresql://postgres@localhost/postgres python scripts/bench_queries.py \\
+        [--layouts baseline,covering,partitioned] [--runs 5] [--plans] [--output runs/bench_queries.json]
+
+Copies the lab_tests rows already loaded in the public schema (run the
+pipeline first, e.g. on pipeline/synthetic.py data) into one throwaway
+`bench_<layout>` schema per layout:
+  baseline     the single-column indexes schema.sql had before covering_indexes.sql
+  covering     the covering indexes of covering_indexes.sql
+  partitioned  covering indexes on lab_tests list-partitioned by lab_id
+Each schema gets its own test_comparison view; the other tables are read
+from public. Every query then runs under EXPLAIN (ANALYZE, BUFFERS) and the
+median execution time, shared buffers touched, heap fetches and the scans
+of lab_tests are printed per layout. Buffers are the stable number to
+compare; timings on a small local database are mostly noise.
+The bench schemas are dropped afterwards.
+"""
+import sys
+import os
+import re
+import json
+import argparse
+import statistics
+from collections import Counter
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import psycopg
+
+from pipeline.config import DATABASE_URL
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
+
+NATURAL_KEY = "UNIQUE NULLS NOT DISTINCT (lab_id, source_key, lab_location_id)"
+COMMON_INDEXES = [
+    "CREATE INDEX ON lab_tests(lab_location_id)",
+    "CREATE INDEX ON lab_tests(source_test_code, lab_id)",
+]
+BASELINE_INDEXES = [
+    "CREATE INDEX ON lab_tests(canonical_test_id) WHERE canonical_test_id IS NOT NULL",
+    "CREATE INDEX ON lab_tests(lab_id)",
+]
+COVERING_INDEXES = [
+    "CREATE INDEX ON lab_tests(canonical_test_id, is_active) INCLUDE (price, lab_id, lab_location_id, tat_hours) "
+    "WHERE canonical_test_id IS NOT NULL",
+    "CREATE INDEX ON lab_tests(lab_id, is_active) INCLUDE (canonical_test_id, price, lab_location_id)",
+]
+# layout -> (partitioned by lab_id, indexes besides the common ones)
+LAYOUTS = {
+    "baseline": (False, BASELINE_INDEXES),
+    "covering": (False, COVERING_INDEXES),
+    "partitioned": (True, COVERING_INDEXES),
+}
+
+# The lab_tests access paths of the dashboard and the RPCs
+QUERIES = {
+    # getTestComparison
+    "comparison": "SELECT * FROM test_comparison WHERE canonical_test_id = %(test_id)s ORDER BY price",
+    "comparison_city": (
+        "SELECT * FROM test_comparison WHERE canonical_test_id = %(test_id)s AND city = %(city)s ORDER BY price"
+    ),
+    # Per-test prices, as the price stats and search lab counts read them
+    "test_prices": (
+        "SELECT lab_id, lab_location_id, price, tat_hours FROM lab_tests "
+        "WHERE canonical_test_id = %(test_id)s AND is_active = TRUE"
+    ),
+    # getLabTests, without and with a city
+    "lab_page": (
+        "SELECT canonical_test_id, price, lab_location_id FROM lab_tests "
+        "WHERE lab_id = %(lab_id)s AND is_active = TRUE AND price > 0 AND canonical_test_id IS NOT NULL LIMIT 1000"
+    ),
+    "lab_page_city": (
+        "SELECT canonical_test_id, price, lab_location_id FROM lab_tests "
+        "WHERE lab_id = %(lab_id)s AND is_active = TRUE AND price > 0 AND canonical_test_id IS NOT NULL "
+        "AND lab_location_id IN (SELECT id FROM lab_locations WHERE city_id = %(city_id)s) LIMIT 1000"
+    ),
+    # The aggregate of refresh_canonical_test_price_stats()
+    "price_stats": (
+        "SELECT lt.canonical_test_id, ll.city_id, count(DISTINCT lt.lab_id), min(lt.price), max(lt.price) "
+        "FROM lab_tests lt LEFT JOIN lab_locations ll ON ll.id = lt.lab_location_id "
+        "WHERE lt.is_active = TRUE AND lt.canonical_test_id IS NOT NULL GROUP BY 1, 2"
+    ),
+}
+
+
+def comparison_view_sql() -> str:
+    """The CREATE VIEW test_comparison statement from schema.sql."""
+    with open(SCHEMA_PATH, encoding="utf-8") as f:
+        return re.search(r"CREATE OR REPLACE VIEW test_comparison AS.*?;", f.read(), re.S).group(0)
+
+
+def pick_params(conn) -> dict:
+    """The busiest test, lab and city, so every query has rows to find."""
+    test_id = conn.execute(
+        "SELECT canonical_test_id FROM lab_tests WHERE is_active AND canonical_test_id IS NOT NULL "
+        "GROUP BY 1 ORDER BY count(*) DESC, 1 LIMIT 1"
+    ).fetchone()
+    if test_id is None:
+        sys.exit("ERROR: public.lab_tests has no linked rows; run the pipeline first")
+    lab_id = conn.execute("SELECT lab_id FROM lab_tests GROUP BY 1 ORDER BY count(*) DESC, 1 LIMIT 1").fetchone()
+    city = conn.execute(
+        "SELECT c.id, c.name FROM lab_tests lt JOIN lab_locations ll ON ll.id = lt.lab_location_id "
+        "JOIN cities c ON c.id = ll.city_id WHERE lt.canonical_test_id = %s "
+        "GROUP BY 1, 2 ORDER BY count(*) DESC, 1 LIMIT 1", test_id,
+    ).fetchone()
+    return {"test_id": test_id[0], "lab_id": lab_id[0], "city_id": city[0], "city": city[1]}
+
+
+def build_layout(conn, layout: str) -> str:
+    """Create bench_<layout> with a copy of public.lab_tests. Returns the schema name."""
+    partitioned, indexes = LAYOUTS[layout]
+    schema = f"bench_{layout}"
+    conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    conn.execute(f"CREATE SCHEMA {schema}")
+    conn.execute(f"SET search_path TO {schema}, public")
+    conn.execute(
+        "CREATE TABLE lab_tests (LIKE public.lab_tests INCLUDING DEFAULTS)"
+        + (" PARTITION BY LIST (lab_id)" if partitioned else "")
+    )
+    if partitioned:
+        for (lab_id,) in conn.execute("SELECT id FROM public.labs ORDER BY id").fetchall():
+            conn.execute(f"CREATE TABLE lab_tests_lab{lab_id} PARTITION OF lab_tests FOR VALUES IN ({lab_id})")
+        conn.execute("CREATE TABLE lab_tests_default PARTITION OF lab_tests DEFAULT")
+    conn.execute("INSERT INTO lab_tests SELECT * FROM public.lab_tests")
+    # A partitioned table's unique constraints must contain the partition key
+    conn.execute(f"ALTER TABLE lab_tests ADD PRIMARY KEY ({'id, lab_id' if partitioned else 'id'})")
+    conn.execute(f"ALTER TABLE lab_tests ADD CONSTRAINT lab_tests_natural_key {NATURAL_KEY}")
+    for statement in COMMON_INDEXES + indexes:
+        conn.execute(statement)
+    conn.execute(comparison_view_sql())
+    # Sets the visibility map, which index-only scans need to skip the heap
+    conn.execute("VACUUM (ANALYZE) lab_tests")
+    return schema
+
+
+def scans(plan: dict, found: Counter | None = None) -> Counter:
+    """Count the scan nodes on lab_tests (or its partitions) in a JSON plan."""
+    found = Counter() if found is None else found
+    if plan.get("Relation Name", "").startswith("lab_tests"):
+        found[plan["Node Type"]] += 1
+    for child in plan.get("Plans", []):
+        scans(child, found)
+    return found
+
+
+def heap_fetches(plan: dict) -> int:
+    return plan.get("Heap Fetches", 0) + sum(heap_fetches(child) for child in plan.get("Plans", []))
+
+
+def measure(conn, sql: str, params: dict, runs: int) -> dict:
+    explain = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql
+    conn.execute(explain, params)  # warm the cache
+    times, result = [], None
+    for _ in range(runs):
+        result = conn.execute(explain, params).fetchone()[0][0]
+        times.append(result["Planning Time"] + result["Execution Time"])
+    plan = result["Plan"]
+    return {
+        "ms": round(statistics.median(times), 3),
+        "buffers": plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0),
+        "heap_fetches": heap_fetches(plan),
+        "scans": dict(scans(plan)),
+        "rows": plan["Actual Rows"],
+    }
+
+
+def print_plan(conn, sql: str, params: dict):
+    for (line,) in conn.execute("EXPLAIN (ANALYZE, BUFFERS, COSTS OFF) " + sql, params).fetchall():
+        print(f"      {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layouts", default=",".join(LAYOUTS), help="comma-separated, from: " + ", ".join(LAYOUTS))
+    parser.add_argument("--runs", type=int, default=5, help="EXPLAIN ANALYZE runs per query (median reported)")
+    parser.add_argument("--plans", action="store_true", help="also print each query's plan per layout")
+    parser.add_argument("--output", default=None, help="write the results as JSON here")
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        sys.exit("ERROR: set DATABASE_URL to a local Postgres with the pipeline's data loaded")
+    layouts = args.layouts.split(",")
+    unknown = [l for l in layouts if l not in LAYOUTS]
+    if unknown:
+        sys.exit(f"ERROR: unknown layouts: {', '.join(unknown)}")
+
+    conn = psycopg.connect(DATABASE_URL, autocommit=True)
+    params = pick_params(conn)
+    total = conn.execute("SELECT count(*) FROM public.lab_tests").fetchone()[0]
+    print(f"lab_tests: {total} rows; test {params['test_id']}, lab {params['lab_id']}, city {params['city']}\n")
+
+    results = []
+    try:
+        for layout in layouts:
+            schema = build_layout(conn, layout)
+            for name, sql in QUERIES.items():
+                result = {"layout": layout, "query": name, **measure(conn, sql, params, args.runs)}
+                results.append(result)
+                if args.plans:
+                    print(f"  {layout} / {name}:")
+                    print_plan(conn, sql, params)
+            conn.execute(f"DROP SCHEMA {schema} CASCADE")
+            conn.execute("SET search_path TO public")
+    finally:
+        for layout in layouts:
+            conn.execute(f"DROP SCHEMA IF EXISTS bench_{layout} CASCADE")
+        conn.close()
+
+    print(f"{'query':<16} {'layout':<12} {'ms':>8} {'buffers':>8} {'heap':>6} {'rows':>6}  lab_tests scans")
+    for name in QUERIES:
+        for r in (r for r in results if r["query"] == name):
+            scan_text = ", ".join(f"{n}x {node}" for node, n in sorted(r["scans"].items()))
+            print(f"{name:<16} {r['layout']:<12} {r['ms']:>8.2f} {r['buffers']:>8} {r['heap_fetches']:>6} "
+                  f"{r['rows']:>6}  {scan_text}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"rows": total, "params": params, "results": results}, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Load throughput of each storage backend.
+
+Usage:
+    python scripts/bench_sinks.py [--rows 100000] [--backends sqlite,duckdb,postgres]
+
+Loads a synthetic lab_tests catalogue (plus the labs, locations and
+canonical tests it references) into every available backend twice: the
+first pass inserts, the second updates every row in place. Prints rows/s
+per pass. The postgres backend needs DATABASE_URL and runs inside a
+throwaway `bench_sinks` schema; duckdb needs the duckdb package.
+"""
+import sys
+import os
+import time
+import argparse
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from pipeline.config import DATABASE_URL
+from pipeline.db import NATURAL_KEYS, open_sink, dedupe_by_key, stream_rows
+
+BENCH_SCHEMA = "bench_sinks"
+LABS = ["metropolis", "agilus", "apollo", "neuberg", "trustlab"]
+
+
+def synthetic_lab_tests(n: int, lab_ids: dict, loc_ids: list[int], ct_ids: list[int], price: float) -> list[dict]:
+    rows = []
+    for i in range(n):
+        lab = LABS[i % len(LABS)]
+        rows.append({
+            "lab_id": lab_ids[lab],
+            "canonical_test_id": ct_ids[i % len(ct_ids)],
+            "lab_location_id": loc_ids[(i // len(LABS)) % len(loc_ids)],
+            "source_test_code": f"{lab[:3].upper()}{i // (len(LABS) * len(loc_ids))}",
+            "source_key": f"{lab[:3].upper()}{i // (len(LABS) * len(loc_ids))}",
+            "source_test_name": f"Synthetic Test {i % 5000}, Serum",
+            "price": price + i % 900,
+            "mrp": price + i % 900 + 100,
+            "test_type": "package" if i % 10 == 0 else "test",
+            "department_raw": "Biochemistry",
+            "sample_type": "Serum",
+            "tat_hours": 24,
+            "home_collection": True,
+            "match_confidence": 0.9,
+            "match_method": "exact_name",
+            "is_active": True,
+        })
+    return dedupe_by_key(rows, NATURAL_KEYS["lab_tests"])
+
+
+def load(sink, n_rows: int, price: float) -> tuple[int, float]:
+    """Load the whole catalogue once. Returns (lab_tests written, seconds)."""
+    start = time.perf_counter()
+    sink.upsert("labs", [{"name": s.title(), "slug": s} for s in LABS], NATURAL_KEYS["labs"])
+    lab_ids = {r["slug"]: r["id"] for r in stream_rows(sink, "labs", "id, slug")}
+
+    sink.upsert("lab_locations", [
+        {"lab_id": lab_ids[s], "location_code": f"LOC{j}", "location_name": f"Location {j}"}
+        for s in LABS for j in range(20)
+    ], NATURAL_KEYS["lab_locations"])
+    loc_ids = [r["id"] for r in stream_rows(sink, "lab_locations", "id")]
+
+    sink.upsert("canonical_tests", [
+        {"name": f"Synthetic Test {j}", "slug": f"synthetic-test-{j}", "keywords": [f"Synthetic Test {j}"]}
+        for j in range(5000)
+    ], NATURAL_KEYS["canonical_tests"])
+    ct_ids = [r["id"] for r in stream_rows(sink, "canonical_tests", "id")]
+
+    rows = synthetic_lab_tests(n_rows, lab_ids, loc_ids, ct_ids, price)
+    written = sink.upsert("lab_tests", rows, NATURAL_KEYS["lab_tests"])
+    return written, time.perf_counter() - start
+
+
+def open_backend(kind: str, workdir: str):
+    if kind == "postgres":
+        sink = open_sink("postgres", DATABASE_URL)
+        sink.conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        sink.conn.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+        sink.conn.execute(f"SET search_path TO {BENCH_SCHEMA}, public")
+        with open(os.path.join(os.path.dirname(__file__), "schema.sql")) as f:
+            sink.conn.execute(f.read())
+        return sink
+    return open_sink(kind, os.path.join(workdir, f"bench.{kind}"))
+
+
+def available(kind: str) -> bool:
+    if kind == "postgres":
+        return bool(DATABASE_URL)
+    if kind == "duckdb":
+        try:
+            import duckdb  # noqa: F401
+        except ImportError:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--backends", default="sqlite,duckdb,postgres")
+    args = parser.parse_args()
+
+    print(f"{'backend':<10} {'pass':<8} {'rows':>8} {'seconds':>8} {'rows/s':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for kind in args.backends.split(","):
+            if not available(kind):
+                print(f"{kind:<10} skipped (not installed / not configured)")
+                continue
+            sink = open_backend(kind, workdir)
+            try:
+                for label, price in (("insert", 100.0), ("update", 120.0)):
+                    written, seconds = load(sink, args.rows, price)
+                    print(f"{kind:<10} {label:<8} {written:>8} {seconds:>8.2f} {written / seconds:>10.0f}")
+            finally:
+                if kind == "postgres":
+                    sink.conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+                sink.close()
+
+
+if __name__ == "__main__":
+    main()
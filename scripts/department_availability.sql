@@ -0,0 +1,65 @@
+-- =============================================
+-- Precomputed availability matrix with a single-call RPC
+-- getAvailabilityMatrix in the dashboard used to page through every active
+-- lab_tests row of a city and count canonical tests per department and lab
+-- in the browser, and canonical_tests.department_id was never set, so every
+-- count landed under "Other". The pipeline now resolves each canonical
+-- test's department by majority vote of its members' raw departments
+-- (majority_department() in pipeline/ingest/department_normalizer.py) and
+-- computes the counts once per run (step "availability",
+-- pipeline/rollups.py): one department_availability row per (city,
+-- department, lab) with the number of distinct canonical tests. Rows are
+-- upserted by row_hash; combinations that disappear are set
+-- is_active = false.
+-- get_availability_matrix() returns a city's counts with department names
+-- and lab slugs in one query.
+--
+-- Run once in the SQL editor on databases created before
+-- department_availability was added to schema.sql.
+-- =============================================
+
+CREATE TABLE IF NOT EXISTS department_availability (
+    id                  SERIAL PRIMARY KEY,
+    city_id             INT NOT NULL REFERENCES cities(id),
+    department_id       INT NOT NULL REFERENCES departments(id),
+    lab_id              INT NOT NULL REFERENCES labs(id),
+    test_count          INT NOT NULL,  -- distinct canonical tests
+    is_active           BOOLEAN DEFAULT TRUE,
+    row_hash            TEXT,  -- content hash for diff-only uploads
+    CONSTRAINT department_availability_natural_key UNIQUE (city_id, department_id, lab_id)
+);
+
+ALTER TABLE department_availability ENABLE ROW LEVEL SECURITY;
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE policyname = 'Public read department_availability') THEN
+        CREATE POLICY "Public read department_availability" ON department_availability FOR SELECT USING (true);
+    END IF;
+END $$;
+
+
+DROP FUNCTION IF EXISTS get_availability_matrix(TEXT);
+
+-- The natural key's (city_id, ...) prefix serves the city lookup
+CREATE OR REPLACE FUNCTION get_availability_matrix(
+    city_name TEXT
+)
+RETURNS TABLE (
+    department TEXT,
+    lab_slug TEXT,
+    test_count INT
+) AS $$
+    SELECT d.name, l.slug, a.test_count
+    FROM department_availability a
+    JOIN departments d ON d.id = a.department_id
+    JOIN labs l ON l.id = a.lab_id
+    WHERE a.city_id = (
+            SELECT c.id FROM cities c WHERE lower(c.name) = lower(city_name) ORDER BY c.id LIMIT 1
+          )
+      AND a.is_active = TRUE
+    ORDER BY d.name, l.slug;
+$$ LANGUAGE sql STABLE;
+
+GRANT EXECUTE ON FUNCTION get_availability_matrix TO anon;
+GRANT EXECUTE ON FUNCTION get_availability_matrix TO authenticated;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,113 @@
+-- =============================================
+-- Set-based canonical_test_id linkage for lab_tests
+-- Replaces fix_linkage.py's per-row HTTP updates. Each call links every
+-- unlinked row in an id range with three set-based UPDATEs:
+--   1. propagate canonical_test_id across the same (lab_id, source_test_code)
+--   2. exact name match against canonical_tests.name
+--   3. exact name match against test_aliases (covers keywords uploaded as aliases)
+-- fix_linkage.py calls it over bounded id chunks to stay under the
+-- statement timeout.
+-- =============================================
+
+-- Indexes the name lookups rely on
+CREATE INDEX IF NOT EXISTS idx_canonical_tests_name_lower_trim
+    ON canonical_tests (lower(trim(name)));
+CREATE INDEX IF NOT EXISTS idx_test_aliases_alias_lower
+    ON test_aliases (alias_lower);
+CREATE INDEX IF NOT EXISTS idx_lab_tests_unlinked
+    ON lab_tests (id) WHERE canonical_test_id IS NULL;
+
+DROP FUNCTION IF EXISTS link_lab_tests(INT, INT);
+
+CREATE OR REPLACE FUNCTION link_lab_tests(from_id INT, to_id INT)
+RETURNS TABLE (
+    code_linked INT,
+    name_linked INT,
+    alias_linked INT,
+    still_unlinked INT
+) AS $$
+DECLARE
+    n_code INT;
+    n_name INT;
+    n_alias INT;
+BEGIN
+    -- Step 1: Propagate within (lab_id, source_test_code), best confidence wins
+    WITH targets AS (
+        SELECT id, lab_id, source_test_code
+        FROM lab_tests
+        WHERE id BETWEEN from_id AND to_id
+          AND canonical_test_id IS NULL
+          AND source_test_code IS NOT NULL
+    ),
+    linked AS (
+        SELECT DISTINCT ON (l.lab_id, l.source_test_code)
+            l.lab_id,
+            l.source_test_code,
+            l.canonical_test_id,
+            l.match_confidence,
+            l.match_method
+        FROM lab_tests l
+        JOIN (SELECT DISTINCT lab_id, source_test_code FROM targets) t
+          ON t.lab_id = l.lab_id AND t.source_test_code = l.source_test_code
+        WHERE l.canonical_test_id IS NOT NULL
+        ORDER BY l.lab_id, l.source_test_code, l.match_confidence DESC NULLS LAST
+    )
+    UPDATE lab_tests lt
+    SET
+        canonical_test_id = linked.canonical_test_id,
+        match_confidence = linked.match_confidence,
+        match_method = linked.match_method
+    FROM targets t
+    JOIN linked ON linked.lab_id = t.lab_id AND linked.source_test_code = t.source_test_code
+    WHERE lt.id = t.id;
+    GET DIAGNOSTICS n_code = ROW_COUNT;
+
+    -- Step 2: Exact (trimmed, case-insensitive) canonical name
+    WITH matches AS (
+        SELECT DISTINCT ON (lt.id) lt.id, ct.id AS ct_id
+        FROM lab_tests lt
+        JOIN canonical_tests ct ON lower(trim(ct.name)) = lower(trim(lt.source_test_name))
+        WHERE lt.id BETWEEN from_id AND to_id
+          AND lt.canonical_test_id IS NULL
+        ORDER BY lt.id, ct.id
+    )
+    UPDATE lab_tests lt
+    SET
+        canonical_test_id = m.ct_id,
+        match_confidence = 0.85,
+        match_method = 'name_propagation'
+    FROM matches m
+    WHERE lt.id = m.id;
+    GET DIAGNOSTICS n_name = ROW_COUNT;
+
+    -- Step 3: Exact alias
+    WITH matches AS (
+        SELECT DISTINCT ON (lt.id) lt.id, ta.canonical_test_id AS ct_id
+        FROM lab_tests lt
+        JOIN test_aliases ta ON ta.alias_lower = lower(trim(lt.source_test_name))
+        WHERE lt.id BETWEEN from_id AND to_id
+          AND lt.canonical_test_id IS NULL
+        ORDER BY lt.id, ta.canonical_test_id
+    )
+    UPDATE lab_tests lt
+    SET
+        canonical_test_id = m.ct_id,
+        match_confidence = 0.80,
+        match_method = 'keyword_propagation'
+    FROM matches m
+    WHERE lt.id = m.id;
+    GET DIAGNOSTICS n_alias = ROW_COUNT;
+
+    RETURN QUERY
+    SELECT
+        n_code,
+        n_name,
+        n_alias,
+        (SELECT count(*)::INT FROM lab_tests
+         WHERE id BETWEEN from_id AND to_id AND canonical_test_id IS NULL);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Writes are for the pipeline only
+REVOKE EXECUTE ON FUNCTION link_lab_tests(INT, INT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION link_lab_tests(INT, INT) TO service_role;
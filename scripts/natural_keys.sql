@@ -0,0 +1,94 @@
+-- =============================================
+-- Natural-key constraints for idempotent upserts
+-- lab_tests and test_aliases used to be written with plain INSERT, so a
+-- rerun relied on duplicate errors. These constraints let the pipeline
+-- upsert with on_conflict and converge in a single pass.
+--
+-- A lab_tests row is keyed by (lab_id, source_key, lab_location_id).
+-- source_key is the code, or 'name:' + the lowercased, whitespace-collapsed
+-- test name when there is none (NormalizedLabTest.source_key() in
+-- pipeline/models.py), so code-less tests at one lab and location stay
+-- distinct. Rows that still share a key are quarantined by the pipeline
+-- instead of replacing each other.
+--
+-- Requires PostgreSQL 15+ (UNIQUE NULLS NOT DISTINCT). Run once in the SQL
+-- editor, after staged_load.sql if installed (this empties
+-- lab_tests_staging, dropping the previous dataset kept there). Safe to
+-- rerun, including on databases that got an earlier version of this file
+-- keyed on source_test_code. The next pipeline run writes the code-less
+-- rows that key collapsed.
+-- =============================================
+
+-- Step 1: Backfill source_key
+ALTER TABLE lab_tests ADD COLUMN IF NOT EXISTS source_key TEXT;
+
+UPDATE lab_tests
+SET source_key = CASE
+    WHEN coalesce(source_test_code, '') <> '' THEN source_test_code
+    ELSE 'name:' || btrim(regexp_replace(lower(source_test_name), '\s+', ' ', 'g'))
+END
+WHERE source_key IS NULL;
+
+ALTER TABLE lab_tests ALTER COLUMN source_key SET NOT NULL;
+
+-- Step 2: Remove existing duplicates, keeping the newest row per key.
+-- One sort per table; PARTITION BY groups NULL locations together, as the
+-- NULLS NOT DISTINCT constraint below does.
+DELETE FROM lab_tests
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY lab_id, source_key, lab_location_id ORDER BY id DESC
+        ) AS rank
+        FROM lab_tests
+    ) ranked
+    WHERE rank > 1
+);
+
+DELETE FROM test_aliases
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY canonical_test_id, lower(alias) ORDER BY id DESC
+        ) AS rank
+        FROM test_aliases
+    ) ranked
+    WHERE rank > 1
+);
+
+-- Step 3: lab_tests natural key
+ALTER TABLE lab_tests DROP CONSTRAINT IF EXISTS lab_tests_natural_key;
+-- '' and NULL were different codes to the old key; the pipeline writes NULL
+UPDATE lab_tests SET source_test_code = NULL WHERE source_test_code = '';
+ALTER TABLE lab_tests
+    ADD CONSTRAINT lab_tests_natural_key
+    UNIQUE NULLS NOT DISTINCT (lab_id, source_key, lab_location_id);
+
+-- lab_tests_staging (staged_load.sql) is swapped with lab_tests, so it needs the same key
+DO $$ BEGIN
+    IF to_regclass('lab_tests_staging') IS NOT NULL THEN
+        TRUNCATE lab_tests_staging;
+        ALTER TABLE lab_tests_staging ADD COLUMN IF NOT EXISTS source_key TEXT NOT NULL;
+        ALTER TABLE lab_tests_staging DROP CONSTRAINT IF EXISTS lab_tests_staging_natural_key;
+        ALTER TABLE lab_tests_staging
+            ADD CONSTRAINT lab_tests_staging_natural_key
+            UNIQUE NULLS NOT DISTINCT (lab_id, source_key, lab_location_id);
+    END IF;
+END $$;
+
+-- Step 4: test_aliases natural key on the lowercased alias
+ALTER TABLE test_aliases
+    ADD COLUMN IF NOT EXISTS alias_lower TEXT GENERATED ALWAYS AS (lower(alias)) STORED;
+
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'test_aliases_natural_key') THEN
+        ALTER TABLE test_aliases
+            ADD CONSTRAINT test_aliases_natural_key UNIQUE (canonical_test_id, alias_lower);
+    END IF;
+END $$;
+
+-- The case-insensitive key supersedes the original (canonical_test_id, alias) constraint
+ALTER TABLE test_aliases DROP CONSTRAINT IF EXISTS test_aliases_canonical_test_id_alias_key;
+
+-- Let PostgREST see the new columns
+NOTIFY pgrst, 'reload schema';
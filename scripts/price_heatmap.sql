@@ -0,0 +1,70 @@
+-- =============================================
+-- Precomputed price heatmap with a single-call RPC
+-- getPriceHeatmap in the dashboard used to page through every active
+-- lab_tests row of a city, fetch test names in batches and average prices
+-- per lab in the browser. The pipeline now computes the matrix once per run
+-- (step "heatmap", pipeline/rollups.py): one price_heatmap row per (city,
+-- canonical test) offered by 2+ labs, with each lab's average price in
+-- lab_prices and the gap between the cheapest and dearest lab in
+-- price_spread. Rows are upserted by row_hash; cells that disappear are set
+-- is_active = false.
+-- get_price_heatmap() returns a city's top-N spread rows with test names in
+-- one query, reading idx_price_heatmap_city_spread in order.
+--
+-- Run once in the SQL editor on databases created before price_heatmap was
+-- added to schema.sql.
+-- =============================================
+
+CREATE TABLE IF NOT EXISTS price_heatmap (
+    id                  SERIAL PRIMARY KEY,
+    city_id             INT NOT NULL REFERENCES cities(id),
+    canonical_test_id   INT NOT NULL REFERENCES canonical_tests(id),
+    lab_prices          JSONB NOT NULL,  -- {lab slug: average price}
+    lab_count           SMALLINT NOT NULL,
+    min_price           DECIMAL(10, 2),
+    max_price           DECIMAL(10, 2),
+    price_spread        DECIMAL(10, 2),
+    is_active           BOOLEAN DEFAULT TRUE,
+    row_hash            TEXT,  -- content hash for diff-only uploads
+    CONSTRAINT price_heatmap_natural_key UNIQUE (city_id, canonical_test_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_price_heatmap_city_spread
+    ON price_heatmap(city_id, price_spread DESC) WHERE is_active = TRUE;
+
+ALTER TABLE price_heatmap ENABLE ROW LEVEL SECURITY;
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE policyname = 'Public read price_heatmap') THEN
+        CREATE POLICY "Public read price_heatmap" ON price_heatmap FOR SELECT USING (true);
+    END IF;
+END $$;
+
+
+DROP FUNCTION IF EXISTS get_price_heatmap(TEXT, INT);
+
+CREATE OR REPLACE FUNCTION get_price_heatmap(
+    city_name TEXT,
+    result_limit INT DEFAULT 100
+)
+RETURNS TABLE (
+    canonical_test_id INT,
+    test_name TEXT,
+    lab_prices JSONB,
+    price_spread DECIMAL,
+    lab_count INT
+) AS $$
+    SELECT h.canonical_test_id, ct.name, h.lab_prices, h.price_spread, h.lab_count::INT
+    FROM price_heatmap h
+    JOIN canonical_tests ct ON ct.id = h.canonical_test_id
+    WHERE h.city_id = (
+            SELECT c.id FROM cities c WHERE lower(c.name) = lower(city_name) ORDER BY c.id LIMIT 1
+          )
+      AND h.is_active = TRUE
+    ORDER BY h.price_spread DESC
+    LIMIT result_limit;
+$$ LANGUAGE sql STABLE;
+
+GRANT EXECUTE ON FUNCTION get_price_heatmap TO anon;
+GRANT EXECUTE ON FUNCTION get_price_heatmap TO authenticated;
+
+NOTIFY pgrst, 'reload schema';
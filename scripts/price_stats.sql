@@ -0,0 +1,143 @@
+-- =============================================
+-- Materialized per-test, per-city price statistics
+-- search_tests used to aggregate lab_tests.price (joining lab_locations and
+-- cities for the city filter) on every search. canonical_test_price_stats
+-- holds those aggregates, one row per (canonical_test_id, city_id) plus an
+-- all-cities row with city_id NULL:
+--   lab_count        labs with an active row for the test
+--   min/max/avg/median_price over active rows with price > 0
+--   cheapest_lab_id  lab with the lowest price (lowest id on ties)
+-- refresh_canonical_test_price_stats() rebuilds it in one transaction;
+-- the pipeline calls it after uploading lab_tests (step "stats"). Readers
+-- see the old or the new statistics, never a mix.
+--
+-- Run once in the SQL editor, after fix_search_v2.sql (this replaces its
+-- search_tests, keeping the same signature).
+-- =============================================
+
+CREATE TABLE IF NOT EXISTS canonical_test_price_stats (
+    canonical_test_id   INT NOT NULL REFERENCES canonical_tests(id),
+    city_id             INT REFERENCES cities(id),  -- NULL: all cities
+    lab_count           INT NOT NULL,
+    min_price           DECIMAL(10, 2),
+    max_price           DECIMAL(10, 2),
+    avg_price           DECIMAL(10, 2),
+    median_price        DECIMAL(10, 2),
+    cheapest_lab_id     INT REFERENCES labs(id),
+    refreshed_at        TIMESTAMPTZ DEFAULT NOW(),
+    CONSTRAINT canonical_test_price_stats_key
+        UNIQUE NULLS NOT DISTINCT (canonical_test_id, city_id)
+);
+
+ALTER TABLE canonical_test_price_stats ENABLE ROW LEVEL SECURITY;
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE policyname = 'Public read canonical_test_price_stats') THEN
+        CREATE POLICY "Public read canonical_test_price_stats" ON canonical_test_price_stats FOR SELECT USING (true);
+    END IF;
+END $$;
+
+
+CREATE OR REPLACE FUNCTION refresh_canonical_test_price_stats()
+RETURNS TABLE (rows_written BIGINT) AS $$
+BEGIN
+    -- DELETE rather than TRUNCATE: searches keep reading the old rows meanwhile
+    DELETE FROM canonical_test_price_stats;
+
+    INSERT INTO canonical_test_price_stats
+        (canonical_test_id, city_id, lab_count, min_price, max_price, avg_price, median_price, cheapest_lab_id)
+    WITH active AS (
+        SELECT lt.canonical_test_id, ll.city_id, lt.lab_id, lt.price
+        FROM lab_tests lt
+        LEFT JOIN lab_locations ll ON ll.id = lt.lab_location_id
+        WHERE lt.is_active = TRUE AND lt.canonical_test_id IS NOT NULL
+    ),
+    scoped AS (
+        SELECT canonical_test_id, city_id, lab_id, price FROM active WHERE city_id IS NOT NULL
+        UNION ALL
+        SELECT canonical_test_id, NULL, lab_id, price FROM active
+    )
+    SELECT
+        canonical_test_id,
+        city_id,
+        count(DISTINCT lab_id),
+        min(price) FILTER (WHERE price > 0),
+        max(price) FILTER (WHERE price > 0),
+        round(avg(price) FILTER (WHERE price > 0), 2),
+        round((percentile_cont(0.5) WITHIN GROUP (ORDER BY price) FILTER (WHERE price > 0))::NUMERIC, 2),
+        (array_agg(lab_id ORDER BY price, lab_id) FILTER (WHERE price > 0))[1]
+    FROM scoped
+    GROUP BY canonical_test_id, city_id;
+
+    RETURN QUERY SELECT count(*) FROM canonical_test_price_stats;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION refresh_canonical_test_price_stats() FROM PUBLIC, anon, authenticated;
+
+
+-- search_tests from fix_search_v2.sql, with prices from canonical_test_price_stats
+DROP FUNCTION IF EXISTS search_tests(TEXT, TEXT, TEXT, INT);
+
+CREATE OR REPLACE FUNCTION search_tests(
+    search_query TEXT,
+    city_filter TEXT DEFAULT NULL,
+    dept_filter TEXT DEFAULT NULL,
+    result_limit INT DEFAULT 50
+)
+RETURNS TABLE (
+    canonical_test_id INT,
+    test_name TEXT,
+    department TEXT,
+    similarity_score REAL,
+    lab_count BIGINT,
+    min_price DECIMAL,
+    max_price DECIMAL,
+    avg_price DECIMAL
+) AS $$
+DECLARE
+    q TEXT := lower(trim(search_query));
+    -- An unknown city matches no stats row (-1), rather than the all-cities row
+    v_city_id INT := CASE WHEN city_filter IS NULL THEN NULL ELSE COALESCE(
+        (SELECT c.id FROM cities c WHERE lower(c.name) = lower(city_filter) ORDER BY c.id LIMIT 1), -1) END;
+BEGIN
+    RETURN QUERY
+    WITH matched_tests AS (
+        SELECT
+            ct.id,
+            ct.name,
+            d.name AS dept_name,
+            GREATEST(
+                similarity(lower(ct.name), q),
+                CASE WHEN lower(ct.name) LIKE '%' || q || '%'
+                     THEN 0.5 ELSE 0.0 END
+            )::REAL AS sim_score
+        FROM canonical_tests ct
+        LEFT JOIN departments d ON d.id = ct.department_id
+        WHERE
+            lower(ct.name) % q
+            OR lower(ct.name) LIKE '%' || q || '%'
+    )
+    SELECT
+        mt.id,
+        mt.name,
+        mt.dept_name,
+        mt.sim_score,
+        COALESCE(ps.lab_count, 0)::BIGINT,
+        ps.min_price,
+        ps.max_price,
+        ps.avg_price
+    FROM matched_tests mt
+    -- One index lookup per matched test on the (canonical_test_id, city_id) key
+    LEFT JOIN canonical_test_price_stats ps
+        ON ps.canonical_test_id = mt.id AND ps.city_id IS NOT DISTINCT FROM v_city_id
+    WHERE
+        (dept_filter IS NULL OR lower(mt.dept_name) = lower(dept_filter))
+    ORDER BY mt.sim_score DESC, COALESCE(ps.lab_count, 0) DESC
+    LIMIT result_limit;
+END;
+$$ LANGUAGE plpgsql;
+
+GRANT EXECUTE ON FUNCTION search_tests TO anon;
+GRANT EXECUTE ON FUNCTION search_tests TO authenticated;
+
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,20 @@
+-- =============================================
+-- row_hash columns for diff-only uploads
+-- The pipeline stores a content hash per canonical_tests and lab_tests row,
+-- reads the stored hashes back in bulk, and only re-sends rows whose hash
+-- changed. lab_tests rows that vanished from the source are set
+-- is_active = false.
+-- Run once on databases created before row_hash was added to schema.sql.
+-- =============================================
+
+ALTER TABLE canonical_tests ADD COLUMN IF NOT EXISTS row_hash TEXT;
+ALTER TABLE lab_tests ADD COLUMN IF NOT EXISTS row_hash TEXT;
+
+-- Keep the staging table (staged_load.sql) column-compatible for the swap
+DO $$ BEGIN
+    IF to_regclass('lab_tests_staging') IS NOT NULL THEN
+        ALTER TABLE lab_tests_staging ADD COLUMN IF NOT EXISTS row_hash TEXT;
+    END IF;
+END $$;
+
+NOTIFY pgrst, 'reload schema';
@@ -1,31 +1,60 @@
 """Main pipeline orchestrator.
 
-Steps:
-1. Seed reference data (labs, cities, departments)
-2. Load and normalize all 5 lab CSVs
-3. Run test matching to create canonical tests
-4. Upload everything to Supabase
+Steps (run as a DAG, independent steps overlap):
+  seed       Seed reference data (labs, cities, departments)
+  load       Load and normalize all 5 lab CSVs
+  locations  Create lab locations (after seed and load)
+  match      Run test matching to create canonical tests (after load)
+  canonical  Upload canonical tests (after locations and match)
+  upload     Upload lab tests (after canonical)
+  stats      Refresh canonical_test_price_stats (after upload)
+  heatmap    Build and upload the price_heatmap table (after stats)
+  availability  Build and upload the department_availability table (after heatmap)
+
+`--only match` runs just the listed steps and `--from canonical` a step and
+everything downstream of it; the other steps' outputs come from the
+checkpoints in --run-dir.
 """
 import sys
 import os
 import re
 import json
+import argparse
 from collections import defaultdict
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from tqdm import tqdm
-from pipeline.config import CSV_FILES, SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, BATCH_SIZE
-from pipeline.db import get_client, batch_upsert, batch_insert
+from pipeline.config import (
+    CSV_FILES, SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY, DATABASE_URL, BATCH_SIZE, CHECKPOINT_ROWS, STREAM_QUEUE_CHUNKS,
+)
+from pipeline.checkpoint import RunCheckpoint, fingerprint_inputs
+from pipeline.scheduler import PipelineDAG, Step
+from pipeline.profiling import PROFILER, span
+from pipeline.db import (
+    open_sink, get_client, batch_upsert, upsert_natural, upload_stages, stream_rows, call_rpc, write_quarantine, write_telemetry,
+    supports_rpc, upsert_natural_stream, natural_key_of, fetch_row_hashes, deactivate_rows, QUARANTINE,
+)
+from pipeline.diff import RowDiff, row_hash, add_row_hashes, diff_rows
 from pipeline.models import NormalizedLabTest
+from pipeline.sinks.base_sink import BaseSink
+from pipeline.spill import SpillStore, SpilledTests, release_memory
+from pipeline.streaming import BackgroundIterator
+from pipeline.uploader import UploadAborted
 from pipeline.ingest.metropolis_loader import MetropolisLoader
 from pipeline.ingest.agilus_loader import AgilusLoader
 from pipeline.ingest.apollo_loader import ApolloLoader
 from pipeline.ingest.neuberg_loader import NeubergLoader
 from pipeline.ingest.trustlab_loader import TRUSTlabLoader
 from pipeline.ingest.city_normalizer import normalize_city, get_all_cities, CITY_STATE_MAP
-from pipeline.ingest.department_normalizer import normalize_department, get_all_departments
+from pipeline.ingest.department_normalizer import normalize_department, get_all_departments, OTHER
 from pipeline.matching.matcher import TestMatcher
+from pipeline.matching.package_matcher import PackageMatcher, has_composition
+from pipeline.matching.linker import LinkageIndex
+from pipeline.matching.preprocessor import search_document
+from pipeline.rollups import location_city_ids, price_heatmap_rows, department_availability_rows
+
+DEFAULT_RUN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "runs", "latest")
 
 
 def slugify(text: str) -> str:
@@ -47,24 +76,29 @@ def step1_seed_reference_data(client):
         {"name": "Neuberg Diagnostics", "slug": "neuberg", "website_url": "https://www.neubergdiagnostics.com"},
         {"name": "TRUSTlab Diagnostics", "slug": "trustlab", "website_url": "https://www.trustlab.in"},
     ]
-    result = batch_upsert(client, "labs", labs_data, "slug")
-    print(f"  Labs: {result} rows")
-
-    # Cities
     cities_data = get_all_cities()
-    result = batch_upsert(client, "cities", cities_data, "name,state")
-    print(f"  Cities: {result} rows")
-
-    # Departments
     depts_data = get_all_departments()
-    result = batch_upsert(client, "departments", depts_data, "slug")
-    print(f"  Departments: {result} rows")
+
+    # Independent tables, so they upload together in one stage
+    totals = upload_stages(client, [[
+        ("labs", labs_data, "slug"),
+        ("cities", cities_data, "name,state"),
+        ("departments", depts_data, "slug"),
+    ]])
+    print(f"  Labs: {totals['labs']} rows")
+    print(f"  Cities: {totals['cities']} rows")
+    print(f"  Departments: {totals['departments']} rows")
 
     return labs_data, cities_data, depts_data
 
 
-def step2_load_csvs():
-    """Load all 5 lab CSVs into normalized format."""
+def step2_load_csvs(spill: SpillStore | None = None):
+    """Load all 5 lab CSVs into normalized format.
+
+    With spill (--max-memory), each CSV is parsed a batch at a time; once
+    resident size passes the budget's spill point, that lab streams straight
+    to an Arrow file and the labs loaded so far are moved to disk too.
+    """
     print("\n=== Step 2: Loading CSVs ===")
 
     loaders = {
@@ -82,11 +116,25 @@ def step2_load_csvs():
         if not csv_path or not os.path.exists(csv_path):
             print(f"  WARNING: CSV not found for {slug}: {csv_path}")
             continue
-        tests = loader.load(csv_path)
+        with span(f"load {slug}", "ingest"):
+            if spill:
+                tests = spill.load_tests(slug, loader.iter_tests(csv_path))
+                print(f"  {slug}: loaded {len(tests)} rows"
+                      + (" (spilled to disk)" if isinstance(tests, SpilledTests) else ""))
+            else:
+                tests = loader.load(csv_path)
         all_tests[slug] = tests
+        del tests
+        if spill and spill.over_budget():
+            with span(f"spill {slug}", "spill"):
+                spilled = spill.spill_labs(all_tests)
+            if spilled:
+                print(f"  Over memory budget: spilled {', '.join(spilled)} to disk")
 
     total = sum(len(v) for v in all_tests.values())
     print(f"\n  Total loaded: {total} rows across {len(all_tests)} labs")
+    if spill:
+        print(spill.report())
     return all_tests, loaders
 
 
@@ -95,12 +143,10 @@ def step3_create_lab_locations(client, all_tests: dict):
     print("\n=== Step 3: Creating Lab Locations ===")
 
     # Get lab IDs
-    labs_result = client.table("labs").select("id, slug").execute()
-    lab_id_map = {r["slug"]: r["id"] for r in labs_result.data}
+    lab_id_map = {r["slug"]: r["id"] for r in stream_rows(client, "labs", "id, slug")}
 
     # Get city IDs
-    cities_result = client.table("cities").select("id, name").execute()
-    city_id_map = {r["name"]: r["id"] for r in cities_result.data}
+    city_id_map = {r["name"]: r["id"] for r in stream_rows(client, "cities", "id, name")}
 
     # Collect unique (lab_slug, location_code) pairs
     location_set = set()
@@ -109,6 +155,20 @@ def step3_create_lab_locations(client, all_tests: dict):
             if t.location_code:
                 location_set.add((slug, t.location_code, t.location_name or ""))
 
+    # If a city is not in our map yet, add it (all at once)
+    missing_cities = {}
+    for lab_slug, loc_code, _ in location_set:
+        city_name = normalize_city(loc_code, lab_slug)
+        if city_name and city_name not in city_id_map:
+            missing_cities[city_name] = {
+                "name": city_name,
+                "state": CITY_STATE_MAP.get(city_name, ("Unknown", 3))[0],
+                "tier": CITY_STATE_MAP.get(city_name, ("Unknown", 3))[1],
+            }
+    if missing_cities:
+        batch_upsert(client, "cities", list(missing_cities.values()), "name,state")
+        city_id_map = {r["name"]: r["id"] for r in stream_rows(client, "cities", "id, name")}
+
     # Build location records
     location_rows = []
     for lab_slug, loc_code, loc_name in location_set:
@@ -119,20 +179,6 @@ def step3_create_lab_locations(client, all_tests: dict):
         city_name = normalize_city(loc_code, lab_slug)
         city_id = city_id_map.get(city_name) if city_name else None
 
-        # If city not in our map, try to add it
-        if city_name and not city_id:
-            try:
-                result = client.table("cities").insert({
-                    "name": city_name,
-                    "state": CITY_STATE_MAP.get(city_name, ("Unknown", 3))[0],
-                    "tier": CITY_STATE_MAP.get(city_name, ("Unknown", 3))[1],
-                }).execute()
-                if result.data:
-                    city_id = result.data[0]["id"]
-                    city_id_map[city_name] = city_id
-            except Exception:
-                pass
-
         location_rows.append({
             "lab_id": lab_id,
             "city_id": city_id,
@@ -144,11 +190,11 @@ def step3_create_lab_locations(client, all_tests: dict):
     print(f"  Lab locations: {result} rows")
 
     # Build lookup: (lab_slug, location_code) -> lab_location_id
-    locs_result = client.table("lab_locations").select("id, lab_id, location_code").execute()
+    locs = stream_rows(client, "lab_locations", "id, lab_id, location_code")
     # Need reverse lab_id -> slug
     slug_by_id = {v: k for k, v in lab_id_map.items()}
     loc_lookup = {}
-    for r in locs_result.data:
+    for r in locs:
         slug = slug_by_id.get(r["lab_id"])
         if slug:
             loc_lookup[(slug, r["location_code"])] = r["id"]
@@ -180,62 +226,69 @@ def step4_run_matching(all_tests: dict, loaders: dict):
 
         unique_tests.extend(unique)
 
-    print(f"\n  Total unique tests for matching: {len(unique_tests)}")
+    # Packages with a composition are matched by it; the rest go through the name passes
+    packages = [t for t in unique_tests if has_composition(t)]
+    unique_tests = [t for t in unique_tests if not has_composition(t)]
+    print(f"\n  Total unique tests for matching: {len(unique_tests)} (+{len(packages)} packages)")
 
     matcher = TestMatcher()
-    assignments = matcher.run(unique_tests)
+    matcher.run(unique_tests)
+    with span("match packages", "match", packages=len(packages)):
+        assignments = PackageMatcher(matcher).run(packages)
     canonicals = matcher.get_canonical_tests()
 
     return matcher, assignments, canonicals
 
 
-def step5_upload_canonical_tests(client, canonicals: list[dict], lab_id_map: dict):
-    """Upload canonical tests and aliases to Supabase."""
+def canonical_test_row(ct: dict, dept_id_map: dict) -> dict:
+    """Build one canonical_tests row from a matcher canonical."""
+    # Ensure unique slug by appending cluster_id
+    slug = f"{slugify(ct['name'])}-{ct['cluster_id']}"
+    return {
+        "name": ct["name"][:500],
+        "slug": slug[:200],
+        "test_type": None,
+        "keywords": [k[:200] for k in ct["keywords"][:20]],
+        "is_popular": ct["lab_count"] >= 3,
+        "department_id": dept_id_map.get(ct.get("department")),
+        "search_text": search_document(ct["name"], ct["keywords"]),
+    }
+
+
+def step5_upload_canonical_tests(client, canonicals: list[dict], lab_id_map: dict, diff: bool = True):
+    """Upload canonical tests and aliases to Supabase.
+
+    With diff, only canonical tests whose row_hash is new or changed are sent.
+    """
     print("\n=== Step 5: Uploading Canonical Tests ===")
 
     # Get department IDs
-    depts_result = client.table("departments").select("id, name").execute()
-    dept_id_map = {r["name"]: r["id"] for r in depts_result.data}
+    dept_id_map = {r["name"]: r["id"] for r in stream_rows(client, "departments", "id, name")}
 
     canonical_rows = []
     alias_rows = []
 
     for ct in tqdm(canonicals, desc="Preparing canonical tests"):
-        slug = slugify(ct["name"])
-        # Ensure unique slug by appending cluster_id
-        slug = f"{slug}-{ct['cluster_id']}"
-
-        row = {
-            "name": ct["name"][:500],
-            "slug": slug[:200],
-            "test_type": None,
-            "keywords": [k[:200] for k in ct["keywords"][:20]],
-            "is_popular": ct["lab_count"] >= 3,
-        }
-        canonical_rows.append(row)
-
-    # Upload in batches
-    total = 0
-    for i in tqdm(range(0, len(canonical_rows), BATCH_SIZE), desc="Uploading canonical tests"):
-        batch = canonical_rows[i:i + BATCH_SIZE]
-        try:
-            result = client.table("canonical_tests").upsert(batch, on_conflict="slug").execute()
-            total += len(result.data) if result.data else 0
-        except Exception as e:
-            print(f"  Error uploading batch {i}: {e}")
-            # Try one by one
-            for row in batch:
-                try:
-                    result = client.table("canonical_tests").upsert(row, on_conflict="slug").execute()
-                    total += 1
-                except Exception:
-                    pass
-
+        canonical_rows.append(canonical_test_row(ct, dept_id_map))
+
+    with_dept = sum(1 for r in canonical_rows if r["department_id"])
+    other = sum(1 for ct in canonicals if ct["department"] == OTHER)
+    print(f"  Departments resolved by majority vote: {with_dept}/{len(canonical_rows)} ({other} {OTHER})")
+
+    add_row_hashes(canonical_rows)
+    if diff:
+        ct_diff = diff_rows(
+            "canonical_tests", canonical_rows,
+            fetch_row_hashes(client, "canonical_tests", with_active=False), natural_key_of("canonical_tests"),
+        )
+        print(ct_diff.summary())
+        canonical_rows = ct_diff.to_write
+
+    total = batch_upsert(client, "canonical_tests", canonical_rows, "slug")
     print(f"  Canonical tests: {total} rows uploaded")
 
     # Build canonical_test slug -> id lookup
-    ct_result = client.table("canonical_tests").select("id, slug").execute()
-    ct_slug_to_id = {r["slug"]: r["id"] for r in ct_result.data}
+    ct_slug_to_id = {r["slug"]: r["id"] for r in stream_rows(client, "canonical_tests", "id, slug")}
 
     # Map cluster_id -> canonical_test_id
     cluster_to_ct_id = {}
@@ -257,129 +310,342 @@ def step5_upload_canonical_tests(client, canonicals: list[dict], lab_id_map: dic
             })
 
     if alias_rows:
-        alias_total = batch_insert(client, "test_aliases", alias_rows)
+        # First spelling of an alias wins; reruns leave existing aliases alone
+        alias_total = upsert_natural(client, "test_aliases", alias_rows, ignore_duplicates=True)
         print(f"  Aliases: {alias_total} rows uploaded")
 
     return cluster_to_ct_id
 
 
-def step6_upload_lab_tests(client, all_tests: dict, matcher, lab_id_map: dict, loc_lookup: dict, cluster_to_ct_id: dict):
-    """Upload all lab_test rows with canonical_test_id assignments."""
+def lab_test_row(t: NormalizedLabTest, lab_id: int, linkage: LinkageIndex, cluster_to_ct_id: dict,
+                 loc_lookup: dict) -> dict:
+    """Build one lab_tests row, linked to its canonical test when one resolves."""
+    # Find canonical_test_id
+    cluster_id, confidence, method = linkage.resolve(t)
+    ct_id = cluster_to_ct_id.get(cluster_id) if cluster_id else None
+
+    # Find lab_location_id
+    loc_id = loc_lookup.get((t.lab_slug, t.location_code))
+
+    # Compute discount
+    discount = None
+    if t.mrp and t.price and t.mrp > 0 and t.price < t.mrp:
+        discount = round(((t.mrp - t.price) / t.mrp) * 100, 2)
+
+    return {
+        "lab_id": lab_id,
+        "canonical_test_id": ct_id,
+        "lab_location_id": loc_id,
+        "source_test_code": t.source_test_code,
+        "source_key": t.source_key(),
+        "source_test_name": t.source_test_name[:500],
+        "source_product_id": t.source_product_id,
+        "price": float(t.price) if t.price else None,
+        "mrp": float(t.mrp) if t.mrp else None,
+        "discount_pct": discount,
+        "test_type": t.test_type,
+        "department_raw": t.department_raw,
+        "methodology": t.methodology,
+        "sample_type": t.sample_type,
+        "sample_volume": t.sample_volume,
+        "sample_container": t.sample_container,
+        "fasting_required": t.fasting_required,
+        "tat_text": t.tat_text,
+        "tat_hours": t.tat_hours,
+        "home_collection": t.home_collection,
+        "nabl_accredited": t.nabl_accredited,
+        "source_url": t.source_url,
+        "match_confidence": confidence if ct_id else None,
+        "match_method": method if ct_id else None,
+        "is_active": True,
+    }
+
+
+def step6_upload_lab_tests(client, all_tests: dict, matcher, lab_id_map: dict, loc_lookup: dict, cluster_to_ct_id: dict,
+                           checkpoint: RunCheckpoint | None = None, staged: bool = False, diff: bool = True,
+                           spill: SpillStore | None = None):
+    """Upload all lab_test rows with canonical_test_id assignments.
+
+    Rows are built on a producer thread in CHECKPOINT_ROWS chunks and handed
+    to the uploader through a queue of STREAM_QUEUE_CHUNKS, so building
+    overlaps uploading and only a few chunks of row dicts exist at a time.
+    With a checkpoint, the count acknowledged per lab is recorded after each
+    fully written chunk, so a resumed run skips them; after a chunk with
+    rejected rows the lab's count stops advancing, so a resume retries them.
+    With staged, rows load into the unindexed lab_tests_staging table, which
+    replaces lab_tests in one transaction at the end (scripts/staged_load.sql).
+    With diff (ignored when staged), only rows whose row_hash is new or
+    changed are sent, and stored rows of the lab that vanished from the
+    source are deactivated. A resumed diff run needs no watermarks: rows
+    already written hash as unchanged.
+    With spill (--max-memory) and resident size past the budget's spill
+    point, every row is built into Arrow files first; the stored hashes and
+    linkage lookups are released before the chunks stream back to the uploader.
+    Returns the per-lab diff counts and the linked rows as
+    (lab_slug, location_code, canonical_test_id, price) tuples for the rollups.
+    """
     print("\n=== Step 6: Uploading Lab Tests ===")
 
-    # Build test_code -> cluster_id from assignments
-    code_to_cluster: dict[str, int] = {}
-    for key, cid in matcher.assignment.items():
-        # key is "lab_slug:source_test_code"
-        parts = key.split(":", 1)
-        if len(parts) == 2:
-            code_to_cluster[key] = cid
+    table = "lab_tests_staging" if staged else "lab_tests"
+    if staged and not (checkpoint and checkpoint.done("upload_staging_begun")):
+        call_rpc(client, "begin_lab_tests_staging")
+        if checkpoint:
+            checkpoint.save("upload_staging_begun")
+        print("  Loading into lab_tests_staging (secondary indexes deferred)")
+
+    diff = diff and not staged
+    stored_by_lab: dict[int, dict] = defaultdict(dict)
+    if diff:
+        for key, stored in fetch_row_hashes(client, "lab_tests").items():
+            stored_by_lab[key[0]][key] = stored
+    key_of = natural_key_of("lab_tests")
+    use_watermarks = checkpoint is not None and not diff
+
+    # Resolves every physical row (location variants, code-less rows) by code or name
+    linkage = LinkageIndex(matcher)
+
+    lab_diffs: dict[str, RowDiff] = {}
+    uploaded: dict[str, int] = defaultdict(int)
+    linked: list[tuple] = []
+
+    def lab_chunks():
+        """(slug, rows produced so far, rows in chunk) tagged chunks of rows to write, lab by lab."""
+        for slug, tests in all_tests.items():
+            lab_id = lab_id_map.get(slug)
+            if not lab_id:
+                print(f"  WARNING: No lab_id for {slug}")
+                continue
+
+            print(f"\n  Building {slug}: {len(tests)} rows...")
+            # natural key -> row_hash of the first row with it; later rows with the key are
+            # dropped, and quarantined when their values differ
+            kept: dict[tuple, str] = {}
+            collisions = 0
+            stored = stored_by_lab.get(lab_id, {})
+            lab_diff = RowDiff(f"lab_tests[{slug}]") if diff else None
+
+            skip = checkpoint.watermark(f"upload:{slug}") if use_watermarks else 0
+            if skip:
+                print(f"  {slug}: resuming after {skip} acknowledged rows")
+
+            produced = 0
+            lab_linked = 0
+            chunk = []
+            for t in tests:
+                row = lab_test_row(t, lab_id, linkage, cluster_to_ct_id, loc_lookup)
+                key = key_of(row)
+                row["row_hash"] = row_hash(row)
+                if key in kept:
+                    if kept[key] != row["row_hash"]:
+                        collisions += 1
+                        QUARANTINE.add("lab_tests", row, f"natural key {key} already used by an earlier row")
+                    continue
+                kept[key] = row["row_hash"]
+                if row["canonical_test_id"]:
+                    linked.append((slug, t.location_code, row["canonical_test_id"], t.price))
+                    lab_linked += 1
+                produced += 1
+                if produced <= skip:
+                    continue
+                if lab_diff and not lab_diff.add(row, stored.get(key)):
+                    continue
+                chunk.append(row)
+                if len(chunk) >= CHECKPOINT_ROWS:
+                    yield (slug, produced, len(chunk)), chunk
+                    chunk = []
+            if chunk:
+                yield (slug, produced, len(chunk)), chunk
+
+            print(f"  {slug}: {lab_linked}/{produced} rows linked to canonical tests")
+            if collisions:
+                print(f"  WARNING: {slug}: {collisions} rows quarantined, natural key already used by an earlier row")
+            if lab_diff:
+                lab_diff.finish(stored, kept.keys())
+                print(lab_diff.summary())
+                lab_diffs[slug] = lab_diff
+
+    # Labs with a chunk not fully written: their watermark stays before it
+    incomplete: set[str] = set()
+
+    def on_chunk(tag, written):
+        slug, produced, rows = tag
+        uploaded[slug] += written
+        # Quarantined rows and batches given up on are not counted as written
+        if written < rows:
+            incomplete.add(slug)
+        if use_watermarks and slug not in incomplete:
+            checkpoint.set_watermark(f"upload:{slug}", produced)
+
+    source = lab_chunks()
+    if spill and spill.over_budget():
+        print("  Over memory budget: preparing rows on disk before uploading")
+        with span("prepare lab_tests", "spill"):
+            prepared = spill.spill_chunks("lab_tests", source)
+        # Only needed to build rows
+        stored_by_lab.clear()
+        linkage = None
+        release_memory()
+        print(spill.report())
+        source = spill.read_chunks(prepared)
+
+    chunks = BackgroundIterator(source, STREAM_QUEUE_CHUNKS)
+    try:
+        total_uploaded = upsert_natural_stream(client, table, chunks, on_chunk)
+    finally:
+        chunks.close()
+
+    print()
+    for slug in all_tests:
+        if slug in lab_id_map:
+            print(f"  {slug}: {uploaded[slug]} rows uploaded")
+    if use_watermarks and incomplete:
+        print(f"  Resume watermarks held back after rejected rows: {', '.join(sorted(incomplete))}")
+    for slug, lab_diff in lab_diffs.items():
+        if lab_diff.vanished_ids:
+            deactivated = deactivate_rows(client, "lab_tests", lab_diff.vanished_ids)
+            print(f"  {slug}: {deactivated} vanished rows set inactive")
 
-    total_uploaded = 0
+    print(f"\n  Total lab_tests uploaded: {total_uploaded}")
 
-    for slug, tests in all_tests.items():
-        lab_id = lab_id_map.get(slug)
-        if not lab_id:
-            print(f"  WARNING: No lab_id for {slug}")
-            continue
+    if staged:
+        print("  Building indexes and swapping lab_tests_staging into place...")
+        swap = call_rpc(client, "swap_lab_tests_staging")[0]
+        print(f"  Swapped: {swap['rows_live']} rows live, {swap['rows_previous']} previous rows kept in lab_tests_staging")
 
-        print(f"\n  Uploading {slug}: {len(tests)} rows...")
-        rows = []
+    return {slug: lab_diff.counts() for slug, lab_diff in lab_diffs.items()}, linked
 
-        for t in tests:
-            # Find canonical_test_id
-            key = f"{t.lab_slug}:{t.source_test_code}"
-            cluster_id = code_to_cluster.get(key)
-            ct_id = cluster_to_ct_id.get(cluster_id) if cluster_id else None
-
-            # Find lab_location_id
-            loc_id = loc_lookup.get((t.lab_slug, t.location_code))
-
-            # Compute discount
-            discount = None
-            if t.mrp and t.price and t.mrp > 0 and t.price < t.mrp:
-                discount = round(((t.mrp - t.price) / t.mrp) * 100, 2)
-
-            # Find match info
-            member_info = None
-            if cluster_id and cluster_id in matcher.clusters:
-                for m in matcher.clusters[cluster_id]:
-                    if m["lab_slug"] == t.lab_slug and m["source_test_code"] == t.source_test_code:
-                        member_info = m
-                        break
-
-            row = {
-                "lab_id": lab_id,
-                "canonical_test_id": ct_id,
-                "lab_location_id": loc_id,
-                "source_test_code": t.source_test_code,
-                "source_test_name": t.source_test_name[:500],
-                "source_product_id": t.source_product_id,
-                "price": float(t.price) if t.price else None,
-                "mrp": float(t.mrp) if t.mrp else None,
-                "discount_pct": discount,
-                "test_type": t.test_type,
-                "department_raw": t.department_raw,
-                "methodology": t.methodology,
-                "sample_type": t.sample_type,
-                "sample_volume": t.sample_volume,
-                "sample_container": t.sample_container,
-                "fasting_required": t.fasting_required,
-                "tat_text": t.tat_text,
-                "tat_hours": t.tat_hours,
-                "home_collection": t.home_collection,
-                "nabl_accredited": t.nabl_accredited,
-                "source_url": t.source_url,
-                "match_confidence": member_info["confidence"] if member_info else None,
-                "match_method": member_info["method"] if member_info else None,
-                "is_active": True,
-            }
-            rows.append(row)
-
-        # Upload in batches
-        for i in tqdm(range(0, len(rows), BATCH_SIZE), desc=f"  {slug}"):
-            batch = rows[i:i + BATCH_SIZE]
-            try:
-                result = client.table("lab_tests").insert(batch).execute()
-                total_uploaded += len(result.data) if result.data else 0
-            except Exception as e:
-                err_str = str(e)
-                if "duplicate" in err_str.lower() or "unique" in err_str.lower():
-                    # Skip duplicates
-                    for row in batch:
-                        try:
-                            result = client.table("lab_tests").insert(row).execute()
-                            total_uploaded += 1
-                        except Exception:
-                            pass
-                else:
-                    print(f"  Error: {err_str[:200]}")
 
-    print(f"\n  Total lab_tests uploaded: {total_uploaded}")
+def step7_refresh_price_stats(client):
+    """Rebuild canonical_test_price_stats from the active lab_tests (scripts/price_stats.sql)."""
+    print("\n=== Step 7: Refreshing Price Statistics ===")
+    if not supports_rpc(client):
+        print("  Skipped: local sinks have no database functions")
+        return
+    result = call_rpc(client, "refresh_canonical_test_price_stats")
+    print(f"  canonical_test_price_stats: {result[0]['rows_written']} rows")
 
 
-def main():
-    if not SUPABASE_URL or "your-project" in SUPABASE_URL:
-        print("ERROR: Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY in .env")
-        print("Also run the schema SQL in Supabase SQL Editor first!")
-        sys.exit(1)
+def upload_rollup(client, table: str, rows: list[dict], diff: bool = True) -> dict:
+    """Upload a precomputed dashboard table; stored rows no longer produced are set inactive.
+
+    With diff, only rows whose row_hash is new or changed are sent.
+    """
+    add_row_hashes(rows)
+    rollup_diff = diff_rows(table, rows, fetch_row_hashes(client, table), natural_key_of(table))
+    print(rollup_diff.summary())
+    total = upsert_natural(client, table, rollup_diff.to_write if diff else rows)
+    print(f"  {table}: {total} rows uploaded")
+    if rollup_diff.vanished_ids:
+        deactivated = deactivate_rows(client, table, rollup_diff.vanished_ids)
+        print(f"  {deactivated} vanished rows set inactive")
+    return rollup_diff.counts()
 
-    client = get_client()
-    print(f"Connected to Supabase: {SUPABASE_URL}")
 
-    # Step 1: Seed reference data
-    step1_seed_reference_data(client)
+def step8_upload_price_heatmap(client, linked_rows: list[tuple], city_id_map: dict, diff: bool = True):
+    """Compute each city's test x lab average-price matrix and upload it to price_heatmap."""
+    print("\n=== Step 8: Building Price Heatmap ===")
 
-    # Step 2: Load CSVs
-    all_tests, loaders = step2_load_csvs()
+    heatmap = price_heatmap_rows(linked_rows, location_city_ids(city_id_map))
+    print(f"  {len(heatmap)} (city, test) cells priced by 2+ labs")
+    return upload_rollup(client, "price_heatmap", heatmap, diff)
 
-    # Step 3: Create lab locations
-    lab_id_map, city_id_map, loc_lookup = step3_create_lab_locations(client, all_tests)
 
-    # Step 4: Run matching
-    matcher, assignments, canonicals = step4_run_matching(all_tests, loaders)
+def step9_upload_department_availability(client, linked_rows: list[tuple], canonicals: list[dict], lab_id_map: dict,
+                                         city_id_map: dict, cluster_to_ct_id: dict, diff: bool = True):
+    """Count canonical tests per (city, department, lab) and upload them to department_availability."""
+    print("\n=== Step 9: Building Department Availability ===")
 
-    # Print matching summary
+    dept_id_map = {r["name"]: r["id"] for r in stream_rows(client, "departments", "id, name")}
+    ct_department = {
+        cluster_to_ct_id[ct["cluster_id"]]: dept_id_map[ct["department"]]
+        for ct in canonicals
+        if ct["cluster_id"] in cluster_to_ct_id and ct.get("department") in dept_id_map
+    }
+    availability = department_availability_rows(linked_rows, location_city_ids(city_id_map), lab_id_map, ct_department)
+    print(f"  {len(availability)} (city, department, lab) counts")
+    return upload_rollup(client, "department_availability", availability, diff)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sink", choices=("supabase", "postgres", "sqlite", "duckdb"), default="supabase",
+        help="write through the Supabase REST API (default), directly to DATABASE_URL with COPY, "
+             "or to a local SQLite/DuckDB file",
+    )
+    parser.add_argument(
+        "--local-db", default=None,
+        help="database file for --sink sqlite/duckdb (default: runs/local.<sink>)",
+    )
+    parser.add_argument(
+        "--copy-format", choices=("binary", "csv"), default="binary",
+        help="COPY format for --sink postgres",
+    )
+    parser.add_argument(
+        "--staged-load", action="store_true",
+        help="load lab_tests into an unindexed staging table and swap it in atomically "
+             "(needs scripts/staged_load.sql; not for --sink sqlite/duckdb)",
+    )
+    parser.add_argument(
+        "--full-upload", action="store_true",
+        help="re-send every canonical_tests and lab_tests row instead of only rows whose row_hash changed",
+    )
+    parser.add_argument(
+        "--run-dir", default=DEFAULT_RUN_DIR,
+        help="directory for step checkpoints and upload watermarks (default: runs/latest)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="reuse checkpoints in --run-dir: skip completed steps and continue uploads from the last acknowledged chunk",
+    )
+    parser.add_argument(
+        "--max-memory", type=float, default=None, metavar="MB",
+        help="memory budget in MB: past it, loaded labs and prepared lab_tests rows are spilled to "
+             "Arrow files in <run-dir>/spill and streamed back (needs pyarrow)",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="write a Chrome trace (trace.json), per-step cProfile stats and a memory report to <run-dir>/profile",
+    )
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument(
+        "--only", default=None,
+        help="comma-separated steps to run (seed, load, locations, match, canonical, upload, stats, heatmap, "
+             "availability); "
+             "inputs from other steps are restored from --run-dir",
+    )
+    selection.add_argument(
+        "--from", dest="start", default=None,
+        help="run this step and every step downstream of it; earlier outputs are restored from --run-dir",
+    )
+    return parser.parse_args()
+
+
+def build_dag() -> PipelineDAG:
+    return PipelineDAG([
+        Step("seed", step1_seed_reference_data, inputs=("client",), outputs=("reference_data",)),
+        Step("load", step2_load_csvs, inputs=("spill",), outputs=("all_tests", "loaders")),
+        Step("locations", step3_create_lab_locations, inputs=("client", "all_tests"),
+             outputs=("lab_id_map", "city_id_map", "loc_lookup"), after=("seed",)),
+        Step("match", step4_run_matching, inputs=("all_tests", "loaders"),
+             outputs=("matcher", "assignments", "canonicals")),
+        Step("canonical", step5_upload_canonical_tests, inputs=("client", "canonicals", "lab_id_map", "diff"),
+             outputs=("cluster_to_ct_id",)),
+        Step("upload", step6_upload_lab_tests,
+             inputs=("client", "all_tests", "matcher", "lab_id_map", "loc_lookup", "cluster_to_ct_id",
+                     "checkpoint", "staged", "diff", "spill"),
+             outputs=("lab_test_diffs", "linked_rows")),
+        Step("stats", step7_refresh_price_stats, inputs=("client",), after=("upload",)),
+        # Ordered after each other only because they share the client
+        Step("heatmap", step8_upload_price_heatmap, inputs=("client", "linked_rows", "city_id_map", "diff"),
+             outputs=("heatmap_diff",), after=("stats",)),
+        Step("availability", step9_upload_department_availability,
+             inputs=("client", "linked_rows", "canonicals", "lab_id_map", "city_id_map", "cluster_to_ct_id", "diff"),
+             outputs=("availability_diff",), after=("heatmap",)),
+    ])
+
+
+def print_matching_summary(canonicals: list[dict]):
     print(f"\n=== Matching Summary ===")
     print(f"  Total canonical tests: {len(canonicals)}")
     cross_lab = sum(1 for c in canonicals if c["lab_count"] >= 2)
@@ -391,12 +657,96 @@ def main():
     all_five = sum(1 for c in canonicals if c["lab_count"] >= 5)
     print(f"  Available at all 5 labs: {all_five}")
 
-    # Step 5: Upload canonical tests
-    cluster_to_ct_id = step5_upload_canonical_tests(client, canonicals, lab_id_map)
 
-    # Step 6: Upload lab tests
-    step6_upload_lab_tests(client, all_tests, matcher, lab_id_map, loc_lookup, cluster_to_ct_id)
+def main():
+    args = parse_args()
 
+    if args.staged_load and args.sink in ("sqlite", "duckdb"):
+        print("ERROR: --staged-load needs the staged_load.sql functions and only works against Postgres/Supabase")
+        sys.exit(1)
+
+    if args.sink == "postgres":
+        if not DATABASE_URL:
+            print("ERROR: Set DATABASE_URL in .env to use --sink postgres")
+            sys.exit(1)
+        client = open_sink("postgres", DATABASE_URL, args.copy_format)
+        print(f"Connected to Postgres (COPY {args.copy_format})")
+    elif args.sink in ("sqlite", "duckdb"):
+        path = args.local_db or os.path.join(os.path.dirname(DEFAULT_RUN_DIR), f"local.{args.sink}")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        client = open_sink(args.sink, path)
+        print(f"Using local {args.sink} database: {path}")
+    else:
+        if not SUPABASE_URL or "your-project" in SUPABASE_URL:
+            print("ERROR: Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY in .env")
+            print("Also run the schema SQL in Supabase SQL Editor first!")
+            sys.exit(1)
+
+        client = get_client()
+        print(f"Connected to Supabase: {SUPABASE_URL}")
+
+    dag = build_dag()
+    try:
+        selected = dag.select(args.only.split(",") if args.only else None, args.start)
+        # Selecting steps reuses the run directory for the outputs of the others
+        reuse_dir = args.resume or bool(args.only or args.start)
+        checkpoint = RunCheckpoint(args.run_dir, resume=reuse_dir, inputs=fingerprint_inputs(CSV_FILES))
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    print(f"Run directory: {args.run_dir}{' (resuming)' if args.resume else ''}")
+    if len(selected) < len(dag.steps):
+        print(f"Running steps: {', '.join(selected)}")
+    if args.profile:
+        PROFILER.start(os.path.join(args.run_dir, "profile"))
+    spill = None
+    if args.max_memory:
+        try:
+            spill = SpillStore(os.path.join(args.run_dir, "spill"), args.max_memory)
+        except ImportError as e:
+            print(f"ERROR: {e}")
+            sys.exit(1)
+
+    values = {
+        "client": client,
+        "checkpoint": checkpoint,
+        "staged": args.staged_load,
+        "diff": not args.full_upload,
+        "spill": spill,
+    }
+    try:
+        to_run, restored = dag.plan(selected, checkpoint, args.resume, values)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    aborted = False
+    try:
+        with span("pipeline", "run"):
+            dag.run(values, to_run, restored, checkpoint)
+        if "canonicals" in values:
+            print_matching_summary(values["canonicals"])
+    except UploadAborted as e:
+        # Completed steps are checkpointed; --resume picks up from the failed one
+        print(f"ERROR: {e}")
+        print("Check SUPABASE_SERVICE_ROLE_KEY and that scripts/schema.sql (and any migrations) ran.")
+        aborted = True
+    finally:
+        # A failed run is the one whose rejected rows and telemetry are needed
+        write_quarantine(os.path.join(os.path.dirname(__file__), "..", "quarantine.json"))
+        write_telemetry(args.run_dir)
+
+        if isinstance(client, BaseSink):
+            client.close()
+
+        if spill:
+            print(spill.report())
+
+        profile_dir = PROFILER.finish()
+        if profile_dir:
+            print(f"  Profile written to {profile_dir} (trace.json, <step>.prof/.txt, memory.txt)")
+
+    if aborted:
+        sys.exit(1)
     print("\n=== Pipeline Complete! ===")
 
 
@@ -0,0 +1,135 @@
+-- =============================================
+-- Hybrid full-text + trigram search over a per-test search document
+-- search_tests only trigram-matched lower(name), so aliases, keywords and
+-- abbreviations were never searched ("sgpt" missed "Alanine
+-- Aminotransferase"). The pipeline now writes canonical_tests.search_text:
+-- the name, every alias/keyword, and ABBREVIATIONS from
+-- pipeline/matching/preprocessor.py expanded and contracted (see
+-- search_document()). Two indexes cover it:
+--   search_tsv   generated tsvector, GIN    whole words and prefixes
+--   search_text  GIN trigram                typos and partial words
+-- search_canonical_tests() ranks candidates from both with one indexed
+-- scan of canonical_tests, however many aliases a test has.
+--
+-- Run once in the SQL editor, after price_stats.sql (this replaces its
+-- search_tests, keeping the same signature). Existing rows are backfilled
+-- from name, keywords and test_aliases; the next pipeline run rewrites
+-- them with the abbreviation expansions.
+-- =============================================
+
+ALTER TABLE canonical_tests ADD COLUMN IF NOT EXISTS search_text TEXT;
+ALTER TABLE canonical_tests ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(search_text, name))) STORED;
+
+UPDATE canonical_tests ct
+SET search_text = lower(concat_ws(' ; ',
+    ct.name,
+    array_to_string(ct.keywords, ' ; '),
+    (SELECT string_agg(ta.alias_lower, ' ; ') FROM test_aliases ta WHERE ta.canonical_test_id = ct.id)
+))
+WHERE ct.search_text IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_canonical_tests_search_tsv ON canonical_tests USING gin (search_tsv);
+CREATE INDEX IF NOT EXISTS idx_canonical_tests_search_text_trgm ON canonical_tests USING gin (search_text gin_trgm_ops);
+
+
+-- Ranked hybrid match. score adds up:
+--   1.0  exact name match
+--   0.4  ts_rank_cd of the full-text match (normalized to 0..1)
+--   0.3  word similarity of the query within search_text
+--   0.3  trigram similarity of the query to the name
+CREATE OR REPLACE FUNCTION search_canonical_tests(
+    search_query TEXT,
+    result_limit INT DEFAULT 50
+)
+RETURNS TABLE (
+    canonical_test_id INT,
+    score REAL
+) AS $$
+DECLARE
+    q TEXT := lower(trim(search_query));
+    -- Every word as a prefix, so partial input ("thyro") matches while typing
+    tsq TSQUERY := (
+        SELECT to_tsquery('english', string_agg(quote_literal(w) || ':*', ' & '))
+        FROM regexp_split_to_table(regexp_replace(lower(search_query), '[^a-z0-9]+', ' ', 'g'), ' ') AS w
+        WHERE w <> ''
+    );
+BEGIN
+    IF q = '' THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    WITH candidates AS (
+        SELECT ct.id FROM canonical_tests ct WHERE ct.search_tsv @@ tsq
+        UNION
+        SELECT ct.id FROM canonical_tests ct WHERE q <% ct.search_text
+    )
+    SELECT
+        ct.id,
+        (CASE WHEN lower(ct.name) = q THEN 1.0 ELSE 0.0 END
+         + 0.4 * COALESCE(ts_rank_cd(ct.search_tsv, tsq, 32), 0)
+         + 0.3 * word_similarity(q, coalesce(ct.search_text, lower(ct.name)))
+         + 0.3 * similarity(lower(ct.name), q))::REAL
+    FROM candidates c
+    JOIN canonical_tests ct ON ct.id = c.id
+    ORDER BY 2 DESC, 1
+    LIMIT result_limit;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+GRANT EXECUTE ON FUNCTION search_canonical_tests TO anon;
+GRANT EXECUTE ON FUNCTION search_canonical_tests TO authenticated;
+
+
+-- search_tests from price_stats.sql, matching through search_canonical_tests
+DROP FUNCTION IF EXISTS search_tests(TEXT, TEXT, TEXT, INT);
+
+CREATE OR REPLACE FUNCTION search_tests(
+    search_query TEXT,
+    city_filter TEXT DEFAULT NULL,
+    dept_filter TEXT DEFAULT NULL,
+    result_limit INT DEFAULT 50
+)
+RETURNS TABLE (
+    canonical_test_id INT,
+    test_name TEXT,
+    department TEXT,
+    similarity_score REAL,
+    lab_count BIGINT,
+    min_price DECIMAL,
+    max_price DECIMAL,
+    avg_price DECIMAL
+) AS $$
+DECLARE
+    -- An unknown city matches no stats row (-1), rather than the all-cities row
+    v_city_id INT := CASE WHEN city_filter IS NULL THEN NULL ELSE COALESCE(
+        (SELECT c.id FROM cities c WHERE lower(c.name) = lower(city_filter) ORDER BY c.id LIMIT 1), -1) END;
+BEGIN
+    RETURN QUERY
+    SELECT
+        ct.id,
+        ct.name,
+        d.name,
+        m.score,
+        COALESCE(ps.lab_count, 0)::BIGINT,
+        ps.min_price,
+        ps.max_price,
+        ps.avg_price
+    -- The department filter drops matches, so fetch more candidates when it is set
+    FROM search_canonical_tests(search_query, CASE WHEN dept_filter IS NULL THEN result_limit ELSE 1000 END) m
+    JOIN canonical_tests ct ON ct.id = m.canonical_test_id
+    LEFT JOIN departments d ON d.id = ct.department_id
+    LEFT JOIN canonical_test_price_stats ps
+        ON ps.canonical_test_id = ct.id AND ps.city_id IS NOT DISTINCT FROM v_city_id
+    WHERE
+        (dept_filter IS NULL OR lower(d.name) = lower(dept_filter))
+    ORDER BY m.score DESC, COALESCE(ps.lab_count, 0) DESC
+    LIMIT result_limit;
+END;
+$$ LANGUAGE plpgsql;
+
+GRANT EXECUTE ON FUNCTION search_tests TO anon;
+GRANT EXECUTE ON FUNCTION search_tests TO authenticated;
+
+NOTIFY pgrst, 'reload schema';
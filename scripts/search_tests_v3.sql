@@ -0,0 +1,69 @@
+-- =============================================
+-- Single-call search for the dashboard
+-- searchTests in the dashboard made up to four requests (canonical tests by
+-- ILIKE on the name, their price stats, the city) and reported a fixed
+-- similarity of 0.5, so aliases and abbreviations were never searched and
+-- results came back ordered by lab count alone. search_tests_v3() returns
+-- what the search page shows in one call:
+--   ranked matches from search_canonical_tests() (search_document.sql)
+--   the department name
+--   lab count and min/max/avg price for the city from
+--     canonical_test_price_stats (price_stats.sql), or the all-cities row
+-- Prices come back as the page displays them (average rounded to whole
+-- rupees, lab count as INT), so the client only renders. A plain SQL
+-- function with no side effects, so PostgREST can serve it over GET.
+-- search_tests keeps its signature for existing callers.
+--
+-- Run once in the SQL editor, after search_document.sql. Databases created
+-- from schema.sql after this was added already have it.
+-- =============================================
+
+DROP FUNCTION IF EXISTS search_tests_v3(TEXT, TEXT, TEXT, INT);
+
+CREATE OR REPLACE FUNCTION search_tests_v3(
+    search_query TEXT,
+    city_filter TEXT DEFAULT NULL,
+    dept_filter TEXT DEFAULT NULL,
+    result_limit INT DEFAULT 50
+)
+RETURNS TABLE (
+    canonical_test_id INT,
+    test_name TEXT,
+    department TEXT,
+    similarity_score REAL,
+    lab_count INT,
+    min_price DECIMAL,
+    max_price DECIMAL,
+    avg_price DECIMAL
+) AS $$
+    WITH scope AS (
+        -- An unknown city matches no stats row (-1), rather than the all-cities row
+        SELECT CASE WHEN city_filter IS NULL THEN NULL ELSE COALESCE(
+            (SELECT c.id FROM cities c WHERE lower(c.name) = lower(city_filter) ORDER BY c.id LIMIT 1), -1
+        ) END AS city_id
+    )
+    SELECT
+        ct.id,
+        ct.name,
+        d.name,
+        m.score,
+        COALESCE(ps.lab_count, 0),
+        ps.min_price,
+        ps.max_price,
+        round(ps.avg_price)
+    -- The department filter drops matches, so fetch more candidates when it is set
+    FROM search_canonical_tests(search_query, CASE WHEN dept_filter IS NULL THEN result_limit ELSE 1000 END) m
+    JOIN canonical_tests ct ON ct.id = m.canonical_test_id
+    LEFT JOIN departments d ON d.id = ct.department_id
+    CROSS JOIN scope
+    LEFT JOIN canonical_test_price_stats ps
+        ON ps.canonical_test_id = ct.id AND ps.city_id IS NOT DISTINCT FROM scope.city_id
+    WHERE dept_filter IS NULL OR lower(d.name) = lower(dept_filter)
+    ORDER BY m.score DESC, COALESCE(ps.lab_count, 0) DESC, ct.id
+    LIMIT result_limit;
+$$ LANGUAGE sql STABLE;
+
+GRANT EXECUTE ON FUNCTION search_tests_v3 TO anon;
+GRANT EXECUTE ON FUNCTION search_tests_v3 TO authenticated;
+
+NOTIFY pgrst, 'reload schema';
@@ -75,6 +75,8 @@ CREATE TABLE IF NOT EXISTS canonical_tests (
     methodology     TEXT,
     keywords        TEXT[],
     is_popular      BOOLEAN DEFAULT FALSE,
+    search_text     TEXT,  -- name, aliases and abbreviation expansions (search_document.sql)
+    row_hash        TEXT,  -- content hash for diff-only uploads
     created_at      TIMESTAMPTZ DEFAULT NOW(),
     updated_at      TIMESTAMPTZ DEFAULT NOW()
 );
@@ -88,6 +90,7 @@ CREATE TABLE IF NOT EXISTS lab_tests (
     canonical_test_id   INT REFERENCES canonical_tests(id),
     lab_location_id     INT REFERENCES lab_locations(id),
     source_test_code    TEXT,
+    source_key          TEXT NOT NULL,  -- source_test_code, or 'name:' + normalized name without one (natural_keys.sql)
     source_test_name    TEXT NOT NULL,
     source_product_id   TEXT,
     price               DECIMAL(10, 2),
@@ -109,8 +112,12 @@ CREATE TABLE IF NOT EXISTS lab_tests (
     raw_data            JSONB,
     match_confidence    DECIMAL(5, 4),
     match_method        TEXT,
+    row_hash            TEXT,  -- content hash for diff-only uploads
     created_at          TIMESTAMPTZ DEFAULT NOW(),
-    updated_at          TIMESTAMPTZ DEFAULT NOW()
+    updated_at          TIMESTAMPTZ DEFAULT NOW(),
+    -- Natural key for idempotent upserts; NULL locations compare equal (PG15+)
+    CONSTRAINT lab_tests_natural_key
+        UNIQUE NULLS NOT DISTINCT (lab_id, source_key, lab_location_id)
 );
 
 -- =============================================
@@ -120,9 +127,58 @@ CREATE TABLE IF NOT EXISTS test_aliases (
     id                  SERIAL PRIMARY KEY,
     canonical_test_id   INT NOT NULL REFERENCES canonical_tests(id),
     alias               TEXT NOT NULL,
+    alias_lower         TEXT GENERATED ALWAYS AS (lower(alias)) STORED,
     source_lab_id       INT REFERENCES labs(id),
     created_at          TIMESTAMPTZ DEFAULT NOW(),
-    UNIQUE(canonical_test_id, alias)
+    CONSTRAINT test_aliases_natural_key UNIQUE (canonical_test_id, alias_lower)
+);
+
+-- =============================================
+-- TABLE: canonical_test_price_stats (refreshed by the pipeline, see price_stats.sql)
+-- =============================================
+CREATE TABLE IF NOT EXISTS canonical_test_price_stats (
+    canonical_test_id   INT NOT NULL REFERENCES canonical_tests(id),
+    city_id             INT REFERENCES cities(id),  -- NULL: all cities
+    lab_count           INT NOT NULL,
+    min_price           DECIMAL(10, 2),
+    max_price           DECIMAL(10, 2),
+    avg_price           DECIMAL(10, 2),
+    median_price        DECIMAL(10, 2),
+    cheapest_lab_id     INT REFERENCES labs(id),
+    refreshed_at        TIMESTAMPTZ DEFAULT NOW(),
+    CONSTRAINT canonical_test_price_stats_key
+        UNIQUE NULLS NOT DISTINCT (canonical_test_id, city_id)
+);
+
+-- =============================================
+-- TABLE: price_heatmap (written by the pipeline, see price_heatmap.sql)
+-- =============================================
+CREATE TABLE IF NOT EXISTS price_heatmap (
+    id                  SERIAL PRIMARY KEY,
+    city_id             INT NOT NULL REFERENCES cities(id),
+    canonical_test_id   INT NOT NULL REFERENCES canonical_tests(id),
+    lab_prices          JSONB NOT NULL,  -- {lab slug: average price}
+    lab_count           SMALLINT NOT NULL,
+    min_price           DECIMAL(10, 2),
+    max_price           DECIMAL(10, 2),
+    price_spread        DECIMAL(10, 2),
+    is_active           BOOLEAN DEFAULT TRUE,
+    row_hash            TEXT,  -- content hash for diff-only uploads
+    CONSTRAINT price_heatmap_natural_key UNIQUE (city_id, canonical_test_id)
+);
+
+-- =============================================
+-- TABLE: department_availability (written by the pipeline, see department_availability.sql)
+-- =============================================
+CREATE TABLE IF NOT EXISTS department_availability (
+    id                  SERIAL PRIMARY KEY,
+    city_id             INT NOT NULL REFERENCES cities(id),
+    department_id       INT NOT NULL REFERENCES departments(id),
+    lab_id              INT NOT NULL REFERENCES labs(id),
+    test_count          INT NOT NULL,  -- distinct canonical tests
+    is_active           BOOLEAN DEFAULT TRUE,
+    row_hash            TEXT,  -- content hash for diff-only uploads
+    CONSTRAINT department_availability_natural_key UNIQUE (city_id, department_id, lab_id)
 );
 
 -- =============================================
@@ -130,13 +186,21 @@ CREATE TABLE IF NOT EXISTS test_aliases (
 -- =============================================
 CREATE INDEX IF NOT EXISTS idx_canonical_tests_name_trgm ON canonical_tests USING gin (name gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_canonical_tests_keywords ON canonical_tests USING gin (keywords);
-CREATE INDEX IF NOT EXISTS idx_lab_tests_canonical ON lab_tests(canonical_test_id) WHERE canonical_test_id IS NOT NULL;
-CREATE INDEX IF NOT EXISTS idx_lab_tests_lab ON lab_tests(lab_id);
+-- Covering indexes (see covering_indexes.sql): per-test and per-lab reads are index-only scans
+CREATE INDEX IF NOT EXISTS idx_lab_tests_canonical_covering ON lab_tests(canonical_test_id, is_active) INCLUDE (price, lab_id, lab_location_id, tat_hours) WHERE canonical_test_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_lab_tests_lab_covering ON lab_tests(lab_id, is_active) INCLUDE (canonical_test_id, price, lab_location_id);
 CREATE INDEX IF NOT EXISTS idx_lab_tests_location ON lab_tests(lab_location_id);
 CREATE INDEX IF NOT EXISTS idx_lab_tests_source_name_trgm ON lab_tests USING gin (source_test_name gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_test_aliases_alias_trgm ON test_aliases USING gin (alias gin_trgm_ops);
 CREATE INDEX IF NOT EXISTS idx_test_aliases_canonical ON test_aliases(canonical_test_id);
 CREATE INDEX IF NOT EXISTS idx_lab_tests_code_lab ON lab_tests(source_test_code, lab_id);
+CREATE INDEX IF NOT EXISTS idx_price_heatmap_city_spread ON price_heatmap(city_id, price_spread DESC) WHERE is_active = TRUE;
+
+-- Search document: full-text half as a generated column (Postgres only, so outside CREATE TABLE)
+ALTER TABLE canonical_tests ADD COLUMN IF NOT EXISTS search_tsv TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(search_text, name))) STORED;
+CREATE INDEX IF NOT EXISTS idx_canonical_tests_search_tsv ON canonical_tests USING gin (search_tsv);
+CREATE INDEX IF NOT EXISTS idx_canonical_tests_search_text_trgm ON canonical_tests USING gin (search_text gin_trgm_ops);
 
 -- =============================================
 -- VIEW: test_comparison
@@ -178,6 +242,9 @@ ALTER TABLE canonical_tests ENABLE ROW LEVEL SECURITY;
 ALTER TABLE lab_tests ENABLE ROW LEVEL SECURITY;
 ALTER TABLE test_aliases ENABLE ROW LEVEL SECURITY;
 ALTER TABLE lab_locations ENABLE ROW LEVEL SECURITY;
+ALTER TABLE canonical_test_price_stats ENABLE ROW LEVEL SECURITY;
+ALTER TABLE price_heatmap ENABLE ROW LEVEL SECURITY;
+ALTER TABLE department_availability ENABLE ROW LEVEL SECURITY;
 
 -- Public read access
 DO $$ BEGIN
@@ -202,6 +269,15 @@ DO $$ BEGIN
     IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE policyname = 'Public read lab_locations') THEN
         CREATE POLICY "Public read lab_locations" ON lab_locations FOR SELECT USING (true);
     END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE policyname = 'Public read canonical_test_price_stats') THEN
+        CREATE POLICY "Public read canonical_test_price_stats" ON canonical_test_price_stats FOR SELECT USING (true);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE policyname = 'Public read price_heatmap') THEN
+        CREATE POLICY "Public read price_heatmap" ON price_heatmap FOR SELECT USING (true);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE policyname = 'Public read department_availability') THEN
+        CREATE POLICY "Public read department_availability" ON department_availability FOR SELECT USING (true);
+    END IF;
 END $$;
 
 -- =============================================
@@ -250,6 +326,95 @@ BEGIN
     LIMIT result_limit;
 END;
 $$ LANGUAGE plpgsql;
+
+-- =============================================
+-- FUNCTION: search_canonical_tests (see search_document.sql)
+-- =============================================
+CREATE OR REPLACE FUNCTION search_canonical_tests(
+    search_query TEXT,
+    result_limit INT DEFAULT 50
+)
+RETURNS TABLE (
+    canonical_test_id INT,
+    score REAL
+) AS $$
+DECLARE
+    q TEXT := lower(trim(search_query));
+    -- Every word as a prefix, so partial input ("thyro") matches while typing
+    tsq TSQUERY := (
+        SELECT to_tsquery('english', string_agg(quote_literal(w) || ':*', ' & '))
+        FROM regexp_split_to_table(regexp_replace(lower(search_query), '[^a-z0-9]+', ' ', 'g'), ' ') AS w
+        WHERE w <> ''
+    );
+BEGIN
+    IF q = '' THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    WITH candidates AS (
+        SELECT ct.id FROM canonical_tests ct WHERE ct.search_tsv @@ tsq
+        UNION
+        SELECT ct.id FROM canonical_tests ct WHERE q <% ct.search_text
+    )
+    SELECT
+        ct.id,
+        (CASE WHEN lower(ct.name) = q THEN 1.0 ELSE 0.0 END
+         + 0.4 * COALESCE(ts_rank_cd(ct.search_tsv, tsq, 32), 0)
+         + 0.3 * word_similarity(q, coalesce(ct.search_text, lower(ct.name)))
+         + 0.3 * similarity(lower(ct.name), q))::REAL
+    FROM candidates c
+    JOIN canonical_tests ct ON ct.id = c.id
+    ORDER BY 2 DESC, 1
+    LIMIT result_limit;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- =============================================
+-- FUNCTION: search_tests_v3 (see search_tests_v3.sql)
+-- =============================================
+CREATE OR REPLACE FUNCTION search_tests_v3(
+    search_query TEXT,
+    city_filter TEXT DEFAULT NULL,
+    dept_filter TEXT DEFAULT NULL,
+    result_limit INT DEFAULT 50
+)
+RETURNS TABLE (
+    canonical_test_id INT,
+    test_name TEXT,
+    department TEXT,
+    similarity_score REAL,
+    lab_count INT,
+    min_price DECIMAL,
+    max_price DECIMAL,
+    avg_price DECIMAL
+) AS $$
+    WITH scope AS (
+        -- An unknown city matches no stats row (-1), rather than the all-cities row
+        SELECT CASE WHEN city_filter IS NULL THEN NULL ELSE COALESCE(
+            (SELECT c.id FROM cities c WHERE lower(c.name) = lower(city_filter) ORDER BY c.id LIMIT 1), -1
+        ) END AS city_id
+    )
+    SELECT
+        ct.id,
+        ct.name,
+        d.name,
+        m.score,
+        COALESCE(ps.lab_count, 0),
+        ps.min_price,
+        ps.max_price,
+        round(ps.avg_price)
+    -- The department filter drops matches, so fetch more candidates when it is set
+    FROM search_canonical_tests(search_query, CASE WHEN dept_filter IS NULL THEN result_limit ELSE 1000 END) m
+    JOIN canonical_tests ct ON ct.id = m.canonical_test_id
+    LEFT JOIN departments d ON d.id = ct.department_id
+    CROSS JOIN scope
+    LEFT JOIN canonical_test_price_stats ps
+        ON ps.canonical_test_id = ct.id AND ps.city_id IS NOT DISTINCT FROM scope.city_id
+    WHERE dept_filter IS NULL OR lower(d.name) = lower(dept_filter)
+    ORDER BY m.score DESC, COALESCE(ps.lab_count, 0) DESC, ct.id
+    LIMIT result_limit;
+$$ LANGUAGE sql STABLE;
 """
 
 
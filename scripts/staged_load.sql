@@ -0,0 +1,157 @@
+-- =============================================
+-- Staged bulk load of lab_tests with deferred indexes and an atomic swap
+--
+-- lab_tests_staging has the same columns as lab_tests but, while loading,
+-- only its primary key and natural key (needed for idempotent upserts).
+-- The GIN trigram and other secondary indexes are not maintained row by row.
+--   begin_lab_tests_staging()  empties staging and drops its secondary
+--                              indexes and foreign keys
+--   (pipeline uploads into lab_tests_staging)
+--   swap_lab_tests_staging()   builds the indexes and foreign keys once,
+--                              then swaps the two tables by renaming them
+--                              in a single transaction
+-- Readers see either the old or the new dataset, never a half-loaded one.
+-- After the swap, lab_tests_staging holds the previous dataset until the
+-- next begin, so a bad load can be undone by swapping again.
+--
+-- Run once in the SQL editor. On Supabase the swap runs under the
+-- service_role statement_timeout; use `--sink postgres` if index builds
+-- on the full table exceed it.
+-- =============================================
+
+CREATE TABLE IF NOT EXISTS lab_tests_staging
+    (LIKE lab_tests INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY);
+
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'lab_tests_staging_pkey') THEN
+        ALTER TABLE lab_tests_staging ADD CONSTRAINT lab_tests_staging_pkey PRIMARY KEY (id);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'lab_tests_staging_natural_key') THEN
+        ALTER TABLE lab_tests_staging ADD CONSTRAINT lab_tests_staging_natural_key
+            UNIQUE NULLS NOT DISTINCT (lab_id, source_key, lab_location_id);
+    END IF;
+END $$;
+
+ALTER TABLE lab_tests_staging ENABLE ROW LEVEL SECURITY;
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_policies WHERE tablename = 'lab_tests_staging' AND policyname = 'Public read lab_tests') THEN
+        -- Same policy as lab_tests, so it is already in place after a swap
+        CREATE POLICY "Public read lab_tests" ON lab_tests_staging FOR SELECT USING (true);
+    END IF;
+END $$;
+-- Half-loaded data is never exposed
+REVOKE ALL ON lab_tests_staging FROM anon, authenticated;
+
+
+-- Secondary (non-constraint) indexes of a table
+CREATE OR REPLACE FUNCTION _secondary_indexes(tbl TEXT)
+RETURNS TABLE (index_name TEXT, index_def TEXT) AS $$
+    SELECT i.relname::TEXT, pg_get_indexdef(i.oid)
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    WHERE x.indrelid = tbl::regclass
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.oid);
+$$ LANGUAGE sql STABLE;
+
+
+CREATE OR REPLACE FUNCTION begin_lab_tests_staging()
+RETURNS VOID AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    TRUNCATE lab_tests_staging;
+    FOR r IN SELECT index_name FROM _secondary_indexes('lab_tests_staging') LOOP
+        EXECUTE format('DROP INDEX %I', r.index_name);
+    END LOOP;
+    FOR r IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'lab_tests_staging'::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE lab_tests_staging DROP CONSTRAINT %I', r.conname);
+    END LOOP;
+    NOTIFY pgrst, 'reload schema';
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+
+CREATE OR REPLACE FUNCTION swap_lab_tests_staging()
+RETURNS TABLE (rows_live BIGINT, rows_previous BIGINT) AS $$
+DECLARE
+    r RECORD;
+    views RECORD;
+    view_defs TEXT[][] := '{}';
+BEGIN
+    -- 1. Build lab_tests' secondary indexes and foreign keys on the staging
+    --    table in one pass each, under temporary names
+    FOR r IN SELECT index_name, index_def FROM _secondary_indexes('lab_tests') LOOP
+        EXECUTE regexp_replace(
+            replace(r.index_def, 'INDEX ' || r.index_name || ' ', 'INDEX ' || r.index_name || '_next '),
+            ' ON (\S+\.)?lab_tests ', ' ON \1lab_tests_staging '
+        );
+    END LOOP;
+    FOR r IN
+        SELECT conname, pg_get_constraintdef(oid) AS def FROM pg_constraint
+        WHERE conrelid = 'lab_tests'::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE lab_tests_staging ADD CONSTRAINT %I %s', r.conname, r.def);
+    END LOOP;
+    ANALYZE lab_tests_staging;
+
+    -- 2. Views bind to the table, not its name: keep their definitions so
+    --    they can be repointed at the new table after the rename
+    FOR views IN
+        SELECT DISTINCT v.oid::regclass::TEXT AS name, pg_get_viewdef(v.oid) AS def
+        FROM pg_depend d
+        JOIN pg_rewrite rw ON rw.oid = d.objid
+        JOIN pg_class v ON v.oid = rw.ev_class AND v.relkind = 'v'
+        WHERE d.refobjid = 'lab_tests'::regclass
+    LOOP
+        view_defs := view_defs || ARRAY[[views.name, views.def]];
+    END LOOP;
+
+    -- 3. Swap: readers block only for the renames below
+    LOCK TABLE lab_tests, lab_tests_staging IN ACCESS EXCLUSIVE MODE;
+    ALTER TABLE lab_tests RENAME TO lab_tests_swap;
+    ALTER TABLE lab_tests_staging RENAME TO lab_tests;
+    ALTER TABLE lab_tests_swap RENAME TO lab_tests_staging;
+
+    ALTER TABLE lab_tests RENAME CONSTRAINT lab_tests_staging_pkey TO lab_tests_swap_pkey;
+    ALTER TABLE lab_tests_staging RENAME CONSTRAINT lab_tests_pkey TO lab_tests_staging_pkey;
+    ALTER TABLE lab_tests RENAME CONSTRAINT lab_tests_swap_pkey TO lab_tests_pkey;
+    ALTER TABLE lab_tests RENAME CONSTRAINT lab_tests_staging_natural_key TO lab_tests_swap_natural_key;
+    ALTER TABLE lab_tests_staging RENAME CONSTRAINT lab_tests_natural_key TO lab_tests_staging_natural_key;
+    ALTER TABLE lab_tests RENAME CONSTRAINT lab_tests_swap_natural_key TO lab_tests_natural_key;
+
+    -- 4. The previous data keeps only its keys; the new indexes take the live names
+    FOR r IN SELECT index_name FROM _secondary_indexes('lab_tests_staging') LOOP
+        EXECUTE format('DROP INDEX %I', r.index_name);
+    END LOOP;
+    FOR r IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'lab_tests_staging'::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE lab_tests_staging DROP CONSTRAINT %I', r.conname);
+    END LOOP;
+    FOR r IN SELECT index_name FROM _secondary_indexes('lab_tests') LOOP
+        EXECUTE format('ALTER INDEX %I RENAME TO %I', r.index_name, left(r.index_name, -length('_next')));
+    END LOOP;
+
+    FOR i IN 1 .. coalesce(array_length(view_defs, 1), 0) LOOP
+        EXECUTE format('CREATE OR REPLACE VIEW %s AS %s', view_defs[i][1], view_defs[i][2]);
+    END LOOP;
+
+    GRANT SELECT ON lab_tests TO anon, authenticated;
+    REVOKE ALL ON lab_tests_staging FROM anon, authenticated;
+    NOTIFY pgrst, 'reload schema';
+
+    RETURN QUERY SELECT
+        (SELECT count(*) FROM lab_tests),
+        (SELECT count(*) FROM lab_tests_staging);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public SET maintenance_work_mem = '256MB';
+
+-- Writes are for the pipeline only
+REVOKE EXECUTE ON FUNCTION begin_lab_tests_staging() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION swap_lab_tests_staging() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION begin_lab_tests_staging() TO service_role;
+GRANT EXECUTE ON FUNCTION swap_lab_tests_staging() TO service_role;
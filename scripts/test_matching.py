@@ -1,6 +1,14 @@
-"""Test the matching algorithm locally without Supabase."""
+"""Test the matching algorithm locally without Supabase.
+
+Usage:
+    python scripts/test_matching.py [--profile] [--run-dir runs/test_matching]
+
+With --profile, writes a Chrome trace (trace.json), cProfile stats for each
+loader and matching stage, and a memory report to <run-dir>/profile.
+"""
 import sys
 import os
+import argparse
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from pipeline.config import CSV_FILES
@@ -10,9 +18,20 @@ from pipeline.ingest.apollo_loader import ApolloLoader
 from pipeline.ingest.neuberg_loader import NeubergLoader
 from pipeline.ingest.trustlab_loader import TRUSTlabLoader
 from pipeline.matching.matcher import TestMatcher
+from pipeline.matching.package_matcher import PackageMatcher, has_composition
+from pipeline.profiling import PROFILER, span
+
+DEFAULT_RUN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "runs", "test_matching")
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", action="store_true", help="profile the run into <run-dir>/profile")
+    parser.add_argument("--run-dir", default=DEFAULT_RUN_DIR)
+    args = parser.parse_args()
+    if args.profile:
+        PROFILER.start(os.path.join(args.run_dir, "profile"))
+
     print("=== Loading CSVs ===")
 
     loaders = {
@@ -29,7 +48,8 @@ def main():
         if not csv_path or not os.path.exists(csv_path):
             print(f"  WARNING: CSV not found for {slug}: {csv_path}")
             continue
-        tests = loader.load(csv_path)
+        with span(f"load {slug}", "ingest", profile=True):
+            tests = loader.load(csv_path)
         all_tests[slug] = tests
 
     # Get unique tests for matching
@@ -51,11 +71,17 @@ def main():
 
         unique_tests.extend(unique)
 
-    print(f"\n  Total unique tests for matching: {len(unique_tests)}")
+    packages = [t for t in unique_tests if has_composition(t)]
+    unique_tests = [t for t in unique_tests if not has_composition(t)]
+    print(f"\n  Total unique tests for matching: {len(unique_tests)} (+{len(packages)} packages)")
 
     # Run matching
     matcher = TestMatcher()
-    assignments = matcher.run(unique_tests)
+    with span("match tests", "step", profile=True):
+        matcher.run(unique_tests)
+    package_matcher = PackageMatcher(matcher)
+    with span("match packages", "step", profile=True, packages=len(packages)):
+        assignments = package_matcher.run(packages)
     canonicals = matcher.get_canonical_tests()
 
     # Summary
@@ -89,12 +115,29 @@ def main():
         for n in names:
             print(f"    {n}")
 
+    # Show cross-lab package equivalents found by composition
+    print(f"\n=== Sample Package Matches (by composition) ===")
+    pkg_clusters = [
+        cid for cid in package_matcher.package_bits
+        if len(set(m["lab_slug"] for m in matcher.clusters[cid])) >= 2
+    ]
+    print(f"  Cross-lab package clusters: {len(pkg_clusters)}")
+    for cid in pkg_clusters[:10]:
+        bits = package_matcher.package_bits[cid]
+        print(f"\n  [{bits.bit_count()} tests] {matcher.clusters[cid][0]['source_test_name']}")
+        for m in matcher.clusters[cid]:
+            print(f'    {m["lab_slug"]}:"{m["source_test_name"][:50]}" ({m["confidence"]})')
+
     # Show lab distribution
     print(f"\n=== Lab Distribution ===")
     for lab_count in [5, 4, 3, 2, 1]:
         count = sum(1 for c in canonicals if c["lab_count"] == lab_count)
         print(f"  {lab_count} labs: {count} tests")
 
+    profile_dir = PROFILER.finish()
+    if profile_dir:
+        print(f"\nProfile written to {profile_dir} (trace.json, <span>.prof/.txt, memory.txt)")
+
 
 if __name__ == "__main__":
     main()
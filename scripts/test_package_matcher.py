@@ -0,0 +1,132 @@
+"""Test composition-based package matching on hand-built packages.
+
+Usage:
+    python scripts/test_package_matcher.py
+
+No lab export lists a package's tests yet, so no CSV exercises
+PackageMatcher. This builds single tests at three labs, runs the
+TestMatcher on them, then matches packages with `components` and checks:
+- bitsets: one bit per resolved component, case and spacing differences
+  resolve to the same cluster, unresolved names are skipped
+- popcount Jaccard on known bitsets
+- find_equivalent honours the threshold and ranks best first
+- run(): equivalent packages across labs share a cluster, packages below
+  PACKAGE_MATCH_THRESHOLD stay apart, and packages none of whose components
+  resolve fall back to exact-name grouping
+- has_composition only selects packages that have components
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from pipeline.config import PACKAGE_MATCH_THRESHOLD
+from pipeline.models import NormalizedLabTest
+from pipeline.matching.matcher import TestMatcher
+from pipeline.matching.package_matcher import PackageMatcher, has_composition, iter_bits, jaccard
+
+SINGLE_TESTS = ["Hemoglobin", "Glucose Fasting", "TSH", "Lipid Profile", "Creatinine", "Vitamin D"]
+BASIC = ["Hemoglobin", "Glucose Fasting", "TSH", "Lipid Profile", "Creatinine"]
+
+ok = True
+
+
+def check(passed: bool, label: str):
+    global ok
+    print(f"  [{'PASS' if passed else 'FAIL'}] {label}")
+    ok = ok and passed
+
+
+def test(lab: str, code: str, name: str) -> NormalizedLabTest:
+    return NormalizedLabTest(lab_slug=lab, source_test_code=code, source_test_name=name)
+
+
+def package(lab: str, code: str, name: str, components: list[str]) -> NormalizedLabTest:
+    return NormalizedLabTest(lab_slug=lab, source_test_code=code, source_test_name=name, test_type="package",
+                             components=components)
+
+
+def build_matcher() -> TestMatcher:
+    matcher = TestMatcher()
+    matcher.run([
+        test(lab, f"{lab[0].upper()}{i}", name)
+        for lab in ("metropolis", "agilus", "neuberg")
+        for i, name in enumerate(SINGLE_TESTS)
+    ])
+    return matcher
+
+
+def main():
+    print("=== Jaccard ===")
+    check(jaccard(0b011, 0b110) == 1 / 3, "jaccard(011, 110) = 1/3")
+    check(jaccard(0b101, 0b101) == 1.0, "identical bitsets score 1.0")
+    check(jaccard(0, 0) == 0.0, "empty bitsets score 0.0")
+    check(list(iter_bits(0b10110)) == [1, 2, 4], "iter_bits yields set positions lowest first")
+
+    matcher = build_matcher()
+    cluster_of = {m["source_test_name"]: cid for cid, members in matcher.clusters.items() for m in members}
+    packages = [
+        package("metropolis", "MP1", "Basic Health Checkup", BASIC),
+        # Same tests, cased and spaced differently
+        package("agilus", "AP1", "Aarogyam Basic", ["HEMOGLOBIN", "glucose  fasting", "tsh", "Lipid profile",
+                                                     "Creatinine"]),
+        # Same tests plus one no single test resolves to
+        package("neuberg", "NP1", "Essential Panel", BASIC + ["Unlisted Marker X"]),
+        # Shares two of six clusters with the basic checkup
+        package("neuberg", "NP2", "Sugar And Vitamin", ["Hemoglobin", "Glucose Fasting", "Vitamin D"]),
+        # Nothing resolves: grouped by exact name
+        package("metropolis", "MP2", "Wellness Gold", ["Unlisted Marker Y", "Unlisted Marker Z"]),
+        package("agilus", "AP2", "wellness  gold", ["Unlisted Marker Y"]),
+    ]
+    basic, spelled, extra, sugar, gold_m, gold_a = packages
+
+    print("\n=== Bitsets ===")
+    pm = PackageMatcher(matcher)
+    basic_bits = pm.to_bitset(basic)
+    check(basic_bits.bit_count() == len(BASIC), f"{len(BASIC)} components give {len(BASIC)} bits")
+    check(sorted(pm.component_clusters(basic_bits)) == sorted(cluster_of[n] for n in BASIC),
+          "bits map back to the components' clusters")
+    check(pm.to_bitset(spelled) == basic_bits, "case and spacing differences resolve to the same bits")
+    check(pm.to_bitset(extra) == basic_bits, "an unresolved component adds no bit")
+    check(pm.to_bitset(gold_m) == 0, "a package with no resolvable component has an empty bitset")
+
+    print("\n=== run() ===")
+    assignments = PackageMatcher(matcher).run(packages)
+    cid = {t.source_test_code: assignments[matcher._make_key(t)] for t in packages}
+    check(cid["MP1"] == cid["AP1"] == cid["NP1"], "equivalent packages at three labs share a cluster")
+    members = {m["source_test_code"]: m for m in matcher.clusters[cid["MP1"]]}
+    check(members["AP1"]["confidence"] == 1.0 and members["AP1"]["method"] == "package_composition",
+          "joined by composition with confidence 1.0")
+    sugar_score = jaccard(pm.to_bitset(sugar), basic_bits)
+    check(sugar_score < PACKAGE_MATCH_THRESHOLD and cid["NP2"] != cid["MP1"],
+          f"a package at Jaccard {sugar_score:.2f} < {PACKAGE_MATCH_THRESHOLD} gets its own cluster")
+    check(cid["MP2"] == cid["AP2"] and cid["MP2"] not in (cid["MP1"], cid["NP2"]),
+          "unresolved packages with the same name are grouped by name")
+    check({m["method"] for m in matcher.clusters[cid["MP2"]]} == {"exact_name"}, "grouped with method exact_name")
+    singles = set(cluster_of.values())
+    check(not singles & set(cid.values()), "packages never join a single-test cluster")
+
+    print("\n=== find_equivalent ===")
+    # Bit positions are per PackageMatcher, so query the one that registered the packages
+    fresh = build_matcher()
+    package_matcher = PackageMatcher(fresh)
+    assignments = package_matcher.run(packages[:4])
+    bits = package_matcher.to_bitset(basic)
+    found = package_matcher.find_equivalent(bits)
+    check(len(found) == 1 and found[0] == (assignments[fresh._make_key(basic)], 1.0),
+          "only the equivalent package passes the default threshold, at 1.0")
+    loose = package_matcher.find_equivalent(bits, min_jaccard=0.3)
+    check(len(loose) == 2 and loose[0][1] >= loose[1][1] and round(loose[1][1], 4) == round(sugar_score, 4),
+          "a lower min_jaccard adds the partial match, ranked after the full one")
+    check(package_matcher.find_equivalent(0) == [], "an empty bitset has no candidates")
+
+    print("\n=== has_composition ===")
+    check(has_composition(basic), "a package with components")
+    check(not has_composition(package("apollo", "X1", "Bare Package", [])), "not a package without components")
+    check(not has_composition(NormalizedLabTest(lab_slug="apollo", source_test_name="TSH", components=["TSH"])),
+          "not a single test, even with components")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
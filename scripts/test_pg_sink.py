@@ -0,0 +1,124 @@
+"""Test the COPY-based Postgres sink against a local Postgres.
+
+Usage:
+    DATABASE_URL=postgresql://postgres@localhost/postgres python scripts/test_pg_sink.py
+
+Creates the schema from scripts/schema.sql inside a throwaway `sink_test`
+schema, loads sample rows through PostgresSink twice per COPY format, and
+checks the second load updates in place instead of duplicating rows.
+The test schema is dropped afterwards.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from pipeline.config import DATABASE_URL
+from pipeline.db import NATURAL_KEYS, dedupe_by_key, stream_rows
+from pipeline.sinks.postgres_sink import PostgresSink
+
+TEST_SCHEMA = "sink_test"
+
+
+def load_once(sink: PostgresSink, price: float) -> dict[str, int]:
+    written = {}
+    written["labs"] = sink.upsert("labs", [
+        {"name": "Lab A", "slug": "lab-a", "website_url": None},
+        {"name": "Lab B", "slug": "lab-b", "website_url": None},
+    ], NATURAL_KEYS["labs"])
+    lab_ids = {r["slug"]: r["id"] for r in sink.select("labs", "id, slug")}
+
+    written["lab_locations"] = sink.upsert("lab_locations", [
+        {"lab_id": lab_ids["lab-a"], "city_id": None, "location_code": "DELHI", "location_name": "Delhi"},
+    ], NATURAL_KEYS["lab_locations"])
+    loc_id = sink.select("lab_locations", "id")[0]["id"]
+
+    written["canonical_tests"] = sink.upsert("canonical_tests", [
+        {"name": f"Test {i}", "slug": f"test-{i}", "keywords": [f"Test {i}", f"T{i}"], "is_popular": False}
+        for i in range(1000)
+    ], NATURAL_KEYS["canonical_tests"])
+    ct_ids = {r["slug"]: r["id"] for r in sink.select("canonical_tests", "id, slug")}
+
+    lab_tests = [
+        {
+            "lab_id": lab_ids["lab-a" if i % 2 else "lab-b"],
+            "canonical_test_id": ct_ids[f"test-{i % 1000}"],
+            "lab_location_id": loc_id if i % 3 else None,
+            "source_test_code": f"C{i}" if i % 7 else None,
+            "source_key": f"C{i}" if i % 7 else f"name:test {i}, serum",
+            "source_test_name": f"Test {i}, Serum",
+            "price": price,
+            "raw_data": {"row": i, "note": 'quote " and, comma'},
+            "is_active": True,
+        }
+        for i in range(5000)
+    ]
+    written["lab_tests"] = sink.upsert(
+        "lab_tests", dedupe_by_key(lab_tests, NATURAL_KEYS["lab_tests"]), NATURAL_KEYS["lab_tests"],
+    )
+
+    aliases = [
+        {"canonical_test_id": ct_ids["test-1"], "alias": "Thyroid Profile"},
+        {"canonical_test_id": ct_ids["test-1"], "alias": "THYROID PROFILE"},
+        {"canonical_test_id": ct_ids["test-2"], "alias": "Lipid Profile"},
+    ]
+    written["test_aliases"] = sink.upsert(
+        "test_aliases", dedupe_by_key(aliases, NATURAL_KEYS["test_aliases"]),
+        NATURAL_KEYS["test_aliases"], ignore_duplicates=True,
+    )
+    return written
+
+
+def count(sink: PostgresSink, table: str) -> int:
+    return len(sink.select(table, "id"))
+
+
+def main():
+    if not DATABASE_URL:
+        print("ERROR: Set DATABASE_URL to a local Postgres")
+        sys.exit(1)
+
+    schema_path = os.path.join(os.path.dirname(__file__), "schema.sql")
+    with open(schema_path) as f:
+        schema_sql = f.read()
+
+    ok = True
+    for copy_format in ("binary", "csv"):
+        sink = PostgresSink(DATABASE_URL, copy_format)
+        sink.conn.execute(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE")
+        sink.conn.execute(f"CREATE SCHEMA {TEST_SCHEMA}")
+        sink.conn.execute(f"SET search_path TO {TEST_SCHEMA}, public")
+        sink.conn.execute(schema_sql)
+
+        try:
+            print(f"\n=== COPY {copy_format} ===")
+            first = load_once(sink, 100.0)
+            counts_first = {t: count(sink, t) for t in first}
+            second = load_once(sink, 120.0)
+            counts_second = {t: count(sink, t) for t in second}
+            prices = {r["price"] for r in sink.select("lab_tests", "price")}
+            streamed = [r["id"] for r in stream_rows(sink, "lab_tests", "id", page_size=333)]
+            unprefetched = [r["id"] for r in stream_rows(sink, "lab_tests", "id", page_size=333, prefetch=False)]
+
+            for table in first:
+                print(f"  {table}: wrote {first[table]} then {second[table]}, {counts_second[table]} rows stored")
+
+            checks = [
+                ("rerun adds no rows", counts_first == counts_second),
+                ("rerun updates prices", prices == {120}),
+                ("case-variant alias collapsed", counts_second["test_aliases"] == 2),
+                ("keyset stream reads every row once, in order",
+                 streamed == sorted(streamed) and len(set(streamed)) == counts_second["lab_tests"]),
+                ("stream without prefetch matches", unprefetched == streamed),
+            ]
+            for name, passed in checks:
+                print(f"  [{'PASS' if passed else 'FAIL'}] {name}")
+                ok = ok and passed
+        finally:
+            sink.conn.execute(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE")
+            sink.close()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
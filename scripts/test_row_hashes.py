@@ -0,0 +1,111 @@
+"""Test that row hashes do not depend on Python's string hash seed.
+
+Usage:
+    python scripts/test_row_hashes.py [--scale 0.05] [--seeds 1,2,3]
+
+Writes a small synthetic catalogue (pipeline/synthetic.py), then in one
+fresh process per PYTHONHASHSEED loads it, runs step 4 (matching) and
+builds the canonical_tests and lab_tests rows steps 5 and 6 would upload.
+Each process reports every row's natural key and row_hash; the check passes
+when all processes agree. A difference means some row content comes from
+set or dict iteration order, and every diff run would re-upload those rows.
+"""
+import sys
+import os
+import json
+import argparse
+import tempfile
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+RESULT_PREFIX = "RESULT "
+
+
+def build_hashes(data_dir: str) -> dict:
+    """{table: {natural key: row_hash}} for the rows of steps 5 and 6."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import run_pipeline
+    from pipeline.diff import add_row_hashes, row_hash
+    from pipeline.matching.linker import LinkageIndex
+
+    loaders = {
+        "metropolis": run_pipeline.MetropolisLoader(),
+        "agilus": run_pipeline.AgilusLoader(),
+        "apollo": run_pipeline.ApolloLoader(),
+        "neuberg": run_pipeline.NeubergLoader(),
+        "trustlab": run_pipeline.TRUSTlabLoader(),
+    }
+    all_tests = {
+        slug: loader.load(os.path.join(data_dir, f"{slug}_tests_directory.csv"))
+        for slug, loader in loaders.items()
+    }
+    matcher, _, canonicals = run_pipeline.step4_run_matching(all_tests, loaders)
+
+    # Department and canonical ids come from the database; stand in stable ones
+    dept_id_map = {d["name"]: d["name"] for d in run_pipeline.get_all_departments()}
+    canonical_rows = [run_pipeline.canonical_test_row(ct, dept_id_map) for ct in canonicals]
+    add_row_hashes(canonical_rows)
+    cluster_to_ct_id = {ct["cluster_id"]: row["slug"] for ct, row in zip(canonicals, canonical_rows)}
+
+    linkage = LinkageIndex(matcher)
+    key_of = run_pipeline.natural_key_of("lab_tests")
+    lab_rows = {}
+    for lab_id, (slug, tests) in enumerate(all_tests.items(), 1):
+        for t in tests:
+            row = run_pipeline.lab_test_row(t, lab_id, linkage, cluster_to_ct_id, {})
+            lab_rows.setdefault(json.dumps(key_of(row)), row_hash(row))
+    return {
+        "canonical_tests": {row["slug"]: row["row_hash"] for row in canonical_rows},
+        "lab_tests": lab_rows,
+    }
+
+
+def run_child(data_dir: str, seed: str) -> dict:
+    env = dict(os.environ, PYTHONHASHSEED=seed, TQDM_DISABLE="1")
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", data_dir],
+        env=env, capture_output=True, text=True,
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    sys.exit(f"ERROR: PYTHONHASHSEED={seed} run failed:\n{proc.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=0.05, help="synthetic catalogue scale")
+    parser.add_argument("--seeds", default="1,2,3", help="comma-separated PYTHONHASHSEED values")
+    parser.add_argument("--child", metavar="DATA_DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(RESULT_PREFIX + json.dumps(build_hashes(args.child)))
+        return
+
+    from pipeline.synthetic import write_catalogue
+
+    seeds = args.seeds.split(",")
+    with tempfile.TemporaryDirectory(prefix="row_hashes_") as data_dir:
+        write_catalogue(data_dir, args.scale, 0)
+        results = {}
+        for seed in seeds:
+            results[seed] = run_child(data_dir, seed)
+            counts = ", ".join(f"{len(rows)} {table}" for table, rows in results[seed].items())
+            print(f"  PYTHONHASHSEED={seed}: {counts}")
+
+    ok = True
+    first = results[seeds[0]]
+    for seed in seeds[1:]:
+        for table, rows in first.items():
+            other = results[seed][table]
+            differing = sum(1 for k in rows.keys() | other.keys() if rows.get(k) != other.get(k))
+            passed = differing == 0
+            print(f"  [{'PASS' if passed else 'FAIL'}] {table} hashes equal under seeds {seeds[0]} and {seed}"
+                  + ("" if passed else f" ({differing} rows differ)"))
+            ok = ok and passed
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
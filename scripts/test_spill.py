@@ -0,0 +1,98 @@
+"""Test that --max-memory keeps the pipeline's peak resident size within the budget.
+
+Usage:
+    python scripts/test_spill.py [--scale 0.5] [--budget 300]
+
+Copies pipeline/ and scripts/ into a temp directory next to a synthetic
+catalogue (pipeline/synthetic.py), since the pipeline reads the lab CSVs
+from its repository root. Then runs the full pipeline into a local SQLite
+file twice, without and with --max-memory, each in its own process, and
+reads each process's peak RSS from the kernel. Checks that:
+- the budgeted run's peak stays within the budget
+- the budgeted run's peak is below the unbudgeted run's
+- both runs wrote the same lab_tests, price_heatmap and department_availability rows
+The budget must leave room for the interpreter and its imports (about
+90 MB) and for pyarrow once it writes a first batch (about 50 MB more). At
+the default 0.5x scale the unbudgeted run peaks near 500 MB and the
+budgeted one near 280 MB.
+"""
+import sys
+import os
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPARED_TABLES = ("lab_tests", "price_heatmap", "department_availability")
+
+
+def run_pipeline(root: str, name: str, budget_mb: float | None) -> tuple[float, str]:
+    """Run the pipeline copy in `root` into <name>.sqlite. Returns (peak RSS in MB, database path)."""
+    db_path = os.path.join(root, f"{name}.sqlite")
+    cmd = [
+        sys.executable, os.path.join(root, "scripts", "run_pipeline.py"),
+        "--sink", "sqlite", "--local-db", db_path, "--run-dir", os.path.join(root, "runs", name),
+    ]
+    if budget_mb:
+        cmd += ["--max-memory", str(budget_mb)]
+    log_path = os.path.join(root, f"{name}.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=dict(os.environ, TQDM_DISABLE="1"))
+        # wait4 rather than proc.wait(): it also returns the child's resource usage
+        _, status, usage = os.wait4(proc.pid, 0)
+    if os.waitstatus_to_exitcode(status) != 0:
+        with open(log_path, encoding="utf-8") as f:
+            sys.exit(f"ERROR: {name} run failed:\n{f.read()[-2000:]}")
+    # ru_maxrss is in KB on Linux
+    return usage.ru_maxrss / 1024, db_path
+
+
+def table_rows(db_path: str) -> dict:
+    conn = sqlite3.connect(db_path)
+    try:
+        return {table: conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in COMPARED_TABLES}
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=0.5, help="synthetic catalogue scale")
+    parser.add_argument("--budget", type=float, default=300, help="--max-memory budget in MB")
+    args = parser.parse_args()
+
+    from pipeline.synthetic import write_catalogue
+
+    ok = True
+
+    def check(passed: bool, label: str):
+        nonlocal ok
+        print(f"  [{'PASS' if passed else 'FAIL'}] {label}")
+        ok = ok and passed
+
+    with tempfile.TemporaryDirectory(prefix="spill_") as root:
+        for package in ("pipeline", "scripts"):
+            shutil.copytree(os.path.join(REPO_ROOT, package), os.path.join(root, package),
+                            ignore=shutil.ignore_patterns("__pycache__"))
+        write_catalogue(root, args.scale, 0)
+
+        unbudgeted_mb, unbudgeted_db = run_pipeline(root, "unbudgeted", None)
+        print(f"  without --max-memory: peak {unbudgeted_mb:.0f} MB")
+        budgeted_mb, budgeted_db = run_pipeline(root, "budgeted", args.budget)
+        print(f"  with --max-memory {args.budget:.0f}: peak {budgeted_mb:.0f} MB")
+
+        check(budgeted_mb <= args.budget, f"budgeted peak {budgeted_mb:.0f} MB within {args.budget:.0f} MB")
+        check(budgeted_mb < unbudgeted_mb,
+              f"budgeted peak {budgeted_mb:.0f} MB below unbudgeted {unbudgeted_mb:.0f} MB")
+        expected, got = table_rows(unbudgeted_db), table_rows(budgeted_db)
+        for table in COMPARED_TABLES:
+            check(got[table] == expected[table], f"{table}: {got[table]} rows, {expected[table]} without budget")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""Test the concurrent uploader locally against a PostgREST stand-in server.
+
+Starts a small threaded HTTP server that accepts PostgREST-style bulk POSTs
+(`/rest/v1/<table>`, `on_conflict`, `Prefer` headers), adds artificial
+latency, and checks that:
+- every row lands exactly once (upserts merge on the conflict columns)
+- a rejected row is isolated by bisection and quarantined
+- several requests are in flight at once
+- stages act as barriers (no lab_tests request starts before canonicals finish)
+- telemetry counts requests, rows, bytes, bisection retries and error classes
+- with injected 429/503 responses, every row still lands via backoff retries,
+  batches respect the byte budget, and the token bucket caps the request rate
+- streamed chunks from a bounded producer are all stored, acknowledged in
+  order, and the producer never runs more than the queue size ahead
+- a row with a bad value (400, SQLSTATE 22P02) is bisected out, while a
+  401 or a missing column (PGRST204) aborts the upload without bisecting
+"""
+import sys
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pipeline.uploader as uploader_module
+from pipeline.streaming import BackgroundIterator
+from pipeline.throttle import TokenBucket
+from pipeline.uploader import AsyncUploader, UploadAborted
+
+LATENCY_S = 0.02
+
+
+class StandInState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables: dict[str, dict] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests: list[tuple[str, float, float]] = []  # (table, start, end)
+        self.payload_sizes: list[int] = []
+        # Answer every nth request with 429 / 503 instead of processing it (0 = off)
+        self.throttle_every = 0
+        self.fail_every = 0
+        # Answer every request with this (status, PostgREST error code) (None = off)
+        self.reject_all = None
+        self.received = 0
+
+    def reset(self):
+        self.__init__()
+
+
+STATE = StandInState()
+
+
+class PostgRESTHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        start = time.perf_counter()
+        with STATE.lock:
+            STATE.in_flight += 1
+            STATE.max_in_flight = max(STATE.max_in_flight, STATE.in_flight)
+
+        url = urlparse(self.path)
+        table = url.path.rsplit("/", 1)[-1]
+        conflict = parse_qs(url.query).get("on_conflict", [None])[0]
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.loads(raw)
+        rows = body if isinstance(body, list) else [body]
+
+        time.sleep(LATENCY_S)
+
+        with STATE.lock:
+            STATE.received += 1
+            n = STATE.received
+            STATE.payload_sizes.append(len(raw))
+        injected = None
+        if STATE.throttle_every and n % STATE.throttle_every == 0:
+            injected = (429, {"Retry-After": "0"})
+        elif STATE.fail_every and n % STATE.fail_every == 0:
+            injected = (503, {})
+        if STATE.reject_all or any(row.get("price") == "n/a" for row in rows):
+            status, code = STATE.reject_all or (400, "22P02")
+            payload = json.dumps({"code": code, "message": "rejected"}).encode()
+            with STATE.lock:
+                STATE.in_flight -= 1
+                STATE.requests.append((table, start, time.perf_counter()))
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if injected:
+            with STATE.lock:
+                STATE.in_flight -= 1
+                STATE.requests.append((table, start, time.perf_counter()))
+            self.send_response(injected[0])
+            for k, v in injected[1].items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        status = 201
+        with STATE.lock:
+            store = STATE.tables.setdefault(table, {})
+            if conflict:
+                cols = conflict.split(",")
+                for row in rows:
+                    store[tuple(row.get(c) for c in cols)] = row
+            else:
+                # Plain insert: reject the whole batch on a duplicate, like Postgres
+                keys = [json.dumps(row, sort_keys=True) for row in rows]
+                if any(k in store for k in keys) or len(set(keys)) < len(keys):
+                    status = 409
+                else:
+                    for k, row in zip(keys, rows):
+                        store[k] = row
+            STATE.in_flight -= 1
+            STATE.requests.append((table, start, time.perf_counter()))
+
+        payload = b'{"code": "23505", "message": "duplicate key value violates unique constraint"}' if status == 409 else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_server() -> tuple[ThreadingHTTPServer, str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PostgRESTHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def check_flaky_server() -> bool:
+    """Wide rows against a server that throttles and fails some requests."""
+    STATE.reset()
+    STATE.throttle_every = 7
+    STATE.fail_every = 11
+    server, base_url = start_server()
+
+    rows = [{"lab_id": i % 5, "source_test_code": f"W{i}", "raw_data": "x" * 2000} for i in range(3000)]
+    budget = 64_000
+    rate = 200.0
+    uploader = AsyncUploader(
+        base_url, "test-key", concurrency=8, batch_size=500,
+        target_batch_bytes=budget, rate_limiter=TokenBucket(rate, burst=8),
+    )
+    # Keep the test fast: retry immediately instead of sleeping
+    uploader_module.backoff_delay = lambda attempt, retry_after=None: 0
+    start = time.perf_counter()
+    written = uploader.upload("lab_tests", rows, "lab_id,source_test_code")
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    stats = uploader.telemetry.tables["lab_tests"]
+    print(f"\n=== Flaky server ({elapsed:.2f}s) ===")
+    print(uploader.telemetry.report())
+    print(f"  Largest payload: {max(STATE.payload_sizes)} bytes, final budget {uploader.sizers['lab_tests'].budget:.0f}")
+
+    checks = [
+        ("every row stored despite 429/503", written == len(rows) and len(STATE.tables["lab_tests"]) == len(rows)),
+        ("throttled and failed requests retried", stats.retries == stats.errors["HTTP 429"] + stats.errors["HTTP 503"]),
+        ("payloads within the byte budget ceiling", max(STATE.payload_sizes) <= uploader.sizers["lab_tests"].max_bytes),
+        ("first batches sized by bytes, not rows", STATE.payload_sizes[0] <= budget),
+        ("token bucket caps the request rate", stats.requests <= 8 + rate * elapsed + 1),
+        ("no errors", not uploader.errors),
+    ]
+    ok = True
+    for name, passed in checks:
+        print(f"  [{'PASS' if passed else 'FAIL'}] {name}")
+        ok = ok and passed
+    return ok
+
+
+def check_streaming() -> bool:
+    """Chunks built on a producer thread while earlier chunks upload."""
+    STATE.reset()
+    server, base_url = start_server()
+
+    n_chunks, chunk_rows, queue_size, build_s = 20, 400, 2, 0.02
+    produced, acked = [], []
+    ahead = []
+
+    def chunks():
+        for c in range(n_chunks):
+            time.sleep(build_s)  # simulated row building
+            produced.append(time.perf_counter())
+            ahead.append(len(produced) - len(acked))
+            yield c, [{"lab_id": 1, "source_test_code": f"S{c}-{i}", "price": i} for i in range(chunk_rows)]
+
+    uploader = AsyncUploader(base_url, "test-key", concurrency=8, batch_size=100)
+    source = BackgroundIterator(chunks(), queue_size)
+    start = time.perf_counter()
+    try:
+        written = uploader.upload_chunks(
+            "lab_tests", source, "lab_id,source_test_code", on_chunk=lambda tag, n: acked.append(tag),
+        )
+    finally:
+        source.close()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    first_request = min(begin for _, begin, _ in STATE.requests)
+    print(f"\n=== Streaming ({elapsed:.2f}s; building {n_chunks * build_s:.2f}s) ===")
+    print(f"  Producer ran at most {max(ahead)} chunks ahead of the acknowledgements")
+
+    checks = [
+        ("every streamed row stored", written == n_chunks * chunk_rows
+         and len(STATE.tables["lab_tests"]) == n_chunks * chunk_rows),
+        ("chunks acknowledged in order", acked == list(range(n_chunks))),
+        # queued + in flight (2) + the one being handed over
+        ("producer bounded by the queue", max(ahead) <= queue_size + 3),
+        ("uploading starts before building ends", first_request < produced[-1]),
+        ("no errors", not uploader.errors),
+    ]
+    ok = True
+    for name, passed in checks:
+        print(f"  [{'PASS' if passed else 'FAIL'}] {name}")
+        ok = ok and passed
+    return ok
+
+
+def check_rejections() -> bool:
+    """Row-level rejections are bisected; auth and schema errors abort."""
+    rows = [{"lab_id": 1, "source_test_code": f"R{i}", "price": i} for i in range(2000)]
+    bad = [dict(row) for row in rows]
+    bad[777]["price"] = "n/a"
+
+    STATE.reset()
+    server, base_url = start_server()
+    uploader = AsyncUploader(base_url, "test-key", concurrency=4, batch_size=100)
+    written = uploader.upload("lab_tests", bad, "lab_id,source_test_code")
+    server.shutdown()
+    print("\n=== Rejections ===")
+    print(f"  Bad value: {written} written, {len(STATE.requests)} requests, {uploader.quarantine.counts()}")
+    checks = [
+        ("bad value bisected out and quarantined",
+         written == len(rows) - 1 and uploader.quarantine.counts() == {"lab_tests": 1}),
+    ]
+
+    for status, code in [(401, "PGRST301"), (400, "PGRST204"), (404, "PGRST205")]:
+        STATE.reset()
+        STATE.reject_all = (status, code)
+        server, base_url = start_server()
+        uploader = AsyncUploader(base_url, "test-key", concurrency=4, batch_size=100)
+        try:
+            uploader.upload("lab_tests", rows, "lab_id,source_test_code")
+            error = None
+        except UploadAborted as e:
+            error = str(e)
+        server.shutdown()
+        print(f"  {status} {code}: {len(STATE.requests)} requests; {error}")
+        checks += [
+            (f"{status} {code} aborts the upload", error is not None and code in error),
+            (f"{status} {code} is not bisected", len(STATE.requests) <= 4 and not uploader.quarantine.counts()),
+        ]
+
+    ok = True
+    for name, passed in checks:
+        print(f"  [{'PASS' if passed else 'FAIL'}] {name}")
+        ok = ok and passed
+    return ok
+
+
+def main():
+    server, base_url = start_server()
+    print(f"Stand-in PostgREST listening on {base_url}")
+
+    labs = [{"slug": f"lab-{i}", "name": f"Lab {i}"} for i in range(5)]
+    canonicals = [{"slug": f"test-{i}", "name": f"Test {i}"} for i in range(5_000)]
+    lab_tests = [{"lab_id": i % 5, "source_test_code": f"C{i}"} for i in range(20_000)]
+    # One duplicate row mid-batch to exercise the bisection
+    lab_tests.insert(250, dict(lab_tests[10]))
+
+    # Byte budget large enough that the 500-row cap decides batch sizes here
+    uploader = AsyncUploader(base_url, "test-key", concurrency=16, batch_size=500, target_batch_bytes=4_000_000)
+    start = time.perf_counter()
+    totals = uploader.upload_stages([
+        [("labs", labs, "slug")],
+        [("canonical_tests", canonicals, "slug")],
+        [("lab_tests", lab_tests, None)],
+    ])
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    print(f"\n=== Upload Summary ({elapsed:.2f}s) ===")
+    for table, count in totals.items():
+        print(f"  {table}: {count} rows written, {len(STATE.tables.get(table, {}))} stored")
+    print(f"  Max requests in flight: {STATE.max_in_flight}")
+
+    last_canonical_end = max(end for t, _, end in STATE.requests if t == "canonical_tests")
+    first_lab_test_start = min(start for t, start, _ in STATE.requests if t == "lab_tests")
+
+    lab_test_requests = sum(1 for t, _, _ in STATE.requests if t == "lab_tests")
+    batches = -(-len(lab_tests) // 500)
+    print(f"  lab_tests requests: {lab_test_requests} for {batches} batches")
+    print(uploader.quarantine.summary())
+    print(uploader.telemetry.report())
+    stats = uploader.telemetry.tables
+    prom = uploader.telemetry.prometheus_text()
+
+    ok = True
+    checks = [
+        ("all labs stored", len(STATE.tables["labs"]) == len(labs)),
+        ("all canonicals stored", len(STATE.tables["canonical_tests"]) == len(canonicals)),
+        ("duplicate lab_test skipped", len(STATE.tables["lab_tests"]) == len(lab_tests) - 1),
+        ("duplicate quarantined", uploader.quarantine.counts() == {"lab_tests": 1}),
+        ("bisection is O(log n)", lab_test_requests <= batches + 2 * 9),
+        ("requests overlapped", STATE.max_in_flight > 1),
+        ("stage barrier held", first_lab_test_start >= last_canonical_end),
+        ("no errors", not uploader.errors),
+        ("telemetry counts every request", sum(s.requests for s in stats.values()) == len(STATE.requests)),
+        ("telemetry counts acknowledged rows", stats["lab_tests"].rows == len(lab_tests) - 1),
+        ("telemetry records bisection retries", stats["lab_tests"].retries == lab_test_requests - batches),
+        ("telemetry classifies the rejection", "HTTP 409 23505" in stats["lab_tests"].errors),
+        ("prometheus histogram exported",
+         f'labcompare_upload_request_duration_seconds_count{{table="lab_tests"}} {lab_test_requests}' in prom),
+    ]
+    for name, passed in checks:
+        print(f"  [{'PASS' if passed else 'FAIL'}] {name}")
+        ok = ok and passed
+
+    ok = check_flaky_server() and ok
+    ok = check_streaming() and ok
+    ok = check_rejections() and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()